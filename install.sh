@@ -45,6 +45,12 @@ fi
 source env/bin/activate
 pip3 install -r requirements.txt
 
+# 4. Convert the data files
+echo -e "4. Converting the csv data files to parquet..."
+python3 -c "from proj_cappmait.helper import storage; storage.convert_folder()"
+echo -e "\t--Building the trade store..."
+python3 -c "from proj_cappmait.helper import storage, trade_store; trade_store.build_store(storage.DATA_PATH)"
+
 echo -e "Install is complete."
 
 deactivate
@@ -1,23 +1,48 @@
 import sys
 import warnings
 warnings.filterwarnings("ignore")
-from proj_cappmait.product import dashboard, analysis
+from proj_cappmait import config
+from proj_cappmait.product import dashboard, analysis, report
 from proj_cappmait.getdata import getready_data, imf_api, un_api
+from proj_cappmait.helper import health, storage, trade_store
 
 
 def run_dashboard():
     """
     Running dashboard
     """
-    app = dashboard.app
-    app.run_server(debug=False, port=50005)
+    serve_app("proj_cappmait.product.dashboard", dashboard.app, 50005)
 
 def run_analysis():
     """
     Running analysis
     """
-    app = analysis.app
-    app.run_server(debug=False, port=50050)
+    serve_app("proj_cappmait.product.analysis", analysis.app, 50050)
+
+def run_build_report():
+    """
+    Writing the analysis report as a static site
+    """
+    report.build_report()
+
+def serve_app(module_name, app, port):
+    """
+    Serve a Dash app with the Flask development server, or with gunicorn
+    workers when config.SERVER is "gunicorn" (the data loaded above is 
+    shared with the workers). Both answer /healthz.
+
+    Inputs:
+        module_name (str): module defining the app
+        app (Dash): the app
+        port (int): port to listen to
+    """
+    if config.SERVER == "gunicorn":
+        # gunicorn only runs on Unix, so it is imported when it is used
+        from proj_cappmait import serve
+        serve.run(module_name, port)
+    else:
+        health.add_health(app.server, module_name.rsplit(".", 1)[-1])
+        app.run_server(debug=False, host=config.HOST, port=port)
 
 def run_un_api():
     """
@@ -35,6 +60,8 @@ def run_imf_api():
 
     print ("Start to create dataset.")
     imf_api.create_export_import_data()
+    imf_api.create_mirror_data()
+    imf_api.create_monthly_data()
     print ("Dataset is ready.")
 
 def run_loadcsv():
@@ -43,6 +70,18 @@ def run_loadcsv():
     """
     getready_data.create_csv_data()
 
+def run_parquet():
+    """
+    Convert the csv files of the data folder to parquet files
+    """
+    storage.convert_folder()
+
+def run_store():
+    """
+    Build the trade store of the data folder
+    """
+    trade_store.build_store(storage.DATA_PATH)
+
 def run():
     """
     User type some arguments and we run a program
@@ -52,6 +91,7 @@ def run():
         """Please type 
             'dashboard' for dashboard, 
             'analysis' for analysis, 
+            'build-report' for a static copy of the analysis report,
             'getdata' for download new data
             'quit' or anything else for quit program.""")
     if user_input == 'dashboard':
@@ -60,6 +100,9 @@ def run():
     elif user_input == "analysis":
         print("running analysis...")
         run_analysis()
+    elif user_input == "build-report":
+        print("building report...")
+        run_build_report()
     elif user_input == 'getdata':
         getdata_user_input = input(
             """Please type 
@@ -67,6 +110,9 @@ def run():
                 'imfapi' for download imf api,
                 'loadcsv' for download and clean WTO trade products, 
                     OWID covid, World Bank econ data and Country code data, 
+                'parquet' for convert the csv files of the data folder to
+                    parquet files,
+                'store' for build the trade store of the data folder,
                 'quit' or anything else for quit program.""")
         if getdata_user_input == 'unapi':
             print("getting new data...")
@@ -77,6 +123,12 @@ def run():
         elif getdata_user_input == 'loadcsv':
             print("getting new data...")
             run_loadcsv()
+        elif getdata_user_input == 'parquet':
+            print("converting data...")
+            run_parquet()
+        elif getdata_user_input == 'store':
+            print("building trade store...")
+            run_store()
         else:
             sys.exit()
     else:
@@ -0,0 +1,90 @@
+'''
+Settings shared by the getdata and product modules.
+
+The year range can be changed with the CAPPMAIT_YEARS environment variable
+(e.g. CAPPMAIT_YEARS=2019-2021, or CAPPMAIT_YEARS=2020 for one year), and CAPPMAIT_INCREMENTAL=1 makes getdata
+fetch only the years that are not stored locally yet. CAPPMAIT_HS_LEVEL
+(2, 4 or 6) sets the HS depth of the UN Comtrade commodities.
+CAPPMAIT_SERVER=gunicorn serves the dashboard and the analysis with
+CAPPMAIT_WORKERS gunicorn worker processes, which share the data loaded
+in CAPPMAIT_SHARED (helper/shared_data.py) and cache the dashboard figures
+in CAPPMAIT_CACHE or CAPPMAIT_REDIS_URL. The static analysis report is
+built in CAPPMAIT_REPORT (product/report.py), and the compressed files of
+the apps are kept in CAPPMAIT_STATIC.
+'''
+import getpass
+import hashlib
+import os
+import re
+import tempfile
+
+
+def parse_years(text):
+    '''
+    Read a year range of CAPPMAIT_YEARS
+
+    Input:
+        text (str): one year (YYYY) or a range of years (YYYY-YYYY)
+
+    Output:
+        (tuple of int): the first and the last year
+    '''
+    match = re.fullmatch(r"(\d{4})(?:-(\d{4}))?", text.strip())
+    if match is None:
+        raise ValueError("CAPPMAIT_YEARS must be a year (2020) or a range " +
+                         f"of years (2019-2021), not {text!r}")
+    start, end = int(match.group(1)), int(match.group(2) or match.group(1))
+    if end < start:
+        raise ValueError(f"CAPPMAIT_YEARS ends before it starts: {text!r}")
+    return start, end
+
+
+START_YEAR, END_YEAR = parse_years(
+    os.environ.get("CAPPMAIT_YEARS", "2019-2020"))
+
+# Every year of the data
+YEARS = list(range(START_YEAR, END_YEAR + 1))
+
+# The years compared in the dashboard and the analysis (before/after)
+BASE_YEAR = max(START_YEAR, END_YEAR - 1)
+COMPARE_YEAR = END_YEAR
+
+INCREMENTAL = os.environ.get("CAPPMAIT_INCREMENTAL", "0") == "1"
+
+# Digits of the HS commodity codes of UN Comtrade (2: chapters, 6: products)
+HS_LEVEL = int(os.environ.get("CAPPMAIT_HS_LEVEL", "2"))
+if HS_LEVEL not in (2, 4, 6):
+    raise ValueError(f"CAPPMAIT_HS_LEVEL must be 2, 4 or 6, not {HS_LEVEL}")
+
+# "dev" for the Flask development server, "gunicorn" for worker processes
+SERVER = os.environ.get("CAPPMAIT_SERVER", "dev")
+WORKERS = int(os.environ.get("CAPPMAIT_WORKERS", 
+                             2 * (os.cpu_count() or 1) + 1))
+HOST = os.environ.get("CAPPMAIT_HOST", "127.0.0.1")
+
+# Folder of the data shared between processes, in memory when possible.
+# One folder per user and data folder, so two checkouts on a machine do not
+# replace each other's files
+SHARED_PATH = os.environ.get("CAPPMAIT_SHARED", os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+    "cappmait-" + (str(os.getuid()) if hasattr(os, "getuid") 
+                   else getpass.getuser()),
+    hashlib.sha1(os.path.abspath("proj_cappmait/data").encode())
+    .hexdigest()[:12], ""))
+
+# Results of the dashboard builders kept by each process
+MEMO_SIZE = int(os.environ.get("CAPPMAIT_MEMO_SIZE", "256"))
+
+# Cache of the dashboard results shared by the processes and kept across
+# restarts: a folder, or a Redis server when CAPPMAIT_REDIS_URL is set
+CACHE_PATH = os.environ.get("CAPPMAIT_CACHE", "proj_cappmait/data/cache/")
+REDIS_URL = os.environ.get("CAPPMAIT_REDIS_URL")
+
+# Compressed variants of the javascript, css and topojson files served by
+# the apps (helper/static_assets.py)
+STATIC_PATH = os.environ.get("CAPPMAIT_STATIC", "proj_cappmait/data/static/")
+
+# Folder of the static analysis report, and of the javascript libraries
+# downloaded once for it
+REPORT_PATH = os.environ.get("CAPPMAIT_REPORT", "proj_cappmait/data/report/")
+VENDOR_PATH = os.environ.get("CAPPMAIT_VENDOR", "proj_cappmait/data/vendor/")
@@ -2,149 +2,370 @@
 This module cleans following data.
     1) IMF trade partner
     2) Country code
-    3) OWID Covid
+    3) OWID Covid (selected years, and the month / quarter / year pyramid)
 '''
+import os
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+from proj_cappmait import config
+from proj_cappmait.getdata import partitions
+from proj_cappmait.helper import countries, storage, trade_cube
 
-def clean_imf():
-    '''
-    Clean IMF trading partners data and save it to csv.
-    1) Merge ISO3 country code
-    2) Drop missing rows
-    3) Select data that trade exists in both 2019 and 2020
-    '''
-    df = pd.read_csv(
-        ('proj_cappmait/data/data_from_prog/rawdata/' + 
-         'imf_import_export.csv')
-    )
-    country_code = pd.read_csv(
-        ("proj_cappmait/data/data_from_prog/rawdata/" + 
-        "countries_codes_and_coordinates.csv")
-    ).rename({'Country': 'Country_name'}, axis = 1)
+# Aggregation used to roll daily OWID rows up to a period
+OWID_AGG = {'total_cases': 'last', 'total_cases_per_million': 'last', 
+            'total_deaths': 'last', 'total_deaths_per_million': 'last',
+            'new_cases': 'sum', 'new_cases_per_million' : 'sum', 
+            'new_deaths': 'sum', 'new_deaths_per_million': 'sum',
+            'stringency_index': 'mean'}
 
-    df = df.iloc[: , 1:]
-    df = df.merge(
-        country_code, 
-        how ='right', 
-        left_on='from', 
-        right_on='Alpha-2code').drop(
-            ['Alpha-2code', 'from', 'Numericcode', 'Latitude(average)', 
-             'Longitude(average)'], 
-            axis = 1
-        )
-    df.rename(
-        columns={'Country_name':'from_name', 'Alpha-3code':'from_code'}, 
-        inplace = True)
-    df = df.merge(
-        country_code, 
-        how ='right', 
-        left_on='to', 
-        right_on='Alpha-2code').drop(
-            ['Alpha-2code','to','Numericcode', 'Latitude(average)', 
-             'Longitude(average)'], 
-            axis = 1
-        )
-    df.rename(
-        columns={'Country_name':'to_name', 'Alpha-3code':'to_code'}, 
-        inplace = True)
-
-    df = df.dropna()
-    df = df[(df["2019"] > 0.0) & df["2020"] > 0.0]
-
-    df.to_csv(
-        ("proj_cappmait/data/data_from_prog/cleandata/" + 
-         "imf_import_export_cleaned.csv"), 
-        index=False)
+# Column types of the daily and period OWID tables written by get_owid
+OWID_DTYPES = {'iso_code': 'str',
+               'total_cases': 'float64', 'total_cases_per_million': 'float32',
+               'total_deaths': 'float64', 'total_deaths_per_million': 'float32',
+               'new_cases': 'float64', 'new_cases_per_million': 'float32',
+               'new_deaths': 'float64', 'new_deaths_per_million': 'float32',
+               'stringency_index': 'float32'}
 
-def clean_countrycode():
-    '''
-    Clean country code data and save it to csv. 
-    1) Drop countries that do not appear in trade dataset
-    2) Drop countries that do not appear in product dataset
-    3) Drop duplicated country codes. 
-    '''
-    partners = pd.read_csv(
-        ("proj_cappmait/data/data_from_prog/cleandata/" + 
-         "imf_import_export_cleaned.csv"), 
-        dtype={"2019":"float", "2020":"float"}
-    )
-    product = pd.read_csv(
-        ("proj_cappmait/data/data_from_prog/rawdata/" + 
-         "merchandise_values_annual_dataset.csv"), 
-        dtype={"Value":"int", "Year":"category"}
-    )
-    df = pd.read_csv(
-        ("proj_cappmait/data/data_from_prog/rawdata/" + 
-        "countries_codes_and_coordinates.csv")
-    )
-
-    df = df.merge(partners["from_code"], 
-        left_on='Alpha-3code', 
-        right_on='from_code', 
-        how='right').drop('from_code', axis=1)
-    df = df.drop_duplicates().reset_index(drop=True)
-    df = df.merge(product["ReporterISO3A"], 
-        left_on='Alpha-3code', 
-        right_on='ReporterISO3A', 
-        how='inner').drop('ReporterISO3A', axis=1)
-    df = df.drop_duplicates().reset_index(drop=True)
-    df = df.sort_values("Alpha-3code")
-
-    df.to_csv(
-        ("proj_cappmait/data/data_from_prog/cleandata/" +
-         "countries_codes_and_coordinates_cleaned.csv"), 
-        index=False)
-
-def clean_owid():
+# Averaged OWID columns, kept as sum and count until the end of aggregation
+OWID_MEAN = [col for col, how in OWID_AGG.items() if how == 'mean']
+
+# Resolutions of the OWID pyramid and their pandas period frequency
+OWID_RESOLUTIONS = {'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+
+# Ratio of imports c.i.f. to exports f.o.b. used by the IMF DOTS to
+# estimate a missing export from the mirror import
+CIF_FOB = 1.1
+# Relative gap between an export and its mirror flagged as a discrepancy
+DISCREPANCY = 0.5
+
+
+def aggregate_owid(owid_covid):
     '''
-    Clean OWID Covid data and save it to csv.
-    1) Aggregate to quarterly and yearly data.
-    2) Merge country name
-    3) Drop irrelevant columns
-    4) Replace missing values with 0 
-    5) Select data in 2020
-    '''
-    owid_covid = pd.read_csv(
-        "proj_cappmait/data/data_from_prog/rawdata/owid_covid_data.csv"
-    ) 
-    country_code = pd.read_csv(
-        ("proj_cappmait/data/data_from_prog/cleandata/" +
-         "countries_codes_and_coordinates_cleaned.csv")
-    ).rename({'Country': 'Country_name'}, axis = 1)
+    Aggregate daily OWID Covid rows to quarterly and yearly data.
 
+    Input:
+        owid_covid (DataFrame): daily rows with iso_code, date and the
+            columns of OWID_AGG, sorted by date within each country
+
+    Output:
+        (DataFrame): one row per iso_code and period
+    '''
     owid_covid['date'] = pd.to_datetime(owid_covid['date'])
     owid_covid['year'] = owid_covid['date'].dt.year
     owid_covid['quarter'] = owid_covid['date'].dt.to_period('Q')
 
-    agg = {'total_cases': 'last', 'total_cases_per_million': 'last', 
-           'total_deaths': 'last', 'total_deaths_per_million': 'last',
-           'new_cases': 'sum', 'new_cases_per_million' : 'sum', 
-           'new_deaths': 'sum', 'new_deaths_per_million': 'sum',
-           'stringency_index': 'mean'}
     owid_covid_quarter = (owid_covid.groupby(['iso_code', 'quarter'])
-                        .agg(agg).reset_index()
+                        .agg(OWID_AGG).reset_index()
                         ).rename(columns={'quarter':'period'})
     owid_covid_year = (owid_covid.groupby(['iso_code', 'year'])
-                      .agg(agg).reset_index()).rename(columns={'year':'period'})
+                      .agg(OWID_AGG).reset_index()
+                      ).rename(columns={'year':'period'})
     owid_covid_grouped = pd.concat(
         [owid_covid_quarter, owid_covid_year], ignore_index=True, sort=False)
     owid_covid_grouped["period"] = owid_covid_grouped["period"].astype(str)
-    owid_covid_grouped = owid_covid_grouped.sort_values(
-        by=["iso_code", "period"])
 
-    owid_covid_grouped = owid_covid_grouped.merge(
-        country_code, left_on="iso_code", right_on="Alpha-3code", how="inner")
-    owid_covid_grouped = owid_covid_grouped[
-        ["iso_code", "Country_name", "period", "total_cases", 
+    return owid_covid_grouped
+
+
+def owid_partials(owid_covid, keys):
+    '''
+    Aggregate OWID rows to partial aggregates that can be combined again:
+    sums and non missing counts for the averaged columns, sums for the
+    summed columns and last values for the others.
+
+    Inputs:
+        owid_covid (DataFrame): daily rows or partial aggregates, in date
+            order within each country
+        keys (list of str): columns to group by
+
+    Output:
+        (DataFrame): one row per group
+    '''
+    grouped = owid_covid.groupby(keys, sort=False)
+    partials = grouped.agg({col: "last" if how == "last" else "sum" 
+                            for col, how in OWID_AGG.items()})
+    for col in OWID_MEAN:
+        count = col + "_count"
+        partials[count] = (grouped[count].sum() if count in owid_covid 
+                           else grouped[col].count())
+    return partials.reset_index()
+
+
+def clean_owid_pyramid(batch_size = 200000):
+    '''
+    Clean OWID Covid data into a pyramid of monthly, quarterly and yearly
+    data for every available period, and save it to csv.
+    The daily data are read in batches and aggregated to months in one
+    pass; quarters and years are rolled up from the months.
+    Countries are the ones of the cleaned country code data, and missing
+    values are replaced with 0 as in clean_owid.
+
+    Input:
+        batch_size (int): number of daily rows read at once
+    '''
+    daily_path = ("proj_cappmait/data/data_from_prog/rawdata/" + 
+                  "owid_covid_data.parquet")
+    country_code = storage.read_clean(
+        "countries_codes_and_coordinates_cleaned", storage.CLEAN_PATH, 
+        columns=["country_id"])
+    dim = countries.load_dimension(storage.CLEAN_PATH)
+
+    partials = []
+    daily_file = pq.ParquetFile(daily_path)
+    for batch in daily_file.iter_batches(
+        batch_size, columns=["iso_code", "date"] + list(OWID_AGG)):
+        daily = batch.to_pandas()
+        daily["period"] = pd.to_datetime(daily.pop("date")).dt.to_period("M")
+        partials.append(owid_partials(daily, ["iso_code", "period"]))
+    # A country can be split between two batches
+    months = owid_partials(pd.concat(partials, ignore_index=True), 
+                           ["iso_code", "period"])
+
+    levels = []
+    for resolution, freq in OWID_RESOLUTIONS.items():
+        level = months.assign(period=months["period"].dt.asfreq(freq))
+        level = owid_partials(level, ["iso_code", "period"])
+        for col in OWID_MEAN:
+            level[col] = level[col] / level.pop(col + "_count")
+        level["period"] = level["period"].astype(str)
+        level.insert(1, "resolution", resolution)
+        levels.append(level)
+
+    pyramid = pd.concat(levels, ignore_index=True).sort_values(
+        by=["iso_code", "resolution", "period"], kind="stable")
+    pyramid = owid_countries(pyramid, dim, country_code["country_id"], 
+                             ["resolution"])
+    storage.write_clean(pyramid, "owid_covid_pyramid")
+
+
+def owid_countries(owid_covid, dim, country_ids, extra = ()):
+    '''
+    Keep the OWID rows of the given countries, add the country name and
+    key, select the dashboard columns and replace missing values with 0
+
+    Inputs:
+        owid_covid (DataFrame): OWID periods with iso_code and period
+        dim (DataFrame): the country dimension table
+        country_ids (Series): keys of the countries to keep
+        extra (list of str): other columns to keep, after iso_code
+
+    Output:
+        (DataFrame): the cleaned rows
+    '''
+    owid_covid = countries.attach_country_id(owid_covid, "iso_code", dim)
+    owid_covid = owid_covid[owid_covid["country_id"].isin(country_ids)]
+    owid_covid = owid_covid.assign(
+        Country_name=countries.lookup(dim, "name")[
+            owid_covid["country_id"].to_numpy("int64")])
+    owid_covid = owid_covid[
+        ["iso_code", "Country_name", *extra, "period", "total_cases", 
          "total_cases_per_million", "total_deaths", "total_deaths_per_million", 
          "new_cases", "new_cases_per_million", "new_deaths", 
-         "new_deaths_per_million", "stringency_index"]
+         "new_deaths_per_million", "stringency_index", "country_id"]
     ]
-    owid_covid_grouped = owid_covid_grouped.fillna(0)
+    return owid_covid.fillna(0)
+
+
+def read_imf_raw(path, dim):
+    '''
+    Read a raw IMF trading partners file and attach the country keys
+
+    Inputs:
+        path (str): path of the file
+        dim (DataFrame): the country dimension table
+
+    Output:
+        (DataFrame): from, to, one column per year, from_id and to_id
+    '''
+    df = pd.read_csv(path, keep_default_na=False, na_values=[''])
+    df = df.iloc[: , 1:]
+    df = countries.attach_country_id(df, "from", dim, "imf", "from_id")
+    return countries.attach_country_id(df, "to", dim, "imf", "to_id")
+
+
+def reconcile_mirror(exports, imports, cif_fob = CIF_FOB, 
+                     threshold = DISCREPANCY):
+    '''
+    Align the exports reported by the exporters with the mirror imports 
+    reported by the importers, for every pair and year at once. A missing 
+    or zero export is filled with its mirror import converted to f.o.b.
+
+    Inputs:
+        exports (DataFrame): the exports, with from_id, to_id and one 
+            column per year
+        imports (DataFrame): the mirror imports, with the same columns
+        cif_fob (float): ratio of imports c.i.f. to exports f.o.b.
+        threshold (float): relative gap between an export and its mirror 
+            flagged as a discrepancy
+
+    Output:
+        (DataFrame): the pairs of both datasets, with the filled years, 
+            mirror_filled (number of years filled from the mirror) and 
+            discrepancy (True if both sides report the flow and differ by 
+            more than threshold in a year)
+    '''
+    keys = ["from_id", "to_id"]
+    years = [col for col in exports.columns if col.isdigit()]
+    mirror_years = [col for col in years if col in imports.columns]
+    pairs = exports.merge(imports[keys + mirror_years], how="outer", 
+                          on=keys, suffixes=("", "_mirror"))
+
+    reported = pairs[years].to_numpy(dtype="float64")
+    # Years without mirror data are all missing
+    mirror = pairs.reindex(columns=[col + "_mirror" for col in years]
+                           ).to_numpy(dtype="float64") / cif_fob
+    has_export = reported > 0
+    has_mirror = mirror > 0
+    filled = ~has_export & has_mirror
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gap = np.abs(reported / mirror - 1)
+
+    pairs[years] = np.where(filled, mirror.round(1), reported)
+    pairs["mirror_filled"] = filled.sum(axis=1).astype("int8")
+    pairs["discrepancy"] = (has_export & has_mirror & 
+                            (gap > threshold)).any(axis=1)
+    return pairs.drop(columns=[col + "_mirror" for col in mirror_years])
+
+
+def clean_imf(cif_fob = CIF_FOB):
+    '''
+    Clean IMF trading partners data and save it to csv.
+    1) Attach the country keys and ISO3 country code
+    2) Fill the missing exports from the mirror imports, when they were 
+       downloaded (imf_api.create_mirror_data)
+    3) Drop missing rows
+    4) Select data that trade exists in both compared years 
+       (config.BASE_YEAR and config.COMPARE_YEAR)
+
+    Input:
+        cif_fob (float): ratio of imports c.i.f. to exports f.o.b.
+    '''
+    compared = [str(config.BASE_YEAR), str(config.COMPARE_YEAR)]
+    raw = 'proj_cappmait/data/data_from_prog/rawdata/'
+    dim = countries.load_dimension(storage.CLEAN_PATH)
+
+    df = read_imf_raw(raw + 'imf_import_export.csv', dim)
+    if os.path.exists(raw + 'imf_imports.csv'):
+        df = reconcile_mirror(df, read_imf_raw(raw + 'imf_imports.csv', dim),
+                              cif_fob)
+    df = df.sort_values(["to_id", "from_id"], kind="stable")
+    names = countries.lookup(dim, "name")
+    codes = countries.lookup(dim, "iso3")
+    from_ids = df["from_id"].to_numpy("int64")
+    to_ids = df["to_id"].to_numpy("int64")
+    df = df.assign(from_name=names[from_ids], from_code=codes[from_ids],
+                   to_name=names[to_ids], to_code=codes[to_ids])
+    df = df.drop(["from", "to"], axis=1)
+    df = df[[col for col in df.columns if col.isdigit()] + 
+            ["from_name", "from_code", "to_name", "to_code", 
+             "from_id", "to_id"] + 
+            [col for col in ["mirror_filled", "discrepancy"] 
+             if col in df.columns]]
+
+    df = df.dropna(subset=compared)
+    df = df[(df[compared] > 0.0).all(axis=1)]
+
+    storage.write_clean(df, "imf_import_export_cleaned")
+
+def clean_imf_monthly():
+    '''
+    Build the array of the monthly IMF trading partners data and save it
+    (helper/trade_cube.py). Nothing is done when the monthly data was not
+    downloaded.
+    '''
+    path = 'proj_cappmait/data/data_from_prog/rawdata/imf_monthly.csv'
+    if not os.path.exists(path):
+        print("No monthly IMF data, skipping.")
+        return
+    flows = pd.read_csv(path, dtype={'from': 'str', 'to': 'str'},
+                        keep_default_na=False, na_values=[''])
+    dim = countries.load_dimension(storage.CLEAN_PATH)
+    months, values = trade_cube.build_cube(flows, dim)
+    trade_cube.write_cube(months, values)
+
+def clean_countrycode():
+    '''
+    Clean country code data and save it to csv. 
+    1) Drop countries that do not appear in trade dataset
+    2) Drop countries that do not appear in product dataset
+    '''
+    partners = storage.read_clean(
+        "imf_import_export_cleaned", storage.CLEAN_PATH, 
+        columns=["from_id"])
+    product = storage.read_clean(
+        "merchandise_values_annual_dataset", storage.RAW_PATH, 
+        columns=["ReporterISO3A"], categorical=False)
+    dim = countries.load_dimension(storage.CLEAN_PATH)
+
+    # Deduplicate the keys before matching them
+    product = countries.attach_country_id(
+        product.drop_duplicates(), "ReporterISO3A", dim)
+    kept = np.intersect1d(partners["from_id"].to_numpy("int64"), 
+                          product["country_id"].to_numpy("int64"))
+    df = dim[dim["country_id"].isin(kept)]
+    df = pd.DataFrame({
+        "Country": df["name"], "Alpha-2code": df["iso2"], 
+        "Alpha-3code": df["iso3"], "Numericcode": df["numeric"], 
+        "Latitude(average)": df["latitude"], 
+        "Longitude(average)": df["longitude"], 
+        "country_id": df["country_id"]})
+    df = df.sort_values("Alpha-3code").reset_index(drop=True)
+
+    storage.write_clean(df, "countries_codes_and_coordinates_cleaned")
+
+def clean_owid(years = None, incremental = None):
+    '''
+    Clean OWID Covid data and save it to csv.
+    1) Aggregate to quarterly and yearly data.
+    2) Select data in the given years
+    3) Merge country name
+    4) Drop irrelevant columns
+    5) Replace missing values with 0 
+    Each year is kept as a partition, so an incremental run only cleans 
+    the years that are not stored yet.
+
+    Inputs:
+        years (list of int): years to keep. Default is config.YEARS
+        incremental (bool): if True, skip the years already cleaned.
+            Default is config.INCREMENTAL
+    '''
+    years = config.YEARS if years is None else years
+    incremental = config.INCREMENTAL if incremental is None else incremental
+    clean_years = partitions.years_to_fetch("owid", years, incremental)
+    periods_path = ("proj_cappmait/data/data_from_prog/rawdata/" + 
+                    "owid_covid_data_periods.csv")
+    country_code = storage.read_clean(
+        "countries_codes_and_coordinates_cleaned", storage.CLEAN_PATH, 
+        columns=["country_id"])
+    dim = countries.load_dimension(storage.CLEAN_PATH)
+
+    if os.path.exists(periods_path):
+        # Periods are aggregated while streaming the download
+        owid_covid_grouped = pd.read_csv(
+            periods_path, dtype=dict(OWID_DTYPES, period="str"))
+    else:
+        owid_covid = pd.read_parquet(
+            "proj_cappmait/data/data_from_prog/rawdata/owid_covid_data.parquet",
+            columns=["iso_code", "date"] + list(OWID_AGG))
+        owid_covid_grouped = aggregate_owid(owid_covid)
+
     owid_covid_grouped = owid_covid_grouped[
-        owid_covid_grouped["period"].str.contains("2020")]
+        owid_covid_grouped["period"].str[:4].isin(
+            [str(year) for year in clean_years])]
+    owid_covid_grouped = owid_covid_grouped.sort_values(
+        by=["iso_code", "period"])
 
-    owid_covid_grouped.to_csv(
-        ("proj_cappmait/data/data_from_prog/cleandata/" + 
-         "owid_covid_data_cleaned.csv"),
-        index=False)
+    owid_covid_grouped = owid_countries(
+        owid_covid_grouped, dim, country_code["country_id"])
+    for year in clean_years:
+        partitions.write_partition(
+            "owid", year, 
+            owid_covid_grouped[owid_covid_grouped["period"].str[:4] == 
+                               str(year)])
+
+    owid_covid_grouped = pd.concat(
+        partitions.read_partitions(
+            "owid", years, dtype={"period": "str", "country_id": "int16"}), 
+        ignore_index=True)
+    storage.write_clean(owid_covid_grouped, "owid_covid_data_cleaned")
@@ -6,46 +6,152 @@ Data Sources:
     World Bank econ data
     Country code data
 '''
-import time
+import codecs
+import json
+import re
 from zipfile import ZipFile
 from io import BytesIO
-import requests
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import wbgapi as wb
+from proj_cappmait import config
+from proj_cappmait.getdata import fetch, partitions
+from proj_cappmait.getdata.clean_data import (OWID_AGG, OWID_DTYPES, 
+                                              aggregate_owid)
+from proj_cappmait.helper import storage
+
+# Characters that change the nesting or string state of a JSON text
+JSON_TOKEN = re.compile(r'[{}\[\]"\\]')
 
 # Helper function
-def get_json(url, params = None):
+def iter_text(url, chunk_size = 1 << 20):
     """
-    Get JSON from the website
-    
+    Stream the body of the website as text chunks
+
     Inputs:
         url (str): url
-        params (dict): parameters following url. Default value is None
-    
+        chunk_size (int): number of bytes read per chunk
+
     Output:
-        (dict): the JSON data in terms of Python dict
+        (generator of str): decoded text chunks
     """
 
-    resp = requests.get(url, params = params)
-    time.sleep(5)
-    if resp.status_code == 200:    
-        return resp.json()
+    resp = fetch.get(url, stream = True)
     if resp.status_code == 409:
         # if encounter this error, wait for 1 hr as complying to the API 
         # provider rule
-        time.sleep(3600)
-        return get_json(url, params)
-    return []
+        resp.close()
+        fetch.wait_rate_limit()
+        yield from iter_text(url, chunk_size)
+        return
+    resp.raise_for_status()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in resp.iter_content(chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final = True)
+    fetch.pause()
+
+
+def _scan_value(buf, state):
+    '''
+    Continue scanning a JSON value until its closing bracket.
+
+    Inputs:
+        buf (str): text holding the value from index 0
+        state (list): [position, depth, in_string], updated in place so
+            scanning can resume after more text is appended to buf
+
+    Output:
+        (int): index just past the value, or -1 if buf ends before it
+    '''
+    pos, depth, in_string = state
+    for match in JSON_TOKEN.finditer(buf, pos):
+        if match.start() < pos:
+            # Character escaped by the previous backslash
+            continue
+        char = match.group()
+        pos = match.end()
+        if in_string:
+            if char == "\\":
+                pos += 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return pos
+    # Plain text up to the end of buf holds no tokens, and a trailing
+    # backslash leaves pos one past the end to skip the escaped character
+    state[:] = [max(pos, len(buf)), depth, in_string]
+    return -1
+
+
+def iter_json_members(chunks):
+    '''
+    Walk the members of a top-level JSON object one at a time, so only
+    one member is held in memory instead of the whole document.
+    Member values must be objects or arrays.
+
+    Input:
+        chunks (iterable of str): the JSON text in pieces
+
+    Output:
+        (generator of tuple): (key, parsed value) for each member
+    '''
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ""
+    opened = False
+    while True:
+        buf = buf.lstrip(" \t\r\n,:")
+        if not opened and buf:
+            buf = buf[buf.index("{") + 1:]
+            opened = True
+            continue
+        if buf.startswith("}"):
+            return
+        try:
+            key, end = decoder.raw_decode(buf)
+            value_start = buf.index(":", end) + 1
+            while buf[value_start] in " \t\r\n":
+                value_start += 1
+        except (ValueError, IndexError):
+            # Key or the start of its value is not complete yet
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            buf += chunk
+            continue
+
+        buf = buf[value_start:]
+        state = [0, 0, False]
+        end = _scan_value(buf, state)
+        while end < 0:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError(f"Truncated JSON in member {key}")
+            buf += chunk
+            end = _scan_value(buf, state)
+
+        yield key, json.loads(buf[:end])
+        buf = buf[end:]
 
 
 # Download COVID our world in data
-def owid_csv(data, path):
+def owid_csv(data, name, folder):
     '''
     Take OWID data in list of dicts format and create a csv file
+    and its parquet copy
 
     Input:
         data (list of dicts): A list of dict
-        path (str): A csv path
+        name (str): name of the dataset
+        folder (str): folder of the files
     '''
 
     df = pd.DataFrame(data)
@@ -54,89 +160,180 @@ def owid_csv(data, path):
     col = df.pop("iso_code")
     df.insert(0, "iso_code", col)
 
-    df.to_csv(path, index = False)
+    storage.write_clean(df, name, folder)
+
+def owid_daily(country_code, days):
+    '''
+    Build the typed daily table of one country, keeping only the columns
+    used by clean_data.clean_owid
+
+    Inputs:
+        country_code (str): OWID iso code
+        days (list of dicts): the "data" list of the country
+
+    Output:
+        (DataFrame): iso_code, date and the columns of OWID_AGG
+    '''
+    df = pd.DataFrame(days, columns = ["date"] + list(OWID_AGG))
+    df = df.astype({col: OWID_DTYPES[col] for col in OWID_AGG})
+    df.insert(0, "iso_code", country_code)
+
+    return df
 
 def get_owid():
     '''
     Gathering COVID-19 data from Our World in Data and making them into
-    csv files
+    csv files.
+    The JSON is streamed country by country. Daily rows are appended to a
+    parquet file one row group per country, and quarterly / yearly
+    aggregates are computed for each country as it is read.
     '''
     url = "https://covid.ourworldindata.org/data/owid-covid-data.json"
-    owid_json = get_json(url)
+    path = "proj_cappmait/data/data_from_prog/rawdata/"
+    schema = pa.schema(
+        [("iso_code", pa.string()), ("date", pa.string())] + 
+        [(col, pa.from_numpy_dtype(OWID_DTYPES[col])) for col in OWID_AGG])
     country_infos = []
-    covid_data = []
-
-    for country_code, rows in owid_json.items():
-        country_info = {}
-        country_info["iso_code"] = country_code
-        for col, val in rows.items():
-            if col != "data":
-                country_info[col] = val
-            else:
-                for day in val:
-                    day["iso_code"] = country_code
-                    covid_data.append(day)
-        country_infos.append(country_info)
-
-    owid_csv(
-        country_infos, 
-        "proj_cappmait/data/data_from_prog/rawdata/owid_country_info.csv"
-    )
-    owid_csv(
-        covid_data, 
-        "proj_cappmait/data/data_from_prog/rawdata/owid_covid_data.csv"
-    )
+    periods = []
+
+    with pq.ParquetWriter(path + "owid_covid_data.parquet", schema) as writer:
+        for country_code, rows in iter_json_members(iter_text(url)):
+            days = rows.pop("data", [])
+            country_info = {"iso_code": country_code}
+            country_info.update(rows)
+            country_infos.append(country_info)
+
+            daily = owid_daily(country_code, days)
+            writer.write_table(
+                pa.Table.from_pandas(daily, schema, preserve_index = False))
+            periods.append(aggregate_owid(daily))
+
+    owid_csv(country_infos, "owid_country_info", path)
+    pd.concat(periods, ignore_index = True).to_csv(
+        path + "owid_covid_data_periods.csv", index = False)
 
 
 # Download WTO trade product data
-def get_wto():
+WTO_COLUMNS = ["Indicator", "ReporterCode", "ReporterISO3A", "Reporter", 
+               "ProductCode", "Product", "Year", "Value"]
+WTO_DTYPES = {"Indicator": "category", "ReporterCode": "str", 
+              "ReporterISO3A": "str", "Reporter": "str", 
+              "ProductCode": "category", "Product": "category", 
+              "Partner": "category", "Year": "int16", "Value": "str"}
+
+def wto_indicator(indicator):
+    '''
+    Shorten a WTO indicator name to Import or Export
+
+    Input:
+        indicator (str): a WTO indicator name
+
+    Output:
+        (str): Import, Export or the name itself
+    '''
+    if re.search(r'.+imports.+', indicator):
+        return "Import"
+    if re.search(r'.+exports.+', indicator):
+        return "Export"
+    return indicator
+
+def download_file(url, path, chunk_size = 1 << 20):
+    '''
+    Stream a file from the website to the local disk
+
+    Inputs:
+        url (str): url
+        path (str): a local path
+        chunk_size (int): number of bytes written per chunk
+    '''
+    with fetch.get(url, stream = True) as resp:
+        resp.raise_for_status()
+        with open(path, "wb") as f:
+            for chunk in resp.iter_content(chunk_size):
+                f.write(chunk)
+
+def get_wto(years = None, incremental = None, chunksize = 200000):
     '''
     Download zip data from WTO websit and extract product details of 
-    2019 and 2020 of total imports and exports in each country.
-    Save it to csv. 
-    '''
-
-    r = requests.get("http://stats.wto.org/assets/UserGuide/" + 
-                     "merchandise_values_annual_dataset.zip")
-    file = ZipFile(BytesIO(r.content))
-    df = pd.read_csv(file.open("merchandise_values_annual_dataset.csv"), \
-         encoding = "ISO-8859-1", dtype="object")
- 
-    df = df[(df["Year"]=="2019") | (df["Year"]=="2020")]
-    df = df[df["Partner"]=="World"]
-    df = df[["Indicator", "ReporterCode", "ReporterISO3A", \
-        "Reporter", "ProductCode", "Product","Year", "Value"]]
-    df["Indicator"].replace(
-        regex={r'.+imports.+': 'Import', r'.+exports.+': 'Export'}, 
-        inplace=True)
+    the given years of total imports and exports in each country.
+    The zip is saved to disk and its csv is read in typed chunks, keeping
+    only the rows of the years against the World. Each year is kept as
+    a partition. Save it to csv. 
 
-    df.to_csv(
-        ("proj_cappmait/data/data_from_prog/rawdata/" + 
-         "merchandise_values_annual_dataset.csv"), 
-        index=False
-    )
+    Inputs:
+        years (list of int): years to keep. Default is config.YEARS
+        incremental (bool): if True, skip the years already stored.
+            Default is config.INCREMENTAL
+        chunksize (int): number of rows read per chunk
+    '''
+    years = config.YEARS if years is None else years
+    incremental = config.INCREMENTAL if incremental is None else incremental
+    fetch_years = partitions.years_to_fetch("wto", years, incremental)
+    path = "proj_cappmait/data/data_from_prog/rawdata/"
+
+    if fetch_years:
+        zip_path = path + "merchandise_values_annual_dataset.zip"
+        download_file(("http://stats.wto.org/assets/UserGuide/" + 
+                       "merchandise_values_annual_dataset.zip"), zip_path)
+
+        chunks = []
+        with ZipFile(zip_path) as file:
+            reader = pd.read_csv(
+                file.open("merchandise_values_annual_dataset.csv"), 
+                encoding = "ISO-8859-1", usecols = WTO_COLUMNS + ["Partner"], 
+                dtype = WTO_DTYPES, chunksize = chunksize)
+            for chunk in reader:
+                chunk = chunk[chunk["Year"].isin(fetch_years) & 
+                              (chunk["Partner"] == "World")]
+                # Mapping a categorical only visits its distinct names
+                chunk["Indicator"] = chunk["Indicator"].map(wto_indicator)
+                chunks.append(chunk[WTO_COLUMNS])
+
+        df = pd.concat(chunks, ignore_index = True)
+        for year in fetch_years:
+            partitions.write_partition("wto", year, df[df["Year"] == year])
+
+    df = pd.concat(partitions.read_partitions("wto", years, dtype = "str"), 
+                   ignore_index = True)
+    storage.write_clean(df, "merchandise_values_annual_dataset", path)
     
 
 # Download World Bank data
-def get_wb():
+def get_wb(years = None, incremental = None):
     '''
     Download World Bank data, which are real gdp, nominal gdp, 
     inflation, tariff, exchange rate and total labor.
-    Save it to csv.
+    Each year is kept as a partition. Save it to csv.
+
+    Inputs:
+        years (list of int): years to download. Default is config.YEARS
+        incremental (bool): if True, skip the years already stored.
+            Default is config.INCREMENTAL
     '''
-    inds = ['NY.GDP.MKTP.CD', 'NY.GDP.MKTP.KD', 'FP.CPI.TOTL.ZG', 
-            'TM.TAX.MRCH.SM.AR.ZS', 'PA.NUS.FCRF', 'SL.TLF.TOTL.IN']
-    wb_data = wb.data.DataFrame(inds, time=[2019, 2020]).reset_index()
-    wb_data = wb_data.melt(['economy', 'series'])
-    wb_data = wb_data.pivot(['economy', 'variable'], 'series').reset_index()
-    wb_data.columns = ['country_code', 'time_code', 'inflation', 
-                       'nominal_gdp', 'real_gdp', 'exchange_rate', 
-                       'labor_force', 'tariff']
-    wb_data['time'] = wb_data['time_code'].str[2:]
-    wb_data.to_csv(
-        "proj_cappmait/data/data_from_prog/rawdata/world-bank-econ-data.csv", 
-        index=False
-    )
+    years = config.YEARS if years is None else years
+    incremental = config.INCREMENTAL if incremental is None else incremental
+    fetch_years = partitions.years_to_fetch("wb", years, incremental)
+
+    if fetch_years:
+        inds = ['NY.GDP.MKTP.CD', 'NY.GDP.MKTP.KD', 'FP.CPI.TOTL.ZG', 
+                'TM.TAX.MRCH.SM.AR.ZS', 'PA.NUS.FCRF', 'SL.TLF.TOTL.IN']
+        wb.endpoint = fetch.route("https://api.worldbank.org/v2")
+        wb_data = wb.data.DataFrame(inds, time=fetch_years, 
+                                    index=['economy', 'series'], 
+                                    columns='time').reset_index()
+        wb_data = wb_data.melt(['economy', 'series'])
+        wb_data = wb_data.pivot(['economy', 'variable'], 'series').reset_index()
+        wb_data.columns = ['country_code', 'time_code', 'inflation', 
+                           'nominal_gdp', 'real_gdp', 'exchange_rate', 
+                           'labor_force', 'tariff']
+        wb_data['time'] = wb_data['time_code'].str[2:]
+        for year in fetch_years:
+            partitions.write_partition(
+                "wb", year, wb_data[wb_data['time'] == str(year)])
+
+    wb_data = pd.concat(partitions.read_partitions("wb", years), 
+                        ignore_index=True)
+    storage.write_clean(wb_data, "world-bank-econ-data", storage.RAW_PATH)
 
 
 # Download Country code data
@@ -150,7 +347,7 @@ def get_countrycode():
            "f5cac3d42d16b78348610fc4ec301e9234f82821/" +
            "countries_codes_and_coordinates.csv")
 
-    df = pd.read_csv(url)
+    df = pd.read_csv(BytesIO(fetch.get(url).content))
     df.columns = df.columns.str.replace(' ','')
     df.loc[:, "Alpha-2code":] = (df.loc[:, "Alpha-2code":]
         .replace(regex=r"[\" ]", value=''))
@@ -0,0 +1,389 @@
+'''
+This module sends every HTTP request of getdata.
+
+It has three modes:
+    live: requests go to the websites directly
+    record: requests go through a local stub server, which forwards them
+        to the websites and saves the raw responses to a cassette directory
+    replay: the stub server answers from the cassette directory, with
+        configurable latency and injected 409 / 5003 errors. Errors are
+        only injected where the pipeline recovers from them: 409 on the
+        hosts whose callers retry, and 5003 on the UN Comtrade requests
+        whose split requests were recorded
+
+The mode is read from the CAPPMAIT_HTTP_MODE environment variable (and the
+cassette directory from CAPPMAIT_CASSETTE_DIR), or set with configure().
+'''
+import hashlib
+import json
+import os
+import random
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit
+import requests
+
+settings = {
+    "mode": os.environ.get("CAPPMAIT_HTTP_MODE", "live"),
+    "cassette_dir": os.environ.get("CAPPMAIT_CASSETTE_DIR",
+                                   "proj_cappmait/data/cassettes/"),
+    # seconds to wait after each API call and after a 409 error
+    "delay": 5,
+    "retry_wait": 3600,
+    # replay options
+    "latency": 0.0,
+    "error_rate": 0.0,
+    "error_codes": (409, 5003),
+}
+if settings["mode"] == "replay":
+    settings.update({"delay": 0, "retry_wait": 0})
+_stub = {"server": None, "url": None, "random": random.Random(0),
+         "lock": threading.Lock(), "split": None}
+# Hosts whose callers wait and retry after a 409 error (get_json and
+# download_data.iter_text). The other callers fail on any error.
+RETRY_HOSTS = {"comtrade.un.org", "covid.ourworldindata.org"}
+
+
+def configure(mode, cassette_dir = None, latency = 0.0, error_rate = 0.0,
+              error_codes = (409, 5003), delay = None, retry_wait = None,
+              seed = 0):
+    '''
+    Set the mode of the HTTP layer and restart the stub server
+
+    Inputs:
+        mode (str): live, record or replay
+        cassette_dir (str): folder keeping the recorded responses
+        latency (float): seconds the stub waits before each replayed answer
+        error_rate (float): probability that a replayed answer is an error
+        error_codes (tuple of int): errors to inject, 409 and/or 5003
+        delay (float): seconds to wait after each API call. Default is 5
+            for live and record, and 0 for replay
+        retry_wait (float): seconds to wait after a 409 error. Default is
+            3600 for live and record, and 0 for replay
+        seed (int): random seed of the error injection
+    '''
+    if mode not in ("live", "record", "replay"):
+        raise ValueError(f"Unknown HTTP mode {mode}")
+    offline = mode == "replay"
+    settings.update({
+        "mode": mode,
+        "latency": latency,
+        "error_rate": error_rate,
+        "error_codes": tuple(error_codes),
+        "delay": (0 if offline else 5) if delay is None else delay,
+        "retry_wait": ((0 if offline else 3600) if retry_wait is None
+                       else retry_wait),
+    })
+    if cassette_dir is not None:
+        settings["cassette_dir"] = cassette_dir
+    _stub["random"] = random.Random(seed)
+    stop_stub()
+
+
+def cassette_key(scheme, host, path, query):
+    '''
+    Name of the cassette files of one request. Query parameters are sorted
+    so the same request always gets the same key.
+
+    Inputs:
+        scheme (str): http or https
+        host (str): host of the website
+        path (str): path of the url
+        query (str): query string of the url
+
+    Output:
+        (str): the key
+    '''
+    query = urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+    text = f"{scheme}://{host}{unquote(path)}?{query}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def route(url):
+    '''
+    Rewrite a url to go through the stub server when recording or
+    replaying. The stub server is started on first use.
+
+    Input:
+        url (str): url of the website
+
+    Output:
+        (str): the url to request
+    '''
+    if settings["mode"] == "live":
+        return url
+    if _stub["server"] is None:
+        start_stub()
+    parts = urlsplit(url)
+    routed = f'{_stub["url"]}/{parts.scheme}/{parts.netloc}{parts.path}'
+    if parts.query:
+        routed += "?" + parts.query
+    return routed
+
+
+def get(url, params = None, stream = False, timeout = None):
+    '''
+    Send a GET request in the current mode
+
+    Inputs:
+        url (str): url
+        params (dict): parameters following url. Default value is None
+        stream (bool): if True, do not read the body at once
+        timeout (float): seconds to wait for the server. Default waits
+            as long as the connection is open
+
+    Output:
+        (Response): the requests response
+    '''
+    return requests.get(route(url), params = params, stream = stream,
+                        timeout = timeout)
+
+
+def pause():
+    '''
+    Wait between two API calls, as complying to the API provider rule
+    '''
+    time.sleep(settings["delay"])
+
+
+def wait_rate_limit():
+    '''
+    Wait after a 409 error, as complying to the API provider rule
+    '''
+    time.sleep(settings["retry_wait"])
+
+
+def get_json(url, params = None):
+    '''
+    Get JSON from the website
+
+    Inputs:
+        url (str): url
+        params (dict): parameters following url. Default value is None
+
+    Output:
+        (dict): the JSON data in terms of Python dict
+    '''
+
+    resp = get(url, params)
+    pause()
+    if resp.status_code == 200:
+        return resp.json()
+    if resp.status_code == 409:
+        # if encounter this error, wait for 1 hr as complying to the API
+        # provider rule
+        wait_rate_limit()
+        return get_json(url, params)
+    return []
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''
+    Request handler of the stub server. The request path is
+    /<scheme>/<host>/<path of the website>.
+    '''
+
+    def do_GET(self):
+        '''
+        Forward and record, or replay, one request
+        '''
+        parts = urlsplit(self.path)
+        pieces = parts.path.lstrip("/").split("/", 2)
+        if len(pieces) < 2:
+            self.send_error(400, "Expected /<scheme>/<host>/<path>")
+            return
+        scheme, host = pieces[0], pieces[1]
+        path = "/" + pieces[2] if len(pieces) == 3 else "/"
+        url = f"{scheme}://{host}{path}"
+        if parts.query:
+            url += "?" + parts.query
+
+        key = cassette_key(scheme, host, path, parts.query)
+        body_path = os.path.join(settings["cassette_dir"], key + ".body")
+        meta_path = os.path.join(settings["cassette_dir"], key + ".json")
+        if settings["mode"] == "record":
+            self.record(url, body_path, meta_path)
+        else:
+            self.replay(url, host, parts.query, body_path, meta_path)
+
+    def record(self, url, body_path, meta_path):
+        '''
+        Forward the request to the website, stream the answer back and
+        save it to the cassette directory
+        '''
+        os.makedirs(settings["cassette_dir"], exist_ok = True)
+        with requests.get(url, stream = True) as resp:
+            content_type = resp.headers.get("Content-Type", "")
+            self.send_response(resp.status_code)
+            self.send_header("Content-Type", content_type)
+            self.end_headers()
+            with open(body_path, "wb") as f:
+                for chunk in resp.iter_content(1 << 20):
+                    f.write(chunk)
+                    self.wfile.write(chunk)
+        with open(meta_path, "w") as f:
+            json.dump({"url": url, "status": resp.status_code,
+                       "content_type": content_type}, f)
+
+    def replay(self, url, host, query, body_path, meta_path):
+        '''
+        Answer the request from the cassette directory
+        '''
+        if not os.path.exists(meta_path):
+            self.send_error(404, f"No cassette for {url}")
+            return
+        time.sleep(settings["latency"])
+
+        error = self.injected_error(host, query)
+        if error == 409:
+            self.send_response(409)
+            self.end_headers()
+            return
+        if error == 5003:
+            body = json.dumps({"validation": {"status": {
+                "value": 5003, "name": "Result too large"}}, "dataset": []})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body.encode("utf-8"))
+            return
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.send_response(meta["status"])
+        self.send_header("Content-Type", meta["content_type"])
+        self.send_header("Content-Length", str(os.path.getsize(body_path)))
+        self.end_headers()
+        with open(body_path, "rb") as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    @staticmethod
+    def injected_error(host, query):
+        '''
+        Draw the error to inject, if any. 409 only applies to the hosts
+        whose callers retry. 5003 only applies to UN Comtrade requests for
+        all partners whose requests per group of partners were recorded,
+        so the pipeline can download them instead.
+
+        Output:
+            (int or None): the error code
+        '''
+        codes = []
+        for code in settings["error_codes"]:
+            if code == 409 and host in RETRY_HOSTS:
+                codes.append(code)
+            elif (code == 5003 and host == "comtrade.un.org" and
+                  ("p", "all") in parse_qsl(query) and
+                  comtrade_request(query) in split_requests()):
+                codes.append(code)
+        with _stub["lock"]:
+            if not codes or _stub["random"].random() >= settings["error_rate"]:
+                return None
+            return _stub["random"].choice(codes)
+
+    def log_message(self, format, *args):
+        '''
+        Keep the stub server quiet
+        '''
+        return
+
+
+def comtrade_request(query):
+    '''
+    Reporter, year and commodity classification of a UN Comtrade request
+
+    Input:
+        query (str): query string of the url
+
+    Output:
+        (tuple of str): the r, ps and cc parameters
+    '''
+    params = dict(parse_qsl(query))
+    return (params.get("r"), params.get("ps"), params.get("cc"))
+
+
+def split_requests():
+    '''
+    UN Comtrade requests recorded per group of partners (after a 5003
+    error), read once from the cassette directory
+
+    Output:
+        (set of tuple): reporter, year and commodity classification
+    '''
+    with _stub["lock"]:
+        if _stub["split"] is None:
+            split = set()
+            folder = settings["cassette_dir"]
+            names = os.listdir(folder) if os.path.isdir(folder) else []
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                with open(os.path.join(folder, name)) as f:
+                    parts = urlsplit(json.load(f)["url"])
+                if (parts.netloc == "comtrade.un.org" and
+                    ("p", "all") not in parse_qsl(parts.query)):
+                    split.add(comtrade_request(parts.query))
+            _stub["split"] = split
+        return _stub["split"]
+
+
+def start_stub(port = 0):
+    '''
+    Start the stub server in a background thread
+
+    Input:
+        port (int): port to listen on. Default 0 picks a free port
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    _stub["server"] = server
+    _stub["url"] = f"http://127.0.0.1:{server.server_port}"
+
+
+def stop_stub():
+    '''
+    Stop the stub server if it is running
+    '''
+    if _stub["server"] is not None:
+        _stub["server"].shutdown()
+        _stub["server"].server_close()
+        _stub["server"] = None
+        _stub["url"] = None
+    _stub["split"] = None
+
+
+def time_pipeline(steps = None, mode = "replay", **options):
+    '''
+    Run the getdata pipeline through the stub server and print how long
+    each step took.
+
+    Inputs:
+        steps (list of functions): steps to run. Default is
+            create_csv_data, create_un_data and create_export_import_data
+        mode (str): record or replay
+        options: other arguments of configure()
+
+    Output:
+        (list of tuple): step name and seconds
+    '''
+    from proj_cappmait.getdata import getready_data, imf_api, un_api
+
+    if steps is None:
+        steps = [getready_data.create_csv_data, un_api.create_un_data,
+                 imf_api.create_export_import_data]
+    previous = settings["mode"]
+    configure(mode, **options)
+    timings = []
+    try:
+        for step in steps:
+            start = time.perf_counter()
+            step()
+            timings.append((step.__name__, time.perf_counter() - start))
+            print(f"{step.__name__}: {timings[-1][1]:.2f}s")
+    finally:
+        configure(previous)
+
+    return timings
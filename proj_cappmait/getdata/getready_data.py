@@ -1,28 +1,90 @@
 '''
-This module executes downloading all data other than api, 
+This module executes downloading all data other than api,
 clean whole data, and generate pagerank data.
 '''
 
-from proj_cappmait.getdata import clean_data, download_data, pagerank
+from proj_cappmait import config
+from proj_cappmait.getdata import (clean_data, download_data, integrity, 
+                                   pagerank, pipeline)
+from proj_cappmait.helper import countries, trade_store
 
-def create_csv_data():
+RAW = "proj_cappmait/data/data_from_prog/rawdata/"
+CLEAN = "proj_cappmait/data/data_from_prog/cleandata/"
+# The steps keeping one partition per year run again when the years change
+YEARS = {"years": config.YEARS}
+
+STEPS = [
+    pipeline.Step("get_owid", download_data.get_owid,
+                  outputs=[RAW + "owid_covid_data.parquet",
+                           RAW + "owid_country_info.csv",
+                           RAW + "owid_covid_data_periods.csv"]),
+    pipeline.Step("get_wto", download_data.get_wto,
+                  outputs=[RAW + "merchandise_values_annual_dataset.csv"],
+                  settings=YEARS),
+    pipeline.Step("get_wb", download_data.get_wb,
+                  outputs=[RAW + "world-bank-econ-data.csv"],
+                  settings=YEARS),
+    pipeline.Step("get_countrycode", download_data.get_countrycode,
+                  outputs=[RAW + "countries_codes_and_coordinates.csv"]),
+    pipeline.Step("write_dimension", countries.write_dimension,
+                  inputs=[RAW + "countries_codes_and_coordinates.csv"],
+                  outputs=[CLEAN + "country_dim.csv"]),
+    pipeline.Step("clean_imf", clean_data.clean_imf,
+                  inputs=[RAW + "imf_import_export.csv",
+                          RAW + "imf_imports.csv",
+                          CLEAN + "country_dim.csv"],
+                  outputs=[CLEAN + "imf_import_export_cleaned.csv"],
+                  kind="cpu", settings=YEARS),
+    pipeline.Step("clean_countrycode", clean_data.clean_countrycode,
+                  inputs=[CLEAN + "imf_import_export_cleaned.csv",
+                          RAW + "merchandise_values_annual_dataset.csv",
+                          CLEAN + "country_dim.csv"],
+                  outputs=[CLEAN + "countries_codes_and_coordinates_cleaned.csv"],
+                  kind="cpu"),
+    pipeline.Step("clean_owid", clean_data.clean_owid,
+                  inputs=[RAW + "owid_covid_data_periods.csv",
+                          CLEAN + "countries_codes_and_coordinates_cleaned.csv",
+                          CLEAN + "country_dim.csv"],
+                  outputs=[CLEAN + "owid_covid_data_cleaned.csv"],
+                  kind="cpu", settings=YEARS),
+    pipeline.Step("clean_owid_pyramid", clean_data.clean_owid_pyramid,
+                  inputs=[RAW + "owid_covid_data.parquet",
+                          CLEAN + "countries_codes_and_coordinates_cleaned.csv",
+                          CLEAN + "country_dim.csv"],
+                  outputs=[CLEAN + "owid_covid_pyramid.csv"],
+                  kind="cpu"),
+    pipeline.Step("clean_imf_monthly", clean_data.clean_imf_monthly,
+                  inputs=[RAW + "imf_monthly.csv",
+                          CLEAN + "country_dim.csv"],
+                  outputs=[CLEAN + "imf_monthly.npz"],
+                  kind="cpu"),
+    pipeline.Step("get_period_pagerank", pagerank.get_period_pagerank,
+                  inputs=[CLEAN + "imf_monthly.npz"],
+                  outputs=[CLEAN + "pagerank_periods.csv"],
+                  kind="cpu"),
+    pipeline.Step("get_pagerank", pagerank.get_pagerank,
+                  inputs=[CLEAN + "imf_import_export_cleaned.csv"],
+                  outputs=[CLEAN + "pagerank.csv"],
+                  kind="cpu", settings=YEARS),
+    pipeline.Step("build_store", trade_store.build_store,
+                  inputs=[CLEAN + "imf_import_export_cleaned.csv",
+                          CLEAN + "un_comtrade_top30.csv"],
+                  outputs=[CLEAN + "trade.db"]),
+]
+
+def create_csv_data(force = None):
     """
-    Execute download csvs and clean all the dataset
+    Execute download csvs and clean all the dataset.
+    The downloads run at the same time, and each cleaning step starts when
+    its inputs are ready.
+
+    Input:
+        force (bool): if False, skip the steps whose outputs are newer than
+            their inputs (and the downloads already stored). Default is
+            False with config.INCREMENTAL, True otherwise
     """
+    force = not config.INCREMENTAL if force is None else force
 
     print ("Start Downloading csv data.")
-    print("Downloading OWID data.")
-    download_data.get_owid()
-    print("Downloading WTO data.")
-    download_data.get_wto()
-    print("Downloading World bank data.")
-    download_data.get_wb()
-    print("Downloading Country code data.")
-    download_data.get_countrycode()
-    print("Cleaning all csv data.")
-    clean_data.clean_imf()
-    clean_data.clean_countrycode()
-    clean_data.clean_owid()
-    print("Calculating page rank.")
-    pagerank.get_pagerank()
+    pipeline.run(STEPS, force, manifest_path=integrity.MANIFEST_PATH)
     print("Data is ready.")
@@ -4,34 +4,152 @@ This module collects bilateral trade data for all countries by IMF API.
 Reference: https://www.bd-econ.com/imfapi1.html
 '''
 import pandas as pd
-import requests
-import time
+from proj_cappmait import config
+from proj_cappmait.getdata import fetch, partitions
 
 url = 'http://dataservices.imf.org/REST/SDMX_JSON.svc/'
+MONTHLY_PATH = 'proj_cappmait/data/data_from_prog/rawdata/imf_monthly.csv'
+MIRROR_PATH = 'proj_cappmait/data/data_from_prog/rawdata/imf_imports.csv'
 
-def create_export_import_data():
+def create_export_import_data(years = None, incremental = None):
     """
     Create bilateral export dataset by running the extract_export_data function
     to the every country and region in IMF dataset.
     And create bilateral export-import dataset from the export dataset.
+    Each year is kept as a partition, so an incremental refresh only 
+    downloads the years that are missing.
+
+    Inputs:
+        years (list of int): years to collect. Default is config.YEARS
+        incremental (bool): if True, skip the years already stored. 
+            Default is config.INCREMENTAL
 
     Output(csv file): bilateral export-import dataset
     """
-    country_codes = find_country_codes()
+    df = collect_annual("imf", years, incremental, 'TXG_FOB_USD')
+
+    return df.to_csv(('proj_cappmait/data/data_from_prog/rawdata/' + 
+                     'imf_import_export.csv')
+    )
+
+
+def create_mirror_data(years = None, incremental = None):
+    """
+    Create the mirror dataset: the imports (c.i.f.) each country reports 
+    from its trading partners. Rows are turned around so that, like the 
+    export dataset, "from" is the exporter and "to" the importer.
 
-    df = pd.DataFrame(index=[], columns=['from', 'to', '2019', '2020'])
+    Inputs:
+        years (list of int): years to collect. Default is config.YEARS
+        incremental (bool): if True, skip the years already stored. 
+            Default is config.INCREMENTAL
+
+    Output(csv file): bilateral mirror import dataset
+    """
+    df = collect_annual("imf_imports", years, incremental, 'TMG_CIF_USD')
+    df = df.rename(columns={'from': 'to', 'to': 'from'})
+    df = df[['from', 'to'] + [col for col in df.columns 
+                              if col not in ('from', 'to')]]
+    df.to_csv(MIRROR_PATH)
+
+
+def collect_annual(dataset, years, incremental, indicator):
+    """
+    Download the missing years of an annual series and read every year 
+    from the partitions.
+
+    Inputs:
+        dataset (str): name of the partitions
+        years (list of int): years to collect. Default is config.YEARS
+        incremental (bool): if True, skip the years already stored. 
+            Default is config.INCREMENTAL
+        indicator (str): IMF indicator of the series
+
+    Output:
+        (pd.DataFrame): from, to (reporter and partner) and one column 
+            per year
+    """
+    years = config.YEARS if years is None else years
+    incremental = config.INCREMENTAL if incremental is None else incremental
+    fetch_years = partitions.years_to_fetch(dataset, years, incremental)
+
+    if fetch_years:
+        df = collect_flows(find_country_codes(), fetch_years, 
+                           indicator=indicator)
+
+        for year in fetch_years:
+            if str(year) in df.columns:
+                partitions.write_partition(
+                    dataset, year, df[['from', 'to', str(year)]].dropna())
+
+    df = pd.DataFrame(columns=['from', 'to'])
+    # Keep Namibia's code "NA" as a string
+    for part in partitions.read_partitions(dataset, years, 
+                                           dtype={'from': 'str', 'to': 'str'},
+                                           keep_default_na=False, 
+                                           na_values=['']):
+        df = df.merge(part, how='outer', on=['from', 'to'])
+    return df
+
+
+def create_monthly_data(years = None, incremental = None):
+    """
+    Create the monthly bilateral export dataset, in long format (one row
+    per exporter, importer and month). Each year is kept as a partition,
+    like the annual data.
+
+    Inputs:
+        years (list of int): years to collect. Default is config.YEARS
+        incremental (bool): if True, skip the years already stored. 
+            Default is config.INCREMENTAL
+
+    Output(csv file): monthly bilateral export dataset
+    """
+    years = config.YEARS if years is None else years
+    incremental = config.INCREMENTAL if incremental is None else incremental
+    fetch_years = partitions.years_to_fetch("imf_monthly", years, incremental)
+
+    if fetch_years:
+        df = collect_flows(find_country_codes(), fetch_years, 'M')
+        df = df.melt(['from', 'to'], var_name='period').dropna()
+        for year in fetch_years:
+            partitions.write_partition(
+                "imf_monthly", year, 
+                df[df['period'].str.startswith(str(year))])
+
+    df = pd.concat(partitions.read_partitions(
+        "imf_monthly", years, dtype={'from': 'str', 'to': 'str'},
+        keep_default_na=False, na_values=['']))
+    df.to_csv(MONTHLY_PATH, index=False)
+
+
+def collect_flows(country_codes, years, frequency = 'A', 
+                  indicator = 'TXG_FOB_USD'):
+    """
+    Get the flows every country reports with its trading partners
+
+    Inputs:
+        country_codes: every country code in the target dataset.
+        years(list of int): years to collect
+        frequency(str): 'A' for annual or 'M' for monthly data
+        indicator(str): 'TXG_FOB_USD' for exports or 'TMG_CIF_USD' for 
+            imports
+
+    Output:
+        (pd.DataFrame): from (the reporter), to (the partner) and one 
+            column per period
+    """
+    frames = []
     for code in country_codes:
         print(f"Getting {code}'s export data...")
-        time.sleep(5)
-        one_country = get_imf_export_data(country_codes, code)
+        fetch.pause()
+        one_country = get_imf_export_data(country_codes, code, years, 
+                                          frequency, indicator)
         one_country.reset_index(level=0, inplace=True)
         one_country.rename(columns={'index': 'to'}, inplace=True)
         one_country.insert(0, "from", code, True)
-        df = pd.concat([df, one_country])
-
-    return df.to_csv(('proj_cappmait/data/data_from_prog/rawdata/' + 
-                     'imf_import_export.csv')
-    )
+        frames.append(one_country)
+    return pd.concat(frames)
 
 
 def find_country_codes():
@@ -41,12 +159,12 @@ def find_country_codes():
         country_codes: every country code in the target dataset.
     """
     key = 'DataStructure/DOT'
-    dimension_list = requests.get(f'{url}{key}').json()\
+    dimension_list = fetch.get(f'{url}{key}').json()\
                 ['Structure']['KeyFamilies']['KeyFamily']\
                 ['Components']['Dimension']
 
     key = f'CodeList/{dimension_list[1]["@codelist"]}'
-    code_list_d2 = requests.get(f'{url}{key}').json()\
+    code_list_d2 = fetch.get(f'{url}{key}').json()\
             ['Structure']['CodeLists']['CodeList']['Code']
     country_codes = {}
     for code in code_list_d2:
@@ -55,18 +173,26 @@ def find_country_codes():
     return country_codes
 
 
-def get_imf_export_data(country_codes, target_country):
+def get_imf_export_data(country_codes, target_country, years = None,
+                        frequency = 'A', indicator = 'TXG_FOB_USD'):
     '''
-    Get one country's trading data with its trading partners in 2019 and 2020
-    by IMF API. This process separates the key to four short keys and execute
+    Get one country's trading data with its trading partners in the given
+    years by IMF API. This process separates the key to four short keys and execute
     individually because there seems to be URL's length limitation.
 
     Inputs:
         country_codes: every country code in the target dataset.
         target_country(str): a country's code
+        years(list of int): years to collect. Default is config.YEARS
+        frequency(str): 'A' for annual series (periods "2019") or 'M' for
+            monthly series (periods "2019-01")
+        indicator(str): 'TXG_FOB_USD' for the exports (f.o.b.) or 
+            'TMG_CIF_USD' for the imports (c.i.f.) of target_country
     Outputs:
         trading data(pd.DataFrame): trading data of the target country
     '''
+    years = config.YEARS if years is None else years
+    period = {'startPeriod': min(years), 'endPeriod': max(years)}
     key_d3 = []
     code_list = list(country_codes.keys())
     for i in range(4):
@@ -77,24 +203,31 @@ def get_imf_export_data(country_codes, target_country):
 
     trading_data = {}
     for k in key_d3:
-        key = f'CompactData/DOT/A.{target_country}.TXG_FOB_USD.{k}\
-            ?startPeriod=2019&endPeriod=2020'
-        data = requests.get(f'{url}{key}').json()['CompactData']['DataSet']
+        key = (f'CompactData/DOT/{frequency}.{target_country}'
+               f'.{indicator}.{k}')
+        data = (fetch.get(f'{url}{key}', params=period).json()
+                ['CompactData']['DataSet'])
         if 'Series' not in data.keys():
             continue
         data = data['Series']
+        if isinstance(data, dict):
+            data = [data]
         for s in data:
             df_dict_col = {}
-            if 'Obs' not in s.keys() or not isinstance(s['Obs'], list):
+            if 'Obs' not in s.keys():
                 continue
-            for i in s['Obs']:
+            # A single observation is not wrapped in a list
+            obs = s['Obs'] if isinstance(s['Obs'], list) else [s['Obs']]
+            for i in obs:
+                if int(i['@TIME_PERIOD'][:4]) not in years:
+                    continue
                 df_dict_col[i['@TIME_PERIOD']] = round(
                     float(i['@OBS_VALUE']), 1
                 )
             trading_data[s['@COUNTERPART_AREA']] = df_dict_col
 
     df = pd.DataFrame(trading_data).T
-    if '2019' in df.columns:
-        df.sort_values(by=['2019'], inplace=True, ascending=False)
+    if str(years[0]) in df.columns:
+        df.sort_values(by=[str(years[0])], inplace=True, ascending=False)
 
     return df
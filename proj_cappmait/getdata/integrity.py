@@ -0,0 +1,233 @@
+'''
+This module checks the raw and clean data files and keeps a checksum
+manifest of them.
+
+Files are read once in binary blocks: the block hashes give the sha256, and
+the newlines give the row count of csv files, so no file is parsed. Files are
+scanned on a thread pool (hashlib releases the GIL on large blocks).
+
+The manifest (data/data_from_prog/manifest.json) keeps, for every file, its
+size, modification time, sha256 and row count. The pipeline also records the
+hashes of the inputs and outputs of each step, to skip the steps whose files
+did not change and to rerun the ones whose outputs are corrupted.
+'''
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+DATA_PATH = "proj_cappmait/data/data_from_prog/"
+MANIFEST_PATH = DATA_PATH + "manifest.json"
+FOLDERS = [DATA_PATH + "rawdata/", DATA_PATH + "rawdata/uncomtrade/",
+           DATA_PATH + "cleandata/"]
+BLOCK_SIZE = 1 << 20
+
+
+def scan_file(path, columns = None):
+    '''
+    Check one file without parsing it
+
+    Inputs:
+        path (str): path of the file
+        columns (list of str): columns the header of a csv file must have
+
+    Output:
+        (dict): size, mtime, sha256, header and rows (csv files only) and
+            error (None if the file looks valid)
+    '''
+    stat = os.stat(path)
+    sha = hashlib.sha256()
+    newlines = 0
+    first = b""
+    last = b""
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            sha.update(block)
+            newlines += block.count(b"\n")
+            if len(first) < BLOCK_SIZE and b"\n" not in first:
+                first += block
+            last = block
+
+    info = {"size": stat.st_size, "mtime": stat.st_mtime,
+            "sha256": sha.hexdigest(), "error": None}
+    if stat.st_size == 0:
+        info["error"] = "empty file"
+    elif path.endswith(".csv"):
+        header = first.split(b"\n", 1)[0].decode("utf-8", "replace")
+        info["header"] = header.strip("\r\ufeff").split(",")
+        # A last line without a newline is a row too
+        lines = newlines + (not last.endswith(b"\n"))
+        info["rows"] = lines - 1
+        missing = [col for col in columns or [] if col not in info["header"]]
+        if missing:
+            info["error"] = "missing columns " + ", ".join(missing)
+        elif info["rows"] < 1:
+            info["error"] = "no rows"
+    elif path.endswith(".parquet"):
+        with open(path, "rb") as f:
+            magic = f.read(4)
+            f.seek(-4, os.SEEK_END)
+            if magic != b"PAR1" or f.read(4) != b"PAR1":
+                info["error"] = "truncated parquet file"
+    return info
+
+
+def scan(paths, columns = None, workers = 8):
+    '''
+    Check files on a thread pool
+
+    Inputs:
+        paths (list of str): paths of the files
+        columns (list of str): columns the csv headers must have
+        workers (int): number of threads
+
+    Output:
+        (dict): path to the result of scan_file
+    '''
+    with ThreadPoolExecutor(workers) as pool:
+        return dict(zip(paths, pool.map(lambda path: scan_file(path, columns),
+                                        paths)))
+
+
+def folder_files(folders = None):
+    '''
+    List the data files of folders (not recursive)
+
+    Input:
+        folders (list of str): folders. Default is FOLDERS
+
+    Output:
+        (list of str): paths of the files
+    '''
+    folders = FOLDERS if folders is None else folders
+    return sorted(folder + file for folder in folders
+                  if os.path.isdir(folder)
+                  for file in os.listdir(folder)
+                  if os.path.isfile(folder + file))
+
+
+def check_error(folder, columns = None):
+    '''
+    List the corrupted files of a folder: empty files, csv files without
+    rows or without the expected columns, truncated parquet files
+
+    Inputs:
+        folder (str): a folder kept files
+        columns (list of str): columns the csv headers must have
+
+    Output:
+        (list): names of the error files
+    '''
+    results = scan(folder_files([folder]), columns)
+    return [os.path.basename(path) for path, info in results.items()
+            if info["error"] is not None]
+
+
+def load_manifest(path = MANIFEST_PATH):
+    '''
+    Load the manifest, or an empty one if it does not exist
+
+    Input:
+        path (str): path of the manifest
+
+    Output:
+        (dict): files and steps of the manifest
+    '''
+    if not os.path.exists(path):
+        return {"version": None, "files": {}, "steps": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, path = MANIFEST_PATH):
+    '''
+    Save the manifest. Its version is a hash of all the file hashes, so it
+    changes whenever a data file changes.
+
+    Inputs:
+        manifest (dict): files and steps of the manifest
+        path (str): path of the manifest
+    '''
+    version = hashlib.sha256()
+    for file, info in sorted(manifest["files"].items()):
+        version.update(f"{file}:{info['sha256']}\n".encode("utf-8"))
+    manifest["version"] = version.hexdigest()[:16]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def update_manifest(manifest = None, paths = None, workers = 8):
+    '''
+    Scan files and update their entries in the manifest. Files whose size
+    and modification time did not change are not read again.
+
+    Inputs:
+        manifest (dict): the manifest. Default loads MANIFEST_PATH
+        paths (list of str): files to scan. Default is every file of FOLDERS
+        workers (int): number of threads
+
+    Output:
+        (dict): the updated manifest
+    '''
+    manifest = load_manifest() if manifest is None else manifest
+    every_file = paths is None
+    paths = folder_files() if every_file else paths
+    paths = [path for path in paths if os.path.exists(path)]
+    changed = [path for path in paths if not is_cached(manifest, path)]
+    manifest["files"].update(scan(changed, workers=workers))
+    if every_file:
+        # Forget the deleted files
+        for path in list(manifest["files"]):
+            if not os.path.exists(path):
+                del manifest["files"][path]
+    return manifest
+
+
+def is_cached(manifest, path):
+    '''
+    Check if the manifest entry of a file is still current (same size and
+    modification time)
+    '''
+    info = manifest["files"].get(path)
+    if info is None:
+        return False
+    stat = os.stat(path)
+    return info["size"] == stat.st_size and info["mtime"] == stat.st_mtime
+
+
+def file_hashes(manifest, paths):
+    '''
+    Current sha256 of files, read again only if they changed since the
+    manifest entry
+
+    Inputs:
+        manifest (dict): the manifest, updated in place
+        paths (list of str): files
+
+    Output:
+        (dict): path to sha256, None for missing files
+    '''
+    update_manifest(manifest, paths)
+    return {path: manifest["files"][path]["sha256"]
+            if os.path.exists(path) else None for path in paths}
+
+
+def build_manifest(path = MANIFEST_PATH):
+    '''
+    Scan every raw and clean file, save the manifest and print the
+    corrupted files
+
+    Input:
+        path (str): path of the manifest
+
+    Output:
+        (dict): the manifest
+    '''
+    manifest = update_manifest(load_manifest(path))
+    write_manifest(manifest, path)
+    for file, info in manifest["files"].items():
+        if info["error"] is not None:
+            print(f"{file}: {info['error']}")
+    return manifest
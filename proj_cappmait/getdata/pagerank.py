@@ -4,43 +4,108 @@ Code idea from 121 lecture note.
 (https://classes.cs.uchicago.edu/archive/2021/fall/30121-1/modules/m2.html)
 '''
 import random
-import csv
 import pandas as pd
 import numpy as np
+from proj_cappmait import config
+from proj_cappmait.getdata import partitions
+from proj_cappmait.helper import countries, storage, trade_cube
 
-def get_pagerank():
+def get_pagerank(years = None, incremental = None):
     '''
     Calculate the Page Rank value for all countries and save to csv file. 
     The Page Rank here is using the damping factor 0.9. 
+    It is calculated for each year on the trades of that year and kept
+    as a partition, so an incremental run only calculates new years. 
+    pagerank.csv holds the Page Rank of config.COMPARE_YEAR.
 
-    Input: None
+    Inputs: 
+        years (list of int): years to calculate. Default is config.YEARS
+        incremental (bool): if True, skip the years already calculated.
+            Default is config.INCREMENTAL
 
     Output: A list of tuple with country code and Page Rank. 
     This data is also saved in csv.
     '''
-    partners = pd.read_csv(
-        ("proj_cappmait/data/data_from_prog/cleandata/" + 
-         "imf_import_export_cleaned.csv"), 
-        dtype={"2019":"float", "2020":"float"})
+    years = config.YEARS if years is None else years
+    incremental = config.INCREMENTAL if incremental is None else incremental
+    partners = storage.read_clean(
+        "imf_import_export_cleaned", storage.CLEAN_PATH, categorical=False)
+
+    for year in partitions.years_to_fetch("pagerank", years, incremental):
+        if str(year) not in partners.columns:
+            continue
+        print(f"Running simulation for {year}.")
+        pagerank_lst = compute_year_pagerank(
+            partners[partners[str(year)] > 0.0])
+        partitions.write_partition(
+            "pagerank", year, 
+            pd.DataFrame(pagerank_lst, columns=["country_code", "pagerank"]))
+
+    stored = partitions.read_partitions("pagerank", [config.COMPARE_YEAR])
+    if not stored:
+        raise ValueError(f"No Page Rank for {config.COMPARE_YEAR}: the " +
+                         "IMF data has no exports for this year")
+    pagerank_df = stored[0]
+    storage.write_clean(pagerank_df, "pagerank")
+    pagerank_lst = [tuple(row) for row in pagerank_df.itertuples(index=False)]
 
+    return pagerank_lst
+
+
+def get_period_pagerank(resolutions = ("month", "quarter")):
+    '''
+    Calculate the Page Rank value for all countries in every month and
+    quarter of the monthly IMF data, and save it to csv file. Nothing is
+    done when the monthly data was not built.
+
+    Input:
+        resolutions (list of str): month, quarter or year
+
+    Output: A DataFrame of period, country code and Page Rank. 
+    '''
+    cube = trade_cube.load_cube(storage.CLEAN_PATH)
+    if cube is None:
+        print("No monthly IMF data, skipping.")
+        return None
+    dim = countries.load_dimension(storage.CLEAN_PATH)
+
+    frames = []
+    for resolution in resolutions:
+        periods, values = trade_cube.rollup(*cube, resolution)
+        for period in periods:
+            partners = trade_cube.period_partners(periods, values, [period],
+                                                  dim)
+            pagerank = PageRank(partners, 0.9)
+            pagerank.compute_transition()
+            pagerank_dct = pagerank.compute_stationary()
+            frames.append(pd.DataFrame({
+                "period": period,
+                "country_code": pagerank.country_list,
+                "pagerank": [pagerank_dct[i] 
+                             for i in range(pagerank.n)]}))
+    pagerank_df = pd.concat(frames, ignore_index=True)
+    storage.write_clean(pagerank_df, "pagerank_periods")
+    return pagerank_df
+
+
+def compute_year_pagerank(partners):
+    '''
+    Calculate the Page Rank value for all countries of one year
+
+    Input:
+        partners(Pandas Dataframe): the IMF trades of the year
+
+    Output: A list of tuple with country code and Page Rank, sorted by
+        Page Rank.
+    '''
     pagerank = PageRank(partners, 0.9)
     pagerank.compute_transition()
 
-    print("Running simulation.")
     pagerank_dct = pagerank.compute_pagerank(1000000, 1)
 
     pagerank_lst = [(pagerank.country_list[i], p) for \
                         i, p in pagerank_dct.items()]
-    pagerank_lst = sorted(pagerank_lst, key=lambda x : x[1], reverse=True)
-
-    with open(
-        'proj_cappmait/data/data_from_prog/cleandata/pagerank.csv', 
-        'w') as f:
-        write = csv.writer(f)
-        for pagerank_tup in pagerank_lst:
-            write.writerow(pagerank_tup)
-
-    return pagerank_lst
+    return sorted(pagerank_lst, key=lambda x : x[1], reverse=True)
 
 
 class PageRank:
@@ -55,7 +120,7 @@ class PageRank:
         Input: 
             partners(Pandas Dataframe): An IMF data of bi-trade 
                 (from exporter = source to importer = target) 
-            in 2019 and 2020. 
+            in the years of config.YEARS. 
             d(float): A damping factor. Typically 0.9. 
 
         Attributes:
@@ -77,7 +142,8 @@ class PageRank:
         self.pagerank = dict()
         self.d = d
         
-        for _, _, _, from_code, _, to_code in partners.itertuples(index=False):
+        for from_code, to_code in partners[["from_code", "to_code"]]\
+                .itertuples(index=False):
             if to_code in self.country_list:
                 from_index = self.country_list.index(from_code)
                 to_index = self.country_list.index(to_code)
@@ -113,5 +179,28 @@ class PageRank:
                     break
         return self.pagerank
 
+    def compute_stationary(self, tol = 1e-10, max_iter = 1000):
+        '''
+        Compute pagerank for each country by power iteration: the
+        distribution the random surfer of compute_pagerank converges to,
+        without sampling. A country without partners links to every
+        country.
+
+        Input:
+            tol(float): Stop when the ranks move less than tol. 
+            max_iter(int): The maximum number of iterations. 
+        '''
+        markov = np.where(self.out_degree[:, None] > 0, self.markov,
+                          1 / self.n)
+        rank = np.full(self.n, 1 / self.n)
+        for _ in range(max_iter):
+            new_rank = rank @ markov
+            converged = np.abs(new_rank - rank).sum() < tol
+            rank = new_rank
+            if converged:
+                break
+        self.pagerank = dict(enumerate(rank))
+        return self.pagerank
+
     def __repr__(self):
         return f'(pagerank = {self.pagerank})'
@@ -0,0 +1,88 @@
+'''
+This module keeps one csv partition per dataset and year, so that a 
+refresh only fetches and processes the years that are not stored yet.
+
+Partitions are saved in data/data_from_prog/partitions/<dataset>/<year>.csv
+'''
+import os
+import pandas as pd
+
+PARTITION_PATH = "proj_cappmait/data/data_from_prog/partitions/"
+
+
+def partition_path(dataset, year):
+    '''
+    Path of the partition of one year
+
+    Inputs:
+        dataset (str): name of the dataset
+        year (int): year
+
+    Output:
+        (str): csv path
+    '''
+    return f"{PARTITION_PATH}{dataset}/{year}.csv"
+
+
+def stored_years(dataset):
+    '''
+    List the years stored for a dataset
+
+    Input:
+        dataset (str): name of the dataset
+
+    Output:
+        (list of int): stored years
+    '''
+    folder = PARTITION_PATH + dataset
+    if not os.path.isdir(folder):
+        return []
+    return sorted(int(file[:-4]) for file in os.listdir(folder) 
+                  if file.endswith(".csv"))
+
+
+def years_to_fetch(dataset, years, incremental):
+    '''
+    Select the years to fetch or process
+
+    Inputs:
+        dataset (str): name of the dataset
+        years (list of int): years requested
+        incremental (bool): if True, skip the years already stored
+
+    Output:
+        (list of int): years to fetch
+    '''
+    if not incremental:
+        return list(years)
+    stored = stored_years(dataset)
+    return [year for year in years if year not in stored]
+
+
+def write_partition(dataset, year, df):
+    '''
+    Save the data of one year
+
+    Inputs:
+        dataset (str): name of the dataset
+        year (int): year
+        df (DataFrame): the data of the year
+    '''
+    os.makedirs(PARTITION_PATH + dataset, exist_ok=True)
+    df.to_csv(partition_path(dataset, year), index=False)
+
+
+def read_partitions(dataset, years, **kwargs):
+    '''
+    Read the partitions of the given years
+
+    Inputs:
+        dataset (str): name of the dataset
+        years (list of int): years to read
+        kwargs: options passed to pd.read_csv
+
+    Output:
+        (list of DataFrame): one dataframe per stored year
+    '''
+    return [pd.read_csv(partition_path(dataset, year), **kwargs) 
+            for year in years if os.path.exists(partition_path(dataset, year))]
@@ -0,0 +1,211 @@
+'''
+Module to run the getdata steps as a dependency graph.
+
+Each step declares the files it reads and writes. A step starts as soon as
+the steps writing its inputs are done, so independent steps run at the same
+time: I/O steps (downloads) on threads and CPU steps (cleaning, PageRank) on
+processes. A step is skipped when all its outputs are newer than its inputs,
+or, with a checksum manifest (getdata/integrity.py), when its inputs and
+outputs have the same hashes and its settings (like the years) are the same
+as after its last run.
+'''
+import json
+import os
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from proj_cappmait.getdata import integrity
+
+
+class Step:
+    '''
+    Class for one step of the pipeline.
+    '''
+
+    def __init__(self, name, func, inputs = (), outputs = (), kind = "io",
+                 settings = None):
+        '''
+        A constructor.
+
+        Inputs:
+            name (str): name printed in the timeline
+            func (function): module level function running the step
+            inputs (list of str): files read by the step
+            outputs (list of str): files written by the step
+            kind (str): "io" to run on a thread, "cpu" to run on a process
+            settings (dict): configuration the outputs depend on, like the
+                years. The step runs again when it changes
+        '''
+        if kind not in ("io", "cpu"):
+            raise ValueError(f"Unknown step kind {kind}")
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.kind = kind
+        # As read back from the manifest (tuples become lists)
+        self.settings = json.loads(json.dumps(settings or {}))
+
+    def is_fresh(self, manifest = None):
+        '''
+        Check if every output exists and is newer than every input. A step
+        without inputs (a download) is fresh when its outputs exist.
+        With a manifest that recorded the last run of the step, check
+        instead that its inputs and outputs still have the recorded hashes,
+        which also catches corrupted outputs, and that its settings did not
+        change. A step with settings is never fresh without this record.
+
+        Input:
+            manifest (dict): the checksum manifest, or None
+
+        Output:
+            (bool): True if the step can be skipped
+        '''
+        if not self.outputs or not all(map(os.path.exists, self.outputs)):
+            return False
+        if manifest is not None and self.name in manifest["steps"]:
+            return self.state(manifest) == manifest["steps"][self.name]
+        if self.settings:
+            return False
+        inputs = [path for path in self.inputs if os.path.exists(path)]
+        if not inputs:
+            return True
+        return (min(map(os.path.getmtime, self.outputs)) >=
+                max(map(os.path.getmtime, inputs)))
+
+    def state(self, manifest):
+        '''
+        Record of a run of the step in the manifest
+
+        Input:
+            manifest (dict): the checksum manifest, updated in place
+
+        Output:
+            (dict): the hashes of the inputs and outputs, and the settings
+        '''
+        return {"files": integrity.file_hashes(manifest, 
+                                               self.inputs + self.outputs),
+                "settings": self.settings}
+
+    def __repr__(self):
+        return f'(name = {self.name}, kind = {self.kind})'
+
+
+def dependencies(steps):
+    '''
+    Find the steps each step waits for: the steps writing its inputs
+
+    Input:
+        steps (list of Step): the steps
+
+    Output:
+        (dict): step name to the set of step names it waits for
+    '''
+    writers = {}
+    for step in steps:
+        for path in step.outputs:
+            if path in writers:
+                raise ValueError(f"{path} is written by {writers[path]} "
+                                 f"and {step.name}")
+            writers[path] = step.name
+    return {step.name: {writers[path] for path in step.inputs
+                        if path in writers} - {step.name}
+            for step in steps}
+
+
+def run(steps, force = False, workers = 4, manifest_path = None):
+    '''
+    Run the steps in dependency order, independent steps concurrently,
+    and print a timeline.
+
+    Inputs:
+        steps (list of Step): the steps
+        force (bool): if True, run every step even if it is fresh
+        workers (int): number of threads and of processes
+        manifest_path (str): checksum manifest to compare and record the
+            files of the steps with, and to update at the end. Default
+            compares modification times only
+
+    Output:
+        (list of tuple): step name, start and end in seconds from the start
+            of the run, and whether it ran or was skipped
+    '''
+    deps = dependencies(steps)
+    by_name = {step.name: step for step in steps}
+    waiting = dict(deps)
+    ran = set()
+    done = set()
+    running = {}
+    timeline = []
+    manifest = (integrity.load_manifest(manifest_path) if manifest_path 
+                else None)
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(workers) as threads, \
+         ProcessPoolExecutor(workers) as processes:
+        while waiting or running:
+            # Skipped steps are done at once, and may make other steps ready
+            ready = [name for name, needs in waiting.items() if needs <= done]
+            while ready:
+                name = ready.pop(0)
+                del waiting[name]
+                step = by_name[name]
+                now = time.perf_counter() - start
+                # Without hashes, a step reruns when a step it waits for
+                # has run
+                if (not force and 
+                    (manifest is not None or not deps[name] & ran) and 
+                    step.is_fresh(manifest)):
+                    print(f"Skipping {name}, outputs are up to date.")
+                    timeline.append((name, now, now, False))
+                    done.add(name)
+                    ready += [other for other, needs in waiting.items()
+                              if needs <= done and other not in ready]
+                    continue
+                print(f"Running {name}.")
+                pool = threads if step.kind == "io" else processes
+                running[pool.submit(step.func)] = (name, now)
+            if not running:
+                if waiting:
+                    raise ValueError("Steps with a dependency cycle: " +
+                                     ", ".join(sorted(waiting)))
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, began = running.pop(future)
+                # Re-raise the error of the step
+                future.result()
+                timeline.append((name, began, time.perf_counter() - start,
+                                 True))
+                ran.add(name)
+                done.add(name)
+                if manifest is not None:
+                    manifest["steps"][name] = by_name[name].state(manifest)
+
+    if manifest is not None:
+        integrity.write_manifest(integrity.update_manifest(manifest), 
+                                 manifest_path)
+    print_timeline(timeline)
+    return timeline
+
+
+def print_timeline(timeline, width = 40):
+    '''
+    Print when each step started and ended
+
+    Inputs:
+        timeline (list of tuple): output of run
+        width (int): number of characters of the longest bar
+    '''
+    total = max([end for _, _, end, _ in timeline] + [1e-9])
+    label = max([len(name) for name, _, _, _ in timeline] + [0])
+    for name, began, end, has_run in timeline:
+        if not has_run:
+            print(f"{name:<{label}} skipped")
+            continue
+        left = int(began / total * width)
+        bar = "#" * max(1, int(end / total * width) - left)
+        print(f"{name:<{label}} |{' ' * left}{bar:<{width - left}}| "
+              f"{began:7.2f}s - {end:7.2f}s")
+    print(f"Total: {total:.2f}s")
@@ -8,34 +8,22 @@ data/data_from_prog
 """
 
 import json
-import time
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import pandas as pd
-import requests
+from proj_cappmait import config
+from proj_cappmait.getdata import integrity
+from proj_cappmait.getdata.fetch import get_json
+from proj_cappmait.helper import comtrade, countries, storage, trade_store
 
-# Helper function
-def get_json(url, params = None):
-    '''
-    Get JSON from the website
-    
-    Inputs:
-        url (str): url
-        params (dict): parameters following url. Default value is None
-    
-    Output:
-        (dict): the JSON data in terms of Python dict
-    '''
-
-    resp = requests.get(url, params = params)
-    time.sleep(5)
-    if resp.status_code == 200:    
-        return resp.json()
-    if resp.status_code == 409:
-        # if encounter this error, wait for 1 hr as complying to the API 
-        # provider rule
-        time.sleep(3600)
-        return get_json(url, params)
-    return []
+# Columns of the raw UN Comtrade files that are kept
+UN_COLUMNS = ['yr', 'rtCode', 'rtTitle', 'rt3ISO', 'ptCode', 'ptTitle', 
+              'pt3ISO', 'cmdCode', 'cmdDescE', 'TradeValue']
+# Their names in the concatenated data
+SHARD_COLUMNS = ['year', 'reporter_code','reporter_title', 'reporter_iso', 
+                 'partner_code', 'partner_title', 'partner_iso', 'comm_code', 
+                 'comm_desc', 'trade_val']
 
 
 def un_comtrade_countries(path):
@@ -56,7 +44,8 @@ def un_comtrade_countries(path):
     return data
 
 
-def un_comtrade_json(year, reporter, partner = {'id':'all', 'text':'all'}):
+def un_comtrade_json(year, reporter, partner = {'id':'all', 'text':'all'},
+                     hs_level = 2):
     '''
     Download UN comtrade JSON data from API
     
@@ -64,6 +53,7 @@ def un_comtrade_json(year, reporter, partner = {'id':'all', 'text':'all'}):
         year (int): year
         reporter (dict): a reporter dict with id, text as keys
         partner (dict): a trade partner dict with id, text as keys
+        hs_level (int): digits of the HS commodity codes (2, 4 or 6)
     Return:
         (list of dicts): a list of dict of data that we get
     '''
@@ -71,7 +61,7 @@ def un_comtrade_json(year, reporter, partner = {'id':'all', 'text':'all'}):
     reporter_id = reporter["id"]
     partner_id = partner["id"]
     params = {'r':reporter_id, 'px':'HS', 'ps':year, 'p':partner_id, 
-              'rg':2, 'cc':'AG2', 'max':100000}
+              'rg':2, 'cc':f'AG{hs_level}', 'max':100000}
     url = "https://comtrade.un.org/api/get"
     json_data = get_json(url, params)
     return json_data
@@ -96,7 +86,7 @@ def un_comtrade_to_csv(data, path, year, reporter,
     df.to_csv(filename, index = False)
 
 
-def large_un_comtrade_json(path, year, reporter, partners):
+def large_un_comtrade_json(path, year, reporter, partners, hs_level = 2):
     '''
     In case of the data too large to retrieve (Error 5003), 
     collect data from each of the reporter's partner instead.
@@ -106,6 +96,7 @@ def large_un_comtrade_json(path, year, reporter, partners):
         year (int): year
         reporter (dict): a reporter dict with id, text as keys
         partners (list): a list of trade partner dict with id, text as keys
+        hs_level (int): digits of the HS commodity codes
     '''
 
     for i in range(0, len(partners), 5):
@@ -113,12 +104,12 @@ def large_un_comtrade_json(path, year, reporter, partners):
         partner["id"] = ",".join([coun["id"] for coun in partners[i:i + 5]])
         partner["text"] = ",".join([coun["text"] for coun in partners[i:i + 5]])
         
-        export = un_comtrade_json(year, reporter, partner)
+        export = un_comtrade_json(year, reporter, partner, hs_level)
         print(reporter["text"], " to ", partner["text"])
         un_comtrade_to_csv(export['dataset'], path, year, reporter, partner)
 
 
-def download_un_comtrade(path, year, reporters, partners):
+def download_un_comtrade(path, year, reporters, partners, hs_level = 2):
     '''
     Gathering export data from UN comtrade database
 
@@ -127,20 +118,53 @@ def download_un_comtrade(path, year, reporters, partners):
         year (int): year
         reporters (list of dict): list of the dictionaries of reporters
         partners (list of dict): list of the dictionaries of reporters
+        hs_level (int): digits of the HS commodity codes
     '''
 
     for reporter in reporters:
-        export = un_comtrade_json(year, reporter)
+        export = un_comtrade_json(year, reporter, hs_level = hs_level)
         print(reporter["text"])
     
         if export['validation']['status']['value'] == 5003:
             # Encounter large dataset limit
-            large_un_comtrade_json(path, year, reporter, partners)
+            large_un_comtrade_json(path, year, reporter, partners, hs_level)
         else:
             un_comtrade_to_csv(export['dataset'], path, year, reporter)
 
 
-def call_un_comtrade(reporters_path, partners_path, csv_path):
+def downloaded_years(csv_path):
+    '''
+    List the years that already have files in the UN comtrade folder
+
+    Input:
+        csv_path (str): a path of csv file
+
+    Output:
+        (set of int): downloaded years
+    '''
+    if not os.path.isdir(csv_path):
+        return set()
+    return {int(file[-8:-4]) for file in os.listdir(csv_path) 
+            if file.endswith(".csv")}
+
+
+def hs_folder(csv_path, hs_level):
+    '''
+    Folder of the raw files of an HS level: csv_path for HS2 and a
+    sub-folder (hs4/, hs6/) for the deeper levels
+
+    Inputs:
+        csv_path (str): folder of the raw UN comtrade files
+        hs_level (int): digits of the HS commodity codes
+
+    Output:
+        (str): the folder
+    '''
+    return csv_path if hs_level == 2 else f"{csv_path}hs{hs_level}/"
+
+
+def call_un_comtrade(reporters_path, partners_path, csv_path, years = None,
+                     incremental = None, hs_level = None):
     '''
     Main Program for Downloading UN comtrade
 
@@ -148,57 +172,174 @@ def call_un_comtrade(reporters_path, partners_path, csv_path):
         reporters_path (path): a path of reporters file
         partners_path (path): a path of partners file
         csv_path (str): a path of csv file
+        years (list of int): years to download. Default is config.YEARS
+        incremental (bool): if True, skip the years already downloaded.
+            Default is config.INCREMENTAL
+        hs_level (int): digits of the HS commodity codes. Default is
+            config.HS_LEVEL
     '''
+    years = config.YEARS if years is None else years
+    incremental = config.INCREMENTAL if incremental is None else incremental
+    hs_level = config.HS_LEVEL if hs_level is None else hs_level
+    csv_path = hs_folder(csv_path, hs_level)
+    os.makedirs(csv_path, exist_ok = True)
+    if incremental:
+        years = [year for year in years 
+                 if year not in downloaded_years(csv_path)]
+
     reporters = un_comtrade_countries(reporters_path)
     partners = un_comtrade_countries(partners_path) 
-    download_un_comtrade(csv_path, 2019, reporters, partners)
-    download_un_comtrade(csv_path, 2020, reporters, partners)
+    for year in years:
+        download_un_comtrade(csv_path, year, reporters, partners, hs_level)
 
 
 # Concatenate all UN comtrade files and create new csv
-def concat_un_comtrade(raw_folder, csv_folder, partners_path):
+def concat_un_comtrade(raw_folder, csv_folder, partners_path, years = None,
+                       workers = None, hs_level = None):
     '''
     concatenate all UN Comtrade files and export to csv
 
+    The files of each reporter and year are read on a process pool, cast to
+    the final columns, filtered to the major importers and saved as one
+    partition of the un_comtrade dataset (helper/comtrade.py), so deep HS
+    levels never have to fit in memory at once. Files are grouped by the
+    ISO3 code of their reporter, so each partition is written by one
+    process, and the partitions of the reporters without files (or rows)
+    are removed. The HS2 flows are also saved as the un_comtrade_top30 csv
+    and parquet files.
+
     Args:
         raw_folder (str): Folder that keeping the UN Comtrade csv file
         csv_folder (str): Folder that we want to the csv kept
         partners_path (path): a path of partners file
+        years (list of int): years to keep. Default is config.YEARS
+        workers (int): number of processes. Default is the number of cores
+        hs_level (int): digits of the HS commodity codes. Default is
+            config.HS_LEVEL
     '''
     
-    df = pd.DataFrame()
-    dir_list = os.listdir(raw_folder)
-    for file in dir_list:
-        path = raw_folder + file
-        un_comtrade = pd.read_csv(path,
-                                  usecols = ['yr', 'rtCode', 'rtTitle', 
-                                             'rt3ISO', 'ptCode', 'ptTitle', 
-                                             'pt3ISO', 'cmdCode', 
-                                             'cmdDescE', 'TradeValue'],
-                                  dtype = {'rtCode': 'str', 'ptCode': 'str', 
-                                           'cmdCode': 'str'})
-        df = pd.concat([df, un_comtrade])
+    years = config.YEARS if years is None else years
+    hs_level = config.HS_LEVEL if hs_level is None else hs_level
+    folder = hs_folder(raw_folder, hs_level)
+    dim = countries.load_dimension(csv_folder)
+    iso3 = countries.lookup(dim, 'iso3')
+    groups = {}
+    for file in sorted(os.listdir(folder)):
+        if file.endswith(tuple(f"_{year}.csv" for year in years)):
+            # Files are named <reporter>_to_<partners>_<year>.csv
+            reporter_id = shard_reporter(folder + file, dim)
+            if reporter_id:
+                key = (iso3[reporter_id], int(file[-8:-4]))
+                groups.setdefault(key, []).append(folder + file)
     
     major_importers = un_comtrade_countries(partners_path) 
-    major_importers = pd.DataFrame(major_importers)
-
-    # Filter out not major importers
-    un_comtrade = df.merge(major_importers, how = "inner", 
-                           left_on = "ptCode", right_on="id")
-    un_comtrade = un_comtrade.loc[:, ~un_comtrade.columns.isin(['id', 'text'])]
-    un_comtrade.columns = ['year', 'reporter_code','reporter_title', 
-                           'reporter_iso', 'partner_code', 'partner_title', 
-                           'partner_iso', 'comm_code', 'comm_desc', 'trade_val']
-    un_comtrade = un_comtrade.sort_values(by = ['year', 'reporter_title', 
-                                                'partner_title', 'comm_code'])
+    major_importers = pd.to_numeric(pd.DataFrame(major_importers)['id'], 
+                                    errors = 'coerce').dropna().astype(int)
+
+    with ProcessPoolExecutor(workers) as pool:
+        rows = list(pool.map(ingest_un_group, groups.values(), 
+                             repeat(set(major_importers)), repeat(dim), 
+                             repeat(csv_folder), repeat(hs_level)))
+    print(f"{sum(rows)} UN comtrade rows of HS{hs_level} stored.")
+    # Only the years that have files, the others are kept as they are
+    comtrade.prune_partitions(
+        {key for key, count in zip(groups, rows) if count > 0}, 
+        sorted({year for _, year in groups}), hs_level, csv_folder)
+    
+    if hs_level == 2:
+        un_comtrade = comtrade.read_flows(2, years = years, 
+                                          folder = csv_folder, 
+                                          categorical = False)
+        un_comtrade = un_comtrade[list(storage.csv_dtypes(
+            "un_comtrade_top30"))]
+        un_comtrade['comm_code'] = (un_comtrade['comm_code'].astype(str)
+                                    .str.zfill(2))
+        un_comtrade = un_comtrade.sort_values(by = ['year', 'reporter_title', 
+                                                    'partner_title', 
+                                                    'comm_code'])
+        # create csv and parquet files
+        storage.write_clean(un_comtrade, "un_comtrade_top30", csv_folder)
+
+
+def ingest_un_group(paths, major_importers, dim, csv_folder, hs_level):
+    '''
+    Read the files of one reporter and year and save them as a partition of
+    the un_comtrade dataset
+
+    Inputs:
+        paths (list of str): files of the reporter and year
+        major_importers (set of int): UN codes of the major importers
+        dim (DataFrame): the country dimension table
+        csv_folder (str): folder of the dataset
+        hs_level (int): digits of the HS commodity codes
+
+    Output:
+        (int): number of rows saved
+    '''
+    un_comtrade = pd.concat([read_un_shard(path, major_importers) 
+                             for path in paths], ignore_index = True)
     
-    # Due to political reason, hard code for Taiwan ISO
-    un_comtrade.fillna({'reporter_iso':'TWN', 'partner_iso':'TWN'}, 
-                       inplace = True)
+    # Comtrade has no ISO code for Taiwan ("Other Asia, nes"), so the ISO
+    # codes come from the country dimension table
+    un_comtrade = countries.attach_country_id(un_comtrade, 'reporter_code', 
+                                              dim, 'un', 'reporter_id')
+    un_comtrade = countries.attach_country_id(un_comtrade, 'partner_code', 
+                                              dim, 'un', 'partner_id')
+    iso3 = countries.lookup(dim, 'iso3')
+    un_comtrade['reporter_iso'] = iso3[un_comtrade['reporter_id'].to_numpy('int64')]
+    un_comtrade['partner_iso'] = iso3[un_comtrade['partner_id'].to_numpy('int64')]
+    un_comtrade['comm_code'] = un_comtrade['comm_code'].str.zfill(hs_level)
+    un_comtrade['hs_level'] = hs_level
     
-    # create csv file
-    filename = csv_folder + "un_comtrade_top30" + ".csv"
-    un_comtrade.to_csv(filename, index = False)
+    if len(un_comtrade) > 0:
+        storage.write_dataset(un_comtrade, comtrade.DATASET, csv_folder, 
+                              comtrade.PARTITIONS)
+    return len(un_comtrade)
+
+
+def shard_reporter(path, dim):
+    '''
+    Find the reporter of a UN Comtrade file from its first row
+
+    Inputs:
+        path (str): path of the file
+        dim (DataFrame): the country dimension table
+
+    Output:
+        (int): country_id of the reporter, 0 if the file has no rows or
+            the reporter is not in the dimension table
+    '''
+    try:
+        first = pd.read_csv(path, usecols = ['rtCode'], nrows = 1)
+    except (ValueError, pd.errors.EmptyDataError):
+        # A reporter without flows is saved as an empty file
+        return 0
+    if first.empty:
+        return 0
+    return int(countries.attach_country_id(first, 'rtCode', dim, 'un', 
+                                           drop = False)['country_id'][0])
+
+
+def read_un_shard(path, major_importers):
+    '''
+    Read one UN Comtrade file with the final column names and types, and
+    keep the exports to the major importers
+
+    Inputs:
+        path (str): path of the file
+        major_importers (set of int): UN codes of the major importers
+
+    Output:
+        (DataFrame): the kept rows
+    '''
+    un_comtrade = pd.read_csv(path,
+                              usecols = UN_COLUMNS,
+                              dtype = {'yr': 'int16',
+                                       'rtCode': 'int16', 
+                                       'ptCode': 'int16', 
+                                       'cmdCode': 'str'})
+    un_comtrade = un_comtrade[un_comtrade['ptCode'].isin(major_importers)]
+    return un_comtrade[UN_COLUMNS].set_axis(SHARD_COLUMNS, axis = 1)
 
 
 def create_un_data():
@@ -213,12 +354,15 @@ def create_un_data():
     final_csv_path = "proj_cappmait/data/data_from_prog/cleandata/"
     call_un_comtrade(reporters, partners, raw_un_comtrade_path)
     concat_un_comtrade(raw_un_comtrade_path, final_csv_path, partners)
+    trade_store.build_store(final_csv_path)
+    integrity.build_manifest()
 
 
 def check_error(path):
     '''
     List the error file, use when we want to
-    check some files might be corrupted
+    check some files might be corrupted. Files are checked for their size,
+    header and row count without being parsed.
 
     Input:
         path (str): a folder kept files
@@ -226,12 +370,4 @@ def check_error(path):
     Return:
         (list): list of error files
     '''
-    dir_list = os.listdir(path)
-    blank = []
-    for file in dir_list:
-        path = path + file
-        df = pd.read_csv(path)
-        if df.shape[0] == 0:
-            blank.append(file)
-    
-    return blank
+    return integrity.check_error(path, columns = UN_COLUMNS)
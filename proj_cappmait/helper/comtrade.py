@@ -0,0 +1,189 @@
+'''
+Module to read the UN Comtrade flows at any HS depth.
+
+The flows are kept as a parquet dataset partitioned by reporter, year and
+HS level (un_comtrade/reporter_iso=AUS/year=2019/hs_level=6/...). Readers
+only open the partitions matching their filters and only read the columns
+they need, so HS4 and HS6 flows are never loaded as a whole. Commodity
+codes are strings of hs_level digits, and codes of a deeper level roll up to
+a coarser level on demand (HS6 010121 is HS4 0101 and HS2 01).
+'''
+import os
+import shutil
+import pyarrow.dataset as ds
+from proj_cappmait.helper import storage
+
+DATASET = "un_comtrade"
+PARTITIONS = ["reporter_iso", "year", "hs_level"]
+HS_LEVELS = [2, 4, 6]
+
+
+def open_dataset(folder = storage.DATA_PATH):
+    '''
+    Open the partitioned UN Comtrade dataset of a folder
+
+    Input:
+        folder (str): folder of the dataset
+
+    Output:
+        (pyarrow Dataset): the dataset, None if the folder has none
+    '''
+    if not os.path.isdir(folder + DATASET):
+        return None
+    return ds.dataset(folder + DATASET, format="parquet",
+                      partitioning="hive")
+
+
+def stored_levels(folder = storage.DATA_PATH):
+    '''
+    List the HS levels stored in the dataset, from the partition folders
+    (no file is read)
+
+    Input:
+        folder (str): folder of the dataset
+
+    Output:
+        (list of int): stored HS levels
+    '''
+    dataset = open_dataset(folder)
+    if dataset is None:
+        return []
+    return sorted({int(part.split("=")[1])
+                   for path in dataset.files
+                   for part in path.split("/")
+                   if part.startswith("hs_level=")})
+
+
+def read_flows(hs_level, columns = None, years = None, reporters = None,
+               folder = storage.DATA_PATH, categorical = True):
+    '''
+    Read the flows of one HS level. The filters are pushed down to the
+    partitions, and only the requested columns are read.
+
+    Inputs:
+        hs_level (int): stored HS level
+        columns (list of str): columns to read. Default reads every column
+        years (list of int): years to read. Default reads every year
+        reporters (list of str): ISO3 codes of the reporters to read.
+            Default reads every reporter
+        folder (str): folder of the dataset
+        categorical (bool): if True, dictionary encoded columns are loaded
+            as pandas categories, otherwise as strings
+
+    Output:
+        (DataFrame): the flows
+    '''
+    condition = ds.field("hs_level") == hs_level
+    if years is not None:
+        condition &= ds.field("year").isin(list(years))
+    if reporters is not None:
+        condition &= ds.field("reporter_iso").isin(list(reporters))
+    table = open_dataset(folder).to_table(columns=columns, filter=condition)
+    if not categorical:
+        table = storage.decode(table)
+    return table.to_pandas()
+
+
+def prune_partitions(keep, years, hs_level, folder = storage.CLEAN_PATH):
+    '''
+    Remove the partitions of the years and HS level whose reporter is not
+    kept, like a reporter gone from the raw files
+
+    Inputs:
+        keep (set of tuple): reporter ISO3 code and year of the partitions
+            to keep
+        years (list of int): years to prune
+        hs_level (int): HS level to prune
+        folder (str): folder of the dataset
+    '''
+    root = folder + DATASET + "/"
+    if not os.path.isdir(root):
+        return
+    for reporter_folder in sorted(os.listdir(root)):
+        if not reporter_folder.startswith("reporter_iso="):
+            continue
+        reporter = reporter_folder.split("=", 1)[1]
+        for year in years:
+            if (reporter, year) not in keep:
+                year_folder = f"{root}{reporter_folder}/year={year}/"
+                shutil.rmtree(year_folder + f"hs_level={hs_level}",
+                              ignore_errors=True)
+                if os.path.isdir(year_folder) and not os.listdir(year_folder):
+                    os.rmdir(year_folder)
+
+
+def rollup_codes(codes, from_level, to_level):
+    '''
+    Roll HS codes up to a coarser level
+
+    Inputs:
+        codes (Series of str): HS codes of from_level digits
+        from_level (int): HS level of the codes
+        to_level (int): HS level to roll up to
+
+    Output:
+        (Series of str): HS codes of to_level digits
+    '''
+    if to_level > from_level:
+        raise ValueError(f"Cannot roll HS{from_level} down to HS{to_level}")
+    return codes.str[:to_level]
+
+
+def commodity_totals(years, hs_level = 2, reporter = None,
+                     folder = storage.DATA_PATH):
+    '''
+    Total UN Comtrade exports of each commodity, one column per year, at
+    any HS level. The stored level closest to hs_level is read and rolled
+    up when it is deeper.
+
+    Inputs:
+        years (list of int): years to sum
+        hs_level (int): HS level of the commodities
+        reporter (str): ISO3 code of the reporter. Default sums all
+            reporters
+        folder (str): folder of the dataset
+
+    Output:
+        (DataFrame): comm_code, comm_desc and a column export_{year} for
+            each year, the same columns as trade_store.commodity_totals
+    '''
+    deeper = [level for level in stored_levels(folder) if level >= hs_level]
+    if not deeper:
+        raise ValueError(f"No HS{hs_level} or deeper flows in {folder}")
+    source = min(deeper)
+    reporters = [reporter] if reporter is not None else None
+    flows = read_flows(source, ["year", "comm_code", "trade_val"], years,
+                       reporters, folder, categorical=False)
+    flows["comm_code"] = rollup_codes(flows["comm_code"], source, hs_level)
+
+    totals = flows.pivot_table("trade_val", "comm_code", "year", "sum")
+    totals = totals.reindex(columns=list(years))
+    totals.columns = [f"export_{year}" for year in years]
+    totals = totals.reset_index()
+    totals.insert(1, "comm_desc", commodity_names(totals["comm_code"],
+                                                  hs_level, years, folder))
+    return totals
+
+
+def commodity_names(codes, hs_level, years = None,
+                    folder = storage.DATA_PATH):
+    '''
+    Descriptions of HS codes, from the flows of their level. Codes of a
+    level that is not stored keep their code as description.
+
+    Inputs:
+        codes (Series of str): HS codes
+        hs_level (int): HS level of the codes
+        years (list of int): years of the flows to read the descriptions
+            from. Default reads every year
+        folder (str): folder of the dataset
+
+    Output:
+        (Series of str): descriptions, in the order of codes
+    '''
+    if hs_level not in stored_levels(folder):
+        return codes.values
+    names = read_flows(hs_level, ["comm_code", "comm_desc"], years,
+                       folder=folder, categorical=False)
+    names = names.drop_duplicates("comm_code").set_index("comm_code")
+    return codes.map(names["comm_desc"]).fillna(codes).values
@@ -0,0 +1,125 @@
+'''
+Module for the country dimension table shared by every dataset.
+
+The table gives each country a small integer key (country_id) and maps it to
+the codes used by the data sources: ISO2 (IMF), ISO3 (WTO, OWID, World Bank)
+and UN Comtrade numeric codes. Datasets carry country_id columns, so joins
+and groupbys run on int16 keys instead of strings.
+'''
+import numpy as np
+import pandas as pd
+from proj_cappmait.helper import storage
+
+DIMENSION = "country_dim"
+
+# UN Comtrade codes that differ from the ISO numeric code. Comtrade reports
+# Taiwan as "Other Asia, nes" (490)
+UN_CODES = {"FRA": 251, "IND": 699, "ITA": 381, "TWN": 490, "CHE": 757,
+            "USA": 842}
+
+# Columns of the dimension table keyed by each kind of code
+KEYS = {"iso2": "iso2", "iso3": "iso3", "imf": "imf_code", "un": "un_code"}
+
+
+def build_dimension(codes_path = (storage.RAW_PATH +
+                                  "countries_codes_and_coordinates.csv")):
+    '''
+    Build the country dimension table from the country code data. Keys
+    follow the order of the country code data.
+
+    Input:
+        codes_path (str): path of the country code csv
+
+    Output:
+        (DataFrame): country_id, name, iso2, iso3, numeric, imf_code,
+            un_code, latitude and longitude
+    '''
+    # "NA" is the ISO2 code of Namibia, not a missing value
+    codes = pd.read_csv(codes_path, keep_default_na=False, na_values=[''])
+    dim = pd.DataFrame({
+        "country_id": np.arange(1, len(codes) + 1, dtype="int16"),
+        "name": codes["Country"],
+        "iso2": codes["Alpha-2code"],
+        "iso3": codes["Alpha-3code"],
+        "numeric": codes["Numericcode"].astype("int16"),
+        "imf_code": codes["Alpha-2code"],
+        "latitude": codes["Latitude(average)"],
+        "longitude": codes["Longitude(average)"],
+    })
+    dim.insert(6, "un_code", dim["iso3"].map(UN_CODES)
+               .fillna(dim["numeric"]).astype("int16"))
+    return dim
+
+
+def write_dimension(folder = storage.CLEAN_PATH):
+    '''
+    Build the country dimension table and save it
+
+    Input:
+        folder (str): folder of the clean datasets
+    '''
+    storage.write_clean(build_dimension(), DIMENSION, folder)
+
+
+def load_dimension(folder = storage.DATA_PATH):
+    '''
+    Load the country dimension table. The copy in proj_cappmait/data is
+    used when the folder has none.
+
+    Input:
+        folder (str): folder of the table
+
+    Output:
+        (DataFrame): the country dimension table
+    '''
+    if not storage.has_clean(DIMENSION, folder):
+        folder = storage.DATA_PATH
+    return storage.read_clean(DIMENSION, folder, categorical=False)
+
+
+def attach_country_id(df, column, dim, key = "iso3", id_column = "country_id",
+                      drop = True):
+    '''
+    Add the integer key of the countries of a column
+
+    Inputs:
+        df (DataFrame): the data
+        column (str): column of df holding the country codes
+        dim (DataFrame): the country dimension table
+        key (str): kind of code in column: iso2, iso3, imf or un
+        id_column (str): name of the new column
+        drop (bool): if True, drop the rows whose code is not in the
+            dimension table. Otherwise their key is 0, which matches no
+            country.
+
+    Output:
+        (DataFrame): df with the id_column
+    '''
+    codes = dim[KEYS[key]]
+    if key == "un":
+        codes = codes.astype("int64")
+        values = pd.to_numeric(df[column], errors="coerce")
+    else:
+        values = df[column].astype("object")
+    ids = values.map(pd.Series(dim["country_id"].values, index=codes))
+    df = df.assign(**{id_column: ids.fillna(0).astype("int16")})
+    if drop:
+        return df[df[id_column] > 0]
+    return df
+
+
+def lookup(dim, column):
+    '''
+    Array to translate country keys into a column of the dimension table,
+    as lookup(dim, column)[country_id]
+
+    Inputs:
+        dim (DataFrame): the country dimension table
+        column (str): column of the dimension table
+
+    Output:
+        (numpy array): the values of column indexed by country_id
+    '''
+    values = np.empty(dim["country_id"].max() + 1, dtype="object")
+    values[dim["country_id"].to_numpy("int64")] = dim[column].values
+    return values
@@ -0,0 +1,26 @@
+'''
+Module to add a health check endpoint to the servers of the apps.
+
+/healthz answers with the name of the app, the process id and the uptime of
+the process, with the Flask development server as with gunicorn workers.
+'''
+import os
+import time
+from flask import jsonify
+
+
+def add_health(server, name):
+    '''
+    Add a /healthz endpoint to a Flask server
+
+    Inputs:
+        server (Flask): the server of a Dash app
+        name (str): name of the app reported by the endpoint
+    '''
+    started = time.time()
+
+    def healthz():
+        return jsonify(status="ok", app=name, pid=os.getpid(),
+                       uptime=round(time.time() - started, 1))
+
+    server.add_url_rule("/healthz", "healthz", healthz)
@@ -2,45 +2,193 @@
 Module to construct network & sankey diagram 
 in the interactive dashboard
 '''
-import pandas as pd
-
-def construct_networkgraph():
+import math
+from collections import defaultdict
+import networkx as nx
+import numpy as np
+from proj_cappmait import config
+from proj_cappmait.helper import countries, shared_data, storage, trade_cube
+
+def construct_networkgraph(period = None, resolution = "month"):
     '''
     Construct a network graph. 
     Load the partners data and pagerank data, construct country node and edge objects, 
     and add pagerank attribute to each country node. 
 
-    Input: None
+    Input:
+        period(str): A month or quarter of the monthly IMF data, compared 
+            with the same period of the year before. Default compares the 
+            years config.BASE_YEAR and config.COMPARE_YEAR. 
+        resolution(str): The resolution of period, month or quarter. 
 
     Output: A graph object. 
     '''
-    partners = pd.read_csv("proj_cappmait/data/imf_import_export_cleaned.csv", \
-        dtype={"2019":"float", "2020":"float"})
-    pagerank = pd.read_csv("proj_cappmait/data/pagerank.csv", \
-        names=["country_code", "pagerank"], \
-        dtype={"country_code":"str", "pagerank":"float"})
-
-    graph = Graph(partners)
+    dim = countries.load_dimension()
+    if period is None:
+        columns = [str(config.BASE_YEAR), str(config.COMPARE_YEAR)]
+        # Shared between the dashboard processes, not copied
+        partners = shared_data.shared_table("imf_partners", 
+            lambda: storage.read_clean("imf_import_export_cleaned"), 
+            shared_data.clean_sources("imf_import_export_cleaned"))
+        pagerank = storage.read_clean("pagerank", categorical=False)
+    else:
+        periods, values = trade_cube.rollup(*trade_cube.shared_cube(), 
+                                            resolution)
+        columns = [trade_cube.year_before(periods, period, resolution), 
+                   period]
+        partners = trade_cube.period_partners(periods, values, columns, dim)
+        pagerank = storage.read_clean("pagerank_periods", categorical=False)
+        pagerank = pagerank.loc[pagerank["period"] == period, 
+                                ["country_code", "pagerank"]]
+
+    graph = Graph(partners, dim, columns)
     graph.update_network()
     graph.update_pagerank(pagerank)
     return graph
 
+# Group of the countries without a continent in the OWID country data
+OTHER = "Other"
+
+def load_continents():
+    '''
+    Load the continent of each country from the OWID country data. 
+
+    Output:
+        continents(dict): An ISO3 country code to its continent. 
+    '''
+    info = storage.read_clean("owid_country_info", 
+        columns=["iso_code", "continent"], categorical=False).dropna()
+    return dict(zip(info["iso_code"], info["continent"]))
+
+def cluster_network(nodes, edges, continents, expanded = None):
+    '''
+    Group the country nodes by continent for the overview of the network. 
+    Each continent is one node, except the expanded continent whose 
+    countries are shown. Edges are moved to the nodes shown, and the edges 
+    between the same two nodes are merged by adding their weights. 
+
+    Input:
+        nodes(dict): A country code to a tuple of its label(str) and 
+            pagerank(float). 
+        edges(list): A list of tuple of source(str), target(str) and 
+            weight(float), between country codes. 
+        continents(dict): A country code to its continent, OTHER if missing. 
+        expanded(str): The continent whose countries are shown. Default 
+            shows the continents only. 
+
+    Output:
+        shown_nodes(list): A list of tuple of id(str), label(str), 
+            pagerank(float) and continent(str). The id of a continent node 
+            is the continent, and its pagerank the sum of its countries. 
+        shown_edges(list): A list of tuple of source(str), target(str) and 
+            weight(float), between the nodes shown. 
+    '''
+    groups = {code: continents.get(code, OTHER) for code in nodes}
+    members = defaultdict(list)
+    for code in nodes:
+        members[groups[code]].append(code)
+
+    shown_nodes = []
+    for continent in sorted(members):
+        pagerank = sum(nodes[code][1] or 0 for code in members[continent])
+        shown_nodes.append((continent, 
+                            f'{continent} ({len(members[continent])})', 
+                            pagerank, continent))
+        if continent == expanded:
+            shown_nodes += [(code, *nodes[code], continent) 
+                            for code in members[continent]]
+
+    weights = defaultdict(float)
+    for source, target, weight in edges:
+        if groups[source] != expanded:
+            source = groups[source]
+        if groups[target] != expanded:
+            target = groups[target]
+        if source != target:
+            weights[(source, target)] += weight
+    shown_edges = [(source, target, weight) 
+                   for (source, target), weight in weights.items()]
+    return shown_nodes, shown_edges
+
+def expanded_positions(centers, expanded, codes, edges, 
+                       scale = 200, distance = 500):
+    '''
+    Place the countries of an expanded continent around the position of 
+    the continent in the overview, and move the other continents away 
+    so that they stay out of its countries. 
+
+    Input:
+        centers(dict): A continent to its position in the overview. 
+        expanded(str): The expanded continent. 
+        codes(list): The country codes of the expanded continent. 
+        edges(list): A list of tuple of source(str), target(str) and weight. 
+        scale(int): The radius of the countries around the continent. 
+        distance(int): The smallest distance of the other continents. 
+
+    Output:
+        positions(dict): A node id to a dict of x and y. 
+    '''
+    center = centers[expanded]
+    positions = {}
+    for continent, position in centers.items():
+        dx = position['x'] - center['x']
+        dy = position['y'] - center['y']
+        stretch = max(1, distance / max(math.hypot(dx, dy), 1e-9))
+        positions[continent] = {'x': round(center['x'] + dx * stretch, 1), 
+                                'y': round(center['y'] + dy * stretch, 1)}
+    inside = [(source, target, weight) for source, target, weight in edges 
+              if source in codes and target in codes]
+    for code, position in node_positions(codes, inside, scale).items():
+        positions[code] = {'x': round(center['x'] + position['x'], 1), 
+                           'y': round(center['y'] + position['y'], 1)}
+    return positions
+
+def node_positions(codes, edges, scale = 600, seed = 0):
+    '''
+    Compute the positions of the network nodes once on the server, with a 
+    force-directed layout like the cose layout of cytoscape, so that the 
+    browser only places them (preset layout). 
+
+    Input:
+        codes(list): The country codes of the nodes. 
+        edges(list): A list of tuple of source(str), target(str) and weight. 
+        scale(int): Half the width of the drawing, in pixels. 
+        seed(int): Seed of the initial positions, so that a view is always 
+            drawn the same way. 
+
+    Output:
+        positions(dict): A country code to a dict of x and y. 
+    '''
+    graph = nx.Graph()
+    graph.add_nodes_from(codes)
+    graph.add_edges_from((source, target) for source, target, _ in edges)
+    layout = nx.spring_layout(graph, scale=scale, seed=seed)
+    return {code: {'x': round(float(x), 1), 'y': round(float(y), 1)} 
+            for code, (x, y) in layout.items()}
+
 class Graph:
     '''
     A class for network graph with nodes and edges. 
     '''
 
-    def __init__(self, partners):
+    def __init__(self, partners, dim, columns = None):
         '''
         A constructor. 
 
         Input: 
             partners(Pandas Dataframe): An IMF data of bi-trade
             (from exporter = source to importer = target) 
-            in 2019 and 2020. 
+            in 2019 and 2020, with the country keys from_id and to_id. 
+            dim(Pandas Dataframe): The country dimension table. 
+            columns(list): The columns of partners with the trade volume 
+            of the two compared periods. Default is the years 
+            config.BASE_YEAR and config.COMPARE_YEAR. 
         
         Attribute:
             partners(Pandas Dataframe)
+            columns(list)
+            codes(numpy array) : ISO3 country code indexed by country key. 
+            names(numpy array) : Country name indexed by country key. 
             nodes(list) : A list of node objects for whole network nodes. 
             edges(list) : A list of tuple for whole network edges. 
                         Each element is a tuple of source(str), target(str), 
@@ -50,6 +198,10 @@ class Graph:
                         source(str), target(str), trade volume in either 2019 or 2020, and color. 
         '''
         self.partners = partners
+        self.columns = (columns if columns is not None else
+                        [str(config.BASE_YEAR), str(config.COMPARE_YEAR)])
+        self.codes = countries.lookup(dim, "iso3")
+        self.names = countries.lookup(dim, "name")
         self.nodes = dict()
         self.edges = list()
         self.sankeynodes = list()
@@ -59,12 +211,15 @@ class Graph:
         '''
         Process the partner dataframe, and build up the country node objects. 
         '''
-        for volume_2019, volume_2020, from_name, from_code, to_name, to_code\
-            in self.partners.itertuples(index=False):
+        columns = self.columns + ["from_id", "to_id"]
+        for volume_2019, volume_2020, from_id, to_id \
+            in self.partners[columns].itertuples(index=False):
+            from_code = self.codes[from_id]
+            to_code = self.codes[to_id]
             if from_code not in self.nodes:
-                self.nodes[from_code] = Node(from_code, from_name)
+                self.nodes[from_code] = Node(from_code, self.names[from_id])
             if to_code not in self.nodes:
-                self.nodes[to_code] = Node(to_code, to_name)
+                self.nodes[to_code] = Node(to_code, self.names[to_id])
             self.nodes[from_code].add_partner(True, self.nodes[to_code], volume_2019, volume_2020)
             self.nodes[to_code].add_partner(False, self.nodes[from_code], volume_2019, volume_2020)
 
@@ -76,7 +231,31 @@ class Graph:
             pagerank_df(Pandas Dataframe): A pagerank for each country. 
         '''
         for code, value in pagerank_df.itertuples(index=False):
-            self.nodes[code].pagerank = value
+            if code in self.nodes:
+                self.nodes[code].pagerank = value
+
+    def node_data(self):
+        '''
+        The label and pagerank of each country node. 
+
+        Output:
+            nodes(dict): A country code to a tuple of label(str) and 
+                pagerank(float). 
+        '''
+        return {code: (node.label, node.pagerank) 
+                for code, node in self.nodes.items()}
+
+    def edge_index(self, is_exporter):
+        '''
+        Sort the partner edges of a view once, for EdgeIndex.select. 
+
+        Input:
+            is_exporter(boolean): True if the country node is exporter, and False otherwise. 
+
+        Output:
+            An EdgeIndex object. 
+        '''
+        return EdgeIndex(self.partners, self.codes, self.columns, is_exporter)
 
     def find_best_partners(self, num, is_exporter):
         '''
@@ -190,6 +369,82 @@ class Graph:
         return f'(nodes = {self.nodes})'
 
 
+class EdgeIndex:
+    '''
+    A class for the partner edges of one view of the network, sorted once 
+    so that the edges to the top partners of each country above a trade 
+    volume are found by binary searches. 
+    '''
+
+    def __init__(self, partners, codes, columns, is_exporter):
+        '''
+        A constructor. Partners of a country are ranked by their trade 
+        volume in the first compared period, like find_best_partners. 
+
+        Input: 
+            partners(Pandas Dataframe): The partners data of a Graph. 
+            codes(numpy array): ISO3 country code indexed by country key. 
+            columns(list): The columns of the two compared periods. 
+            is_exporter(boolean): True if the country node is exporter, and 
+            False otherwise. 
+
+        Attribute:
+            sources(numpy array): The country of each edge. 
+            targets(numpy array): The partner of each edge. 
+            volumes(numpy array): The trade volume in the first period. 
+            weights(numpy array): The change of trade volume. 
+            The edges are sorted by rank of the partner, then by volume. 
+            starts(numpy array): The position of the first edge of each rank. 
+        '''
+        from_ids = partners["from_id"].to_numpy("int64")
+        to_ids = partners["to_id"].to_numpy("int64")
+        nodes, others = ((from_ids, to_ids) if is_exporter 
+                         else (to_ids, from_ids))
+        volumes = partners[columns[0]].to_numpy("float64")
+        weights = partners[columns[1]].to_numpy("float64") - volumes
+
+        # Rank of each edge among the partners of its country (stable, so 
+        # ties keep the order of the data like find_best_partners)
+        order = np.lexsort((-volumes, nodes))
+        firsts = np.r_[True, nodes[order][1:] != nodes[order][:-1]]
+        positions = np.arange(len(order))
+        ranks = np.empty(len(order), dtype="int64")
+        ranks[order] = positions - np.maximum.accumulate(
+            np.where(firsts, positions, 0))
+
+        order = np.lexsort((volumes, ranks))
+        self.sources = codes[nodes[order]]
+        self.targets = codes[others[order]]
+        self.volumes = volumes[order]
+        self.weights = weights[order]
+        self.starts = np.searchsorted(ranks[order], 
+                                      np.arange(ranks.max(initial=-1) + 2))
+
+    def select(self, top, threshold = 0):
+        '''
+        Find the edges to the top partners of each country with a trade 
+        volume of at least threshold: one binary search and one slice 
+        per rank. 
+
+        Input:
+            top(int): The number of best partners of each country. 
+            threshold(float): The smallest trade volume. 
+
+        Output:
+            edges(list): A list of tuple of source(str), target(str) and 
+                change of trade volume(float). 
+        '''
+        edges = []
+        for rank in range(min(top, len(self.starts) - 1)):
+            start, end = self.starts[rank], self.starts[rank + 1]
+            first = start + np.searchsorted(self.volumes[start:end], 
+                                            threshold)
+            edges += zip(self.sources[first:end].tolist(), 
+                         self.targets[first:end].tolist(), 
+                         self.weights[first:end].tolist())
+        return edges
+
+
 class Node:
     '''
     Class for each country node.
@@ -0,0 +1,198 @@
+'''
+Module to share the loaded tables and arrays between processes.
+
+A table is published as one .npy file per column (string columns as integer
+codes, their values in a small json file) in config.SHARED_PATH, which is in
+memory (/dev/shm) on Linux. Every process attaches to the files as read-only
+memory maps, so the columns are not copied: all the dashboard workers use
+the same pages, and the memory used grows with the data, not with the number
+of workers.
+
+The published files are named after the version of the source files (their
+absolute paths, sizes and modification times) and of the years of
+config.py, which the loaders filter and type the data with. A process
+attaches to the files published by another process when they did not
+change, and publishes them again otherwise. The old versions are removed,
+the processes still attached to them keep their maps.
+'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from proj_cappmait import config
+from proj_cappmait.helper import storage
+
+
+def clean_sources(name, folder = storage.DATA_PATH):
+    '''
+    Source files of a clean dataset (helper/storage.py)
+
+    Inputs:
+        name (str): name of the dataset
+        folder (str): folder of the files
+
+    Output:
+        (list of str): paths of the parquet file and of the csv copy
+    '''
+    return [folder + name + ".parquet", folder + name + ".csv"]
+
+
+def version(sources):
+    '''
+    Version of the source files: a hash of their absolute paths, sizes and
+    modification times, and of the years of the configuration
+
+    Input:
+        sources (list of str): paths of the files
+
+    Output:
+        (str): the version
+    '''
+    stats = [[os.path.abspath(path), os.stat(path).st_size, 
+              os.stat(path).st_mtime_ns]
+             if os.path.exists(path) else [os.path.abspath(path), None, None]
+             for path in sources]
+    years = [config.YEARS, config.BASE_YEAR, config.COMPARE_YEAR]
+    return hashlib.sha1(json.dumps([stats, years]).encode()).hexdigest()[:16]
+
+
+def shared_table(name, loader, sources, folder = config.SHARED_PATH):
+    '''
+    Attach to a shared table, published first if the sources changed
+
+    Inputs:
+        name (str): name of the shared table
+        loader (function): function without arguments loading the table
+            from the sources
+        sources (list of str): paths of the files the table is loaded from
+        folder (str): folder of the shared files
+
+    Output:
+        (DataFrame): the table, with read-only columns. String columns are
+            categories
+    '''
+    path = folder + name + "/" + version(sources)
+    if not os.path.exists(path):
+        publish(path, *table_arrays(loader()))
+    return attach_table(path)
+
+
+def shared_arrays(name, loader, sources, folder = config.SHARED_PATH):
+    '''
+    Attach to shared numpy arrays, published first if the sources changed
+
+    Inputs:
+        name (str): name of the shared arrays
+        loader (function): function without arguments returning the arrays
+            as a dict of name to numpy array
+        sources (list of str): paths of the files the arrays are loaded from
+        folder (str): folder of the shared files
+
+    Output:
+        (dict): name to read-only numpy array
+    '''
+    path = folder + name + "/" + version(sources)
+    if not os.path.exists(path):
+        publish(path, loader(), {})
+    return attach(path)[0]
+
+
+def table_arrays(df):
+    '''
+    Split a table into one numpy array per column. String and categorical
+    columns become integer codes.
+
+    Input:
+        df (DataFrame): the table
+
+    Output:
+        arrays (dict): column name to numpy array
+        categories (dict): column name to the list of values of its codes
+    '''
+    arrays = {}
+    categories = {}
+    for col in df.columns:
+        values = df[col]
+        if values.dtype == object or values.dtype.name == "category":
+            values = values.astype("category")
+            arrays[col] = values.cat.codes.to_numpy()
+            categories[col] = values.cat.categories.tolist()
+        elif isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+            # Nullable integers (parsed from csv), missing values as NaN
+            arrays[col] = (values.to_numpy("float64", na_value=np.nan)
+                           if values.hasnans else
+                           values.to_numpy(values.dtype.numpy_dtype))
+        else:
+            arrays[col] = values.to_numpy()
+    return arrays, categories
+
+
+def publish(path, arrays, categories):
+    '''
+    Write the shared files of a version, and remove the other versions.
+    The files are written in a temporary folder renamed at the end, so no
+    process attaches to a half written version.
+
+    Inputs:
+        path (str): folder of the version
+        arrays (dict): name to numpy array
+        categories (dict): name to the values of the codes of an array
+    '''
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".publish-")
+    for i, values in enumerate(arrays.values()):
+        np.save(f"{tmp}/{i}.npy", np.ascontiguousarray(values))
+    with open(tmp + "/meta.json", "w") as f:
+        json.dump({"names": list(arrays), "categories": categories}, f)
+    os.chmod(tmp, 0o755)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Published by another process in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+    for other in os.listdir(parent):
+        if other != os.path.basename(path) and not other.startswith("."):
+            shutil.rmtree(parent + "/" + other, ignore_errors=True)
+
+
+def attach(path):
+    '''
+    Memory map the shared files of a version
+
+    Input:
+        path (str): folder of the version
+
+    Output:
+        arrays (dict): name to read-only numpy array
+        categories (dict): name to the values of the codes of an array
+    '''
+    with open(path + "/meta.json") as f:
+        meta = json.load(f)
+    arrays = {name: np.load(f"{path}/{i}.npy", mmap_mode="r")
+              for i, name in enumerate(meta["names"])}
+    return arrays, meta["categories"]
+
+
+def attach_table(path):
+    '''
+    Build a table on the memory mapped columns of a version, without
+    copying them
+
+    Input:
+        path (str): folder of the version
+
+    Output:
+        (DataFrame): the table
+    '''
+    arrays, categories = attach(path)
+    columns = {}
+    for name, values in arrays.items():
+        if name in categories:
+            values = pd.Categorical.from_codes(values, categories[name])
+        columns[name] = values
+    # copy=False keeps one block per column, on the memory maps
+    return pd.DataFrame(columns, copy=False)
@@ -0,0 +1,209 @@
+'''
+Module to coalesce identical calls of the expensive dashboard builders.
+
+A function wrapped by a SingleFlight computes each distinct call once: a
+call made while the same call is running in another thread waits for it and
+gets its result, and later calls get the result from a bounded memo (the
+least recently used results are dropped first). With a store (a Flask-Caching
+cache on a folder or a Redis server), the results are also saved there, so
+the other worker processes, and the processes started later, reuse them
+instead of computing them again. Results are stored under the version of the
+data they are built from, so new data never gets older results.
+
+The results are shared by every caller, so they must not be modified.
+'''
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+
+class Flight:
+    '''
+    Class for one running call and the callers waiting for it.
+    '''
+
+    def __init__(self):
+        '''
+        A constructor.
+
+        Attributes:
+            done (threading.Event): set when the call returned or raised
+            result: the value returned
+            error (Exception): the error raised, None if it returned
+        '''
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        '''
+        Wait for the call and return its result, or raise its error
+        '''
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    '''
+    Class for a memo of function calls, computing each call once.
+    '''
+
+    def __init__(self, maxsize = 128, store = None, version = ""):
+        '''
+        A constructor.
+
+        Inputs:
+            maxsize (int): number of results kept in memory
+            store (Cache): cache with get and set methods shared between
+                processes. Default keeps the results in this process only
+            version (str): version of the data the results are built from,
+                part of the keys of the store
+
+        Attributes:
+            memo (OrderedDict): call key to result, least recently used
+                first
+            flights (dict): call key to the Flight of a running call
+            lock (threading.Lock): lock of memo and flights
+            hits, misses, coalesced (int): calls answered from the memo or
+                the store, calls computed, and calls that waited for a
+                running call
+        '''
+        self.maxsize = maxsize
+        self.store = store
+        self.version = version
+        self.memo = OrderedDict()
+        self.flights = dict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __call__(self, func):
+        '''
+        Wrap a function. The arguments must be hashable.
+
+        Input:
+            func (function): the function
+
+        Output:
+            (function): the wrapped function
+        '''
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__module__, func.__qualname__, args,
+                   tuple(sorted(kwargs.items())))
+            return self.call(key, func, args, kwargs)
+
+        wrapper.flights = self
+        return wrapper
+
+    def call(self, key, func, args, kwargs):
+        '''
+        Return the result of a call, from the memo, from a running identical
+        call, from a file, or by running it
+
+        Inputs:
+            key (tuple): key of the call
+            func (function): the function
+            args (tuple), kwargs (dict): its arguments
+
+        Output:
+            the result of func(*args, **kwargs)
+        '''
+        with self.lock:
+            if key in self.memo:
+                self.memo.move_to_end(key)
+                self.hits += 1
+                return self.memo[key]
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.wait()
+        return self.run(key, flight, func, args, kwargs)
+
+    def run(self, key, flight, func, args, kwargs):
+        '''
+        Run a call as the leader of its flight and share its result
+        '''
+        found = False
+        try:
+            found, result = self.read(key)
+            if not found:
+                result = func(*args, **kwargs)
+                self.write(key, result)
+            flight.result = result
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                if flight.error is None:
+                    if found:
+                        self.hits += 1
+                    else:
+                        self.misses += 1
+                    self.memo[key] = flight.result
+                    while len(self.memo) > self.maxsize:
+                        self.memo.popitem(last=False)
+                del self.flights[key]
+            flight.done.set()
+        return result
+
+    def store_key(self, key):
+        '''
+        Key of the result of a call in the store: the data version, the
+        function and a hash of the arguments
+        '''
+        module, name, *arguments = key
+        digest = hashlib.sha1(repr(arguments).encode()).hexdigest()
+        return f"{self.version}/{module}.{name}/{digest}"
+
+    def read(self, key):
+        '''
+        Load the result of a call saved in the store
+
+        Input:
+            key (tuple): key of the call
+
+        Output:
+            found (bool): True if the result was saved
+            result: the result, None if not found
+        '''
+        if self.store is None:
+            return False, None
+        try:
+            result = self.store.get(self.store_key(key))
+        except Exception as error:
+            # The dashboard works without the store
+            print(f"Cache unavailable: {error}")
+            return False, None
+        return result is not None, result
+
+    def write(self, key, result):
+        '''
+        Save the result of a call in the store for the other processes
+
+        Inputs:
+            key (tuple): key of the call
+            result: the result
+        '''
+        if self.store is None:
+            return
+        try:
+            self.store.set(self.store_key(key), result)
+        except Exception as error:
+            print(f"Cache unavailable: {error}")
+
+    def clear(self):
+        '''
+        Drop the results kept in memory
+        '''
+        with self.lock:
+            self.memo.clear()
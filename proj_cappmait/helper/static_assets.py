@@ -0,0 +1,288 @@
+'''
+Module to serve the static files of the Dash apps from their own server,
+cached by the browsers for good.
+
+Dash serves its javascript bundles (dash, plotly.js in the core components,
+cytoscape) from the server, with their version in the url. The files of
+the assets folder (trade.css, lazy.js) get their modification time in the
+url (?m=...), and the map outlines (topojson) of the geo figures are served
+from a folder named after the hash of their content, instead of the plotly
+CDN. These urls change when the content changes, so they are answered as
+immutable for a year: repeat visits download nothing.
+
+The responses are sent gzip or brotli compressed when the browser accepts
+it. The compressed variants are made once, named after the hash of the
+content, in a folder shared by the worker processes and kept across
+restarts. precompress makes the variants of the bundles before the workers
+start.
+'''
+import functools
+import gzip
+import hashlib
+import os
+import pkgutil
+import sys
+import tempfile
+import flask
+from dash import _dash_renderer, dash_table, dcc, html
+from dash.development.base_component import ComponentRegistry
+from dash.fingerprint import check_fingerprint
+from proj_cappmait import config
+from proj_cappmait.getdata import fetch
+
+try:
+    # Brotli is optional, gzip is used without it
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+COMPRESSIBLE = {"application/javascript", "text/javascript", "text/css",
+                "application/json"}
+# Preferred first
+ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+
+# Default location of the topojson files of plotly.js
+TOPOJSON_URL = "https://cdn.plot.ly/"
+GEO_TRACES = {"choropleth", "scattergeo"}
+# Seconds to wait for a library to download, a firewall may drop the
+# packets without an answer
+DOWNLOAD_TIMEOUT = 10
+
+
+def add_static_cache(app, prefixes = (), 
+                     folder = config.STATIC_PATH):
+    '''
+    Send the fingerprinted files of a Dash app as immutable, and
+    compressed when the browser accepts it
+
+    Inputs:
+        app (Dash): the app
+        prefixes (list of str): other paths of the app whose urls change
+            with their content, like "/figures/"
+        folder (str): folder of the compressed variants
+    '''
+    @app.server.after_request
+    def cache_static(response):
+        if (flask.request.method != "GET" or response.status_code != 200 or
+            not fingerprinted(app, flask.request, prefixes)):
+            return response
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.vary.add("Accept-Encoding")
+        encoding = next((encoding for encoding in ENCODINGS
+                         if encoding in flask.request.accept_encodings),
+                        None)
+        if (encoding is None or response.content_encoding or
+            response.mimetype not in COMPRESSIBLE):
+            return response
+        # Files are sent as a stream, read them
+        response.direct_passthrough = False
+        data = variant(response.get_data(), encoding, folder)
+        if data is not None:
+            response.set_data(data)
+            response.content_encoding = encoding
+            # The tag of the file is not the tag of its variant
+            response.headers.pop("ETag", None)
+        return response
+
+
+def fingerprinted(app, request, prefixes = ()):
+    '''
+    Check if a request is for a file whose url changes with its content
+
+    Inputs:
+        app (Dash): the app
+        request (Request): the Flask request
+        prefixes (list of str): other paths of the app whose urls change
+            with their content
+
+    Output:
+        (bool): True for the Dash bundles with a fingerprint, the assets
+            with a modification time, the topojson files and the paths
+            under the prefixes
+    '''
+    path = request.path
+    suites = app.config.requests_pathname_prefix + "_dash-component-suites/"
+    if path.startswith(suites):
+        return check_fingerprint(path)[1]
+    if path.startswith(app.get_asset_url("")):
+        return "m" in request.args
+    return any(path.startswith(app.get_relative_path(prefix))
+               for prefix in ["/topojson/", *prefixes])
+
+
+def variant(data, encoding, folder = config.STATIC_PATH):
+    '''
+    Compressed variant of a file, made once
+
+    Inputs:
+        data (bytes): the content of the file
+        encoding (str): br or gzip
+        folder (str): folder of the compressed variants
+
+    Output:
+        (bytes): the compressed content, None if it is not smaller
+    '''
+    path = (folder + hashlib.sha1(data).hexdigest() +
+            EXTENSIONS[encoding])
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            compressed = f.read()
+    else:
+        if encoding == "br":
+            compressed = brotli.compress(data, quality=11)
+        else:
+            compressed = gzip.compress(data, 9, mtime=0)
+        os.makedirs(folder, exist_ok=True)
+        # Written then renamed, other processes never read a partial file
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=".variant-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp, path)
+    return compressed if len(compressed) < len(data) else None
+
+
+def dist_files():
+    '''
+    Javascript and css files of the Dash packages
+
+    Output:
+        (list of tuple): package name and path in the package
+    '''
+    modules = [_dash_renderer, dcc, html, dash_table] + [
+        sys.modules[name] for name in ComponentRegistry.registry
+        if name in sys.modules]
+    files = []
+    for module in modules:
+        for resource in (getattr(module, "_js_dist", []) +
+                         getattr(module, "_js_dist_dependencies", []) +
+                         getattr(module, "_css_dist", [])):
+            paths = resource.get("relative_package_path", [])
+            if isinstance(paths, dict):
+                paths = paths.get("prod", [])
+            if isinstance(paths, str):
+                paths = [paths]
+            files += [(resource["namespace"], path) for path in paths
+                      if not path.endswith(".map")]
+    return list(dict.fromkeys(files))
+
+
+def precompress(app, folder = config.STATIC_PATH):
+    '''
+    Make the compressed variants of the Dash bundles and of the assets of
+    an app, when they are not made yet
+
+    Inputs:
+        app (Dash): the app
+        folder (str): folder of the compressed variants
+    '''
+    files = [(pkgutil.get_data, package, path)
+             for package, path in dist_files()]
+    assets = app.config.assets_folder
+    if os.path.isdir(assets):
+        files += [(read_file, assets, name)
+                  for name in sorted(os.listdir(assets))
+                  if name.endswith((".js", ".css"))]
+    for read, folder_or_package, path in files:
+        data = read(folder_or_package, path)
+        for encoding in ENCODINGS:
+            variant(data, encoding, folder)
+
+
+def read_file(folder, name):
+    '''
+    Read a file of a folder as bytes
+    '''
+    with open(os.path.join(folder, name), "rb") as f:
+        return f.read()
+
+
+def add_topojson(app, names, vendor = config.VENDOR_PATH):
+    '''
+    Serve the topojson files of the geo figures of an app, from a folder
+    named after their hash. The files are never downloaded here, the app
+    is imported when the server starts: they are copied to the vendor
+    folder by hand or downloaded by the static report (product/report.py).
+
+    Inputs:
+        app (Dash): the app
+        names (set of str): the file names, like world_110m.json
+        vendor (str): the folder of the downloaded files
+
+    Output:
+        (str): the topojsonURL of the plotly.js configuration, the plotly
+            CDN if a file is not in the vendor folder
+    '''
+    paths = [vendor + name for name in sorted(names)]
+    if not paths or not all(map(os.path.exists, paths)):
+        print(f"Map outlines not in {vendor}, linked to {TOPOJSON_URL}")
+        return TOPOJSON_URL
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    url = app.get_relative_path(f"/topojson/{digest.hexdigest()[:12]}/")
+    files = {os.path.basename(path): path for path in paths}
+
+    def topojson(fingerprint, name):
+        if name not in files:
+            flask.abort(404)
+        return flask.send_file(os.path.abspath(files[name]),
+                               mimetype="application/json")
+
+    app.server.add_url_rule(app.config.routes_pathname_prefix +
+                            "topojson/<fingerprint>/<name>",
+                            "topojson", topojson)
+    return url
+
+
+def topojson_names(figures):
+    '''
+    Map outlines needed by geo figures, as named by plotly.js
+
+    Input:
+        figures (list): the figures (Figure or dict)
+
+    Output:
+        (set of str): file names, like world_110m.json
+    '''
+    names = set()
+    for figure in figures:
+        if hasattr(figure, "to_plotly_json"):
+            figure = figure.to_plotly_json()
+        layout = figure.get("layout", {})
+        for trace in figure.get("data", []):
+            if trace.get("type") in GEO_TRACES:
+                geo = layout.get(trace.get("geo", "geo"), {})
+                names.add("{}_{}m.json".format(geo.get("scope", "world"),
+                                               geo.get("resolution", 110)))
+    return names
+
+
+@functools.lru_cache(maxsize=None)
+def download(url, vendor = config.VENDOR_PATH, timeout = DOWNLOAD_TIMEOUT):
+    '''
+    Download a library to the vendor folder, once
+
+    Inputs:
+        url (str): the url of the library
+        vendor (str): the folder of the downloaded libraries
+        timeout (float): seconds to wait for the server
+
+    Output:
+        (str): the path of the file, None if it could not be downloaded
+    '''
+    path = vendor + os.path.basename(url)
+    if os.path.exists(path):
+        return path
+    try:
+        resp = fetch.get(url, timeout = timeout)
+        resp.raise_for_status()
+    except Exception as error:
+        print(f"Could not download {url}, linked instead: {error}")
+        return None
+    os.makedirs(vendor, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(resp.content)
+    return path
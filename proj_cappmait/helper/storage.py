@@ -0,0 +1,402 @@
+'''
+Module to store the clean datasets as typed parquet files.
+
+Each dataset has a declared schema: country codes and names are dictionary
+encoded and values are float32. A csv copy is kept next to every parquet
+file for humans. Readers load the parquet file, and fall back to the csv
+(parsed with the declared types) when the parquet file is missing or older
+than the csv. Both load with the same dtypes. Reading never writes to the
+data folder: convert_folder (the 'parquet' getdata command) writes the
+parquet files of the csv files.
+'''
+import os
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from proj_cappmait import config
+
+CLEAN_PATH = "proj_cappmait/data/data_from_prog/cleandata/"
+RAW_PATH = "proj_cappmait/data/data_from_prog/rawdata/"
+DATA_PATH = "proj_cappmait/data/"
+
+CODE = pa.dictionary(pa.int16(), pa.string())
+VALUE = pa.float32()
+# Integer key of the country dimension table (helper/countries.py)
+KEY = pa.int16()
+# Integer columns that are never missing: the country keys (countries
+# without a match get key 0) and the years. The other integer columns may
+# be missing and are loaded as nullable pandas integers.
+NOT_NULL = {"country_id", "from_id", "to_id", "reporter_id", "partner_id",
+            "year", "Year", "time"}
+
+
+def imf_fields():
+    '''
+    Fields of the IMF trading partners data, one value column per year
+    '''
+    return ([(str(year), VALUE) for year in config.YEARS] +
+            [("from_name", CODE), ("from_code", CODE),
+             ("to_name", CODE), ("to_code", CODE),
+             ("from_id", KEY), ("to_id", KEY),
+             # Only with the mirror imports (getdata/clean_data.py)
+             ("mirror_filled", pa.int8()), ("discrepancy", pa.bool_())])
+
+
+def owid_fields(extra):
+    '''
+    Fields of the cleaned OWID Covid data, with extra fields after the
+    country name
+    '''
+    return ([("iso_code", CODE), ("Country_name", CODE)] + extra +
+            [("period", CODE)] +
+            [(col, VALUE) for col in
+             ["total_cases", "total_cases_per_million", "total_deaths",
+              "total_deaths_per_million", "new_cases",
+              "new_cases_per_million", "new_deaths",
+              "new_deaths_per_million", "stringency_index"]] +
+            [("country_id", KEY)])
+
+
+def un_fields(comm_type):
+    '''
+    Fields of the UN Comtrade flows, with the type of the commodity codes
+    '''
+    return [("year", pa.int16()), ("reporter_code", pa.int16()),
+            ("reporter_title", CODE), ("reporter_iso", CODE),
+            ("partner_code", pa.int16()), ("partner_title", CODE),
+            ("partner_iso", CODE), ("comm_code", comm_type),
+            ("comm_desc", CODE), ("trade_val", pa.float64()),
+            ("reporter_id", KEY), ("partner_id", KEY)]
+
+
+# Declared columns of every dataset, in their csv order
+SCHEMAS = {
+    "country_dim": lambda: [
+        ("country_id", KEY), ("name", CODE), ("iso2", CODE), ("iso3", CODE),
+        ("numeric", pa.int16()), ("imf_code", CODE), ("un_code", pa.int16()),
+        ("latitude", VALUE), ("longitude", VALUE)],
+    "imf_import_export_cleaned": imf_fields,
+    "countries_codes_and_coordinates_cleaned": lambda: [
+        ("Country", CODE), ("Alpha-2code", CODE), ("Alpha-3code", CODE),
+        ("Numericcode", pa.int16()), ("Latitude(average)", VALUE),
+        ("Longitude(average)", VALUE), ("country_id", KEY)],
+    "owid_covid_data_cleaned": lambda: owid_fields([]),
+    "owid_covid_pyramid": lambda: owid_fields([("resolution", CODE)]),
+    "pagerank": lambda: [("country_code", CODE), ("pagerank", pa.float64())],
+    "pagerank_periods": lambda: [
+        ("period", CODE), ("country_code", CODE), ("pagerank", pa.float64())],
+    "merchandise_values_annual_dataset": lambda: [
+        ("Indicator", CODE), ("ReporterCode", CODE), ("ReporterISO3A", CODE),
+        ("Reporter", CODE), ("ProductCode", CODE), ("Product", CODE),
+        ("Year", pa.int16()), ("Value", VALUE)],
+    "world-bank-econ-data": lambda: [
+        ("country_code", CODE), ("time_code", CODE), ("inflation", VALUE),
+        ("nominal_gdp", VALUE), ("real_gdp", VALUE),
+        ("exchange_rate", VALUE), ("labor_force", VALUE), ("tariff", VALUE),
+        ("time", pa.int16())],
+    "owid_country_info": lambda: [
+        ("iso_code", CODE), ("continent", CODE), ("location", CODE),
+        ("population", VALUE)],
+    "un_comtrade_top30": lambda: un_fields(pa.int16()),
+    # Partitioned by reporter_iso, year and hs_level (helper/comtrade.py)
+    # Codes keep their leading zeros (HS4 0101)
+    "un_comtrade": lambda: un_fields(CODE) + [("hs_level", pa.int8())],
+}
+
+# Datasets saved as csv without a header row
+HEADERLESS = {"pagerank"}
+
+
+def schema(name, df = None):
+    '''
+    Build the arrow schema of a dataset. Columns of df that are not
+    declared keep the type inferred by arrow.
+
+    Inputs:
+        name (str): name of the dataset (file name without extension)
+        df (DataFrame): the data, used for the undeclared columns
+
+    Output:
+        (pa.Schema): the schema
+    '''
+    fields = SCHEMAS[name]()
+    if df is not None:
+        declared = {col for col, _ in fields}
+        fields = [(col, typ) for col, typ in fields if col in df.columns]
+        inferred = pa.Schema.from_pandas(df, preserve_index=False)
+        fields += [(field.name, field.type) for field in inferred
+                   if field.name not in declared]
+    return pa.schema(fields)
+
+
+def csv_dtypes(name, categorical = True):
+    '''
+    Pandas dtypes to parse the csv copy of a dataset
+
+    Inputs:
+        name (str): name of the dataset
+        categorical (bool): if True, dictionary columns become categories
+
+    Output:
+        (dict): column name to dtype
+    '''
+    dtypes = {}
+    for field in schema(name):
+        if pa.types.is_dictionary(field.type):
+            dtypes[field.name] = "category" if categorical else "str"
+        elif pa.types.is_integer(field.type):
+            dtypes[field.name] = integer_dtype(field)
+        else:
+            dtypes[field.name] = field.type.to_pandas_dtype()
+    return dtypes
+
+
+def integer_dtype(field):
+    '''
+    Pandas dtype of an integer field: plain numpy integers for the columns
+    that are never missing, nullable integers for the others
+
+    Input:
+        field (pa.Field): an integer field of a schema
+
+    Output:
+        (str): the dtype
+    '''
+    if field.name in NOT_NULL:
+        return field.type.to_pandas_dtype().__name__
+    return f"Int{field.type.bit_width}"
+
+
+def nullable_dtypes(name, columns):
+    '''
+    Nullable integer dtypes of the columns of a dataset that may be missing
+
+    Inputs:
+        name (str): name of the dataset
+        columns (list of str): columns of the data
+
+    Output:
+        (dict): column name to dtype
+    '''
+    return {field.name: integer_dtype(field) for field in schema(name)
+            if pa.types.is_integer(field.type) and
+            field.name not in NOT_NULL and field.name in columns}
+
+
+def write_clean(df, name, folder = CLEAN_PATH):
+    '''
+    Save a dataset as a typed parquet file and a csv copy
+
+    Inputs:
+        df (DataFrame): the data
+        name (str): name of the dataset (file name without extension)
+        folder (str): folder of the files
+    '''
+    df.to_csv(folder + name + ".csv", index=False,
+              header=name not in HEADERLESS)
+    write_parquet(df, name, folder)
+
+
+def write_parquet(df, name, folder):
+    '''
+    Save a dataset as a typed parquet file
+
+    Inputs:
+        df (DataFrame): the data
+        name (str): name of the dataset
+        folder (str): folder of the file
+    '''
+    pq.write_table(typed_table(df, name), folder + name + ".parquet")
+
+
+def typed_table(df, name):
+    '''
+    Convert a dataframe to an arrow table with the schema of a dataset
+
+    Inputs:
+        df (DataFrame): the data
+        name (str): name of the dataset
+
+    Output:
+        (pa.Table): the typed table
+    '''
+    dtypes = csv_dtypes(name)
+    df = df.astype({col: dtypes[col] for col in df.columns if col in dtypes})
+    table = pa.Table.from_pandas(df, schema(name, df), preserve_index=False)
+    # Without the pandas metadata, arrow types decide the loaded dtypes
+    return table.replace_schema_metadata(None)
+
+
+def write_dataset(df, name, folder = CLEAN_PATH, partition_cols = ("year",)):
+    '''
+    Save a dataset as a partitioned parquet dataset: one folder per value of
+    the partition columns (folder/name/year=2019/...). The partitions of
+    df replace the stored ones, the other partitions are kept.
+
+    Inputs:
+        df (DataFrame): the data
+        name (str): name of the dataset (folder name)
+        folder (str): folder of the dataset
+        partition_cols (list of str): columns to partition on
+    '''
+    partition_cols = list(partition_cols)
+    for values in df[partition_cols].drop_duplicates().itertuples(
+            index=False):
+        shutil.rmtree(folder + name + "/" + "/".join(
+            f"{col}={value}" for col, value in zip(partition_cols, values)),
+            ignore_errors=True)
+    pq.write_to_dataset(typed_table(df, name), folder + name,
+                        partition_cols=partition_cols)
+
+
+def has_clean(name, folder = DATA_PATH):
+    '''
+    Check if a dataset is saved in a folder, as csv or parquet
+
+    Inputs:
+        name (str): name of the dataset
+        folder (str): folder of the files
+
+    Output:
+        (bool): True if the dataset exists
+    '''
+    return any(os.path.exists(folder + name + ext)
+               for ext in (".csv", ".parquet"))
+
+
+def read_clean(name, folder = DATA_PATH, columns = None, categorical = True):
+    '''
+    Load a dataset from its parquet file, or from the csv copy if the
+    parquet file is missing or older than the csv.
+
+    Inputs:
+        name (str): name of the dataset (file name without extension)
+        folder (str): folder of the files
+        columns (list): columns to load. Default loads every column
+        categorical (bool): if True, dictionary encoded columns are loaded
+            as pandas categories, otherwise as strings
+
+    Output:
+        (DataFrame): the data
+    '''
+    parquet_path = folder + name + ".parquet"
+    csv_path = folder + name + ".csv"
+    if (not os.path.exists(parquet_path) or
+        (os.path.exists(csv_path) and
+         os.path.getmtime(csv_path) > os.path.getmtime(parquet_path))):
+        print(f"{name}.parquet is missing or older than {name}.csv, " +
+              "reading the csv. Run getdata parquet to convert it.")
+        return select(read_csv(name, folder), columns, categorical)
+    return read_parquet(name, folder, columns, categorical)
+
+
+def read_parquet(name, folder, columns = None, categorical = True):
+    '''
+    Load a dataset from its parquet file, with the dtypes of the csv
+
+    Inputs:
+        name (str): name of the dataset
+        folder (str): folder of the file
+        columns (list): columns to load. Default loads every column
+        categorical (bool): if True, dictionary encoded columns are loaded
+            as pandas categories, otherwise as strings
+
+    Output:
+        (DataFrame): the data
+    '''
+    table = pq.read_table(folder + name + ".parquet", columns=columns,
+                          memory_map=True)
+    if not categorical:
+        table = decode(table)
+    df = table.to_pandas()
+    # Arrow loads integers with nulls as floats
+    return df.astype(nullable_dtypes(name, df.columns))
+
+
+def decode(table):
+    '''
+    Cast the dictionary encoded columns of an arrow table to their values
+    '''
+    return table.cast(pa.schema([
+        (field.name, field.type.value_type
+         if pa.types.is_dictionary(field.type) else field.type)
+        for field in table.schema]))
+
+
+def read_csv(name, folder):
+    '''
+    Parse the csv copy of a dataset with the declared types
+
+    Inputs:
+        name (str): name of the dataset
+        folder (str): folder of the file
+
+    Output:
+        (DataFrame): the data
+    '''
+    dtypes = csv_dtypes(name)
+    # Only empty fields are missing: "NA" is the ISO2 code of Namibia
+    if name in HEADERLESS:
+        return pd.read_csv(folder + name + ".csv", names=list(dtypes),
+                           dtype=dtypes, keep_default_na=False,
+                           na_values=[''])
+    header = pd.read_csv(folder + name + ".csv", nrows=0).columns
+    return pd.read_csv(folder + name + ".csv",
+                       dtype={col: dtypes[col] for col in header
+                              if col in dtypes},
+                       keep_default_na=False, na_values=[''])
+
+
+def select(df, columns, categorical):
+    '''
+    Apply the column selection and string option of read_clean to a
+    dataframe read from csv
+    '''
+    if columns is not None:
+        df = df[columns]
+    if not categorical:
+        df = df.astype({col: "str" for col in df.columns
+                        if df[col].dtype.name == "category"})
+    return df
+
+
+def convert_folder(folder = DATA_PATH):
+    '''
+    Write the parquet file of every dataset that has a csv in the folder,
+    when it is missing or older than the csv
+
+    Input:
+        folder (str): folder of the csv files
+    '''
+    for name in SCHEMAS:
+        csv_path = folder + name + ".csv"
+        parquet_path = folder + name + ".parquet"
+        if os.path.exists(csv_path) and (
+                not os.path.exists(parquet_path) or
+                os.path.getmtime(csv_path) > os.path.getmtime(parquet_path)):
+            write_parquet(read_csv(name, folder), name, folder)
+            print(f"{parquet_path} written.")
+        if os.path.exists(csv_path) and os.path.exists(parquet_path):
+            check_dtypes(name, folder)
+
+
+def check_dtypes(name, folder = DATA_PATH):
+    '''
+    Check that read_clean loads the same dtypes from the csv and from the
+    parquet file of a dataset
+
+    Inputs:
+        name (str): name of the dataset
+        folder (str): folder of the files
+    '''
+    for categorical in (True, False):
+        from_csv = select(read_csv(name, folder), None, categorical).dtypes
+        from_parquet = read_parquet(name, folder, None, categorical).dtypes
+        different = [f"{col} ({from_csv[col]} in the csv, " +
+                     f"{from_parquet.get(col)} in the parquet file)"
+                     for col in from_csv.index
+                     if str(from_csv[col]) != str(from_parquet.get(col))]
+        if different:
+            raise ValueError(f"{name} has different dtypes: " +
+                             ", ".join(different))
@@ -0,0 +1,167 @@
+'''
+Module for the monthly IMF trade flows.
+
+The flows are kept as one float32 array of shape (month, exporter, importer)
+indexed by the country keys of the country dimension table, with NaN where
+no flow is reported. Quarters and years are rolled up from the months by
+summing consecutive slices of the array, and the flows of one period are
+read back as a partners table for the network and the PageRank.
+'''
+import os
+import numpy as np
+import pandas as pd
+from proj_cappmait.helper import countries, shared_data, storage
+
+CUBE_NAME = "imf_monthly.npz"
+
+# Pandas frequency and number of periods in a year of each resolution
+FREQUENCIES = {"month": "M", "quarter": "Q", "year": "Y"}
+PER_YEAR = {"month": 12, "quarter": 4, "year": 1}
+
+
+def build_cube(flows, dim):
+    '''
+    Build the monthly array from the monthly IMF data
+
+    Inputs:
+        flows (DataFrame): from and to (IMF country codes), period
+            ("2019-01") and value
+        dim (DataFrame): the country dimension table
+
+    Output:
+        months (list of str): the months of the first axis, in order
+        values (numpy array): exports of shape (month, exporter key,
+            importer key)
+    '''
+    flows = countries.attach_country_id(flows, "from", dim, "imf", "from_id")
+    flows = countries.attach_country_id(flows, "to", dim, "imf", "to_id")
+    # Parse each distinct month once
+    codes, labels = pd.factorize(flows["period"])
+    labels = pd.PeriodIndex(labels, freq="M")
+    months = pd.period_range(labels.min(), labels.max(), freq="M")
+    ordinals = labels.asi8[codes]
+
+    size = dim["country_id"].max() + 1
+    values = np.full((len(months), size, size), np.nan, dtype="float32")
+    values[ordinals - months[0].ordinal,
+           flows["from_id"].to_numpy("int64"),
+           flows["to_id"].to_numpy("int64")] = flows["value"]
+    return [str(month) for month in months], values
+
+
+def write_cube(months, values, folder = storage.CLEAN_PATH):
+    '''
+    Save the monthly array (compressed, most flows are missing)
+
+    Inputs:
+        months (list of str): the months of the first axis
+        values (numpy array): exports of shape (month, exporter, importer)
+        folder (str): folder of the file
+    '''
+    np.savez_compressed(folder + CUBE_NAME, months=np.array(months),
+                        values=values)
+
+
+def load_cube(folder = storage.DATA_PATH):
+    '''
+    Load the monthly array
+
+    Input:
+        folder (str): folder of the file
+
+    Output:
+        (tuple): months and values as given by build_cube, None if the
+            folder has no monthly data
+    '''
+    if not os.path.exists(folder + CUBE_NAME):
+        return None
+    with np.load(folder + CUBE_NAME) as cube:
+        return [str(month) for month in cube["months"]], cube["values"]
+
+
+def shared_cube(folder = storage.DATA_PATH):
+    '''
+    Attach to the monthly array shared between processes
+    (helper/shared_data.py), published first if the file changed
+
+    Input:
+        folder (str): folder of the file
+
+    Output:
+        (tuple): months and read-only values as given by build_cube, None
+            if the folder has no monthly data
+    '''
+    if not os.path.exists(folder + CUBE_NAME):
+        return None
+    arrays = shared_data.shared_arrays(
+        "imf_monthly", 
+        lambda: dict(zip(["months", "values"], load_cube(folder))), 
+        [folder + CUBE_NAME])
+    return [str(month) for month in arrays["months"]], arrays["values"]
+
+
+def rollup(months, values, resolution):
+    '''
+    Sum the months of each quarter or year. A flow is missing in a period
+    only when it is missing in all its months.
+
+    Inputs:
+        months (list of str): the months of the first axis, in order
+        values (numpy array): exports of shape (month, exporter, importer)
+        resolution (str): month, quarter or year
+
+    Output:
+        periods (list of str): the periods ("2020-04", "2020Q2", "2020")
+        values (numpy array): exports of shape (period, exporter, importer)
+    '''
+    labels = pd.PeriodIndex(months, freq="M").asfreq(FREQUENCIES[resolution])
+    if resolution == "month":
+        return [str(label) for label in labels], values
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    totals = np.add.reduceat(np.nan_to_num(values), starts, axis=0)
+    reported = np.add.reduceat(~np.isnan(values), starts, axis=0)
+    totals[reported == 0] = np.nan
+    return [str(labels[start]) for start in starts], totals
+
+
+def period_partners(periods, values, selected, dim):
+    '''
+    The flows of some periods as a partners table, one column per period.
+    Like the annual data, only the flows reported in every selected period
+    are kept.
+
+    Inputs:
+        periods (list of str): the periods of the first axis
+        values (numpy array): exports of shape (period, exporter, importer)
+        selected (list of str): the periods to read
+        dim (DataFrame): the country dimension table
+
+    Output:
+        (DataFrame): one column named after each selected period, from_id,
+            to_id, from_code and to_code
+    '''
+    flows = values[[periods.index(period) for period in selected]]
+    from_ids, to_ids = np.nonzero((flows > 0).all(axis=0))
+    codes = countries.lookup(dim, "iso3")
+    partners = pd.DataFrame({period: flows[i, from_ids, to_ids]
+                             for i, period in enumerate(selected)})
+    return partners.assign(from_id=from_ids.astype("int16"),
+                           to_id=to_ids.astype("int16"),
+                           from_code=codes[from_ids],
+                           to_code=codes[to_ids])
+
+
+def year_before(periods, period, resolution):
+    '''
+    The same period of the year before
+
+    Inputs:
+        periods (list of str): the periods of the first axis, in order
+        period (str): a period
+        resolution (str): month, quarter or year
+
+    Output:
+        (str): the period a year before, None if it is not stored
+    '''
+    index = periods.index(period) - PER_YEAR[resolution]
+    return periods[index] if index >= 0 else None
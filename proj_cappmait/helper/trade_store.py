@@ -0,0 +1,242 @@
+'''
+Module for the SQLite store of bilateral trade flows.
+
+The IMF trading partners data and the UN Comtrade extract are kept in long
+format (one row per flow and year) with covering indexes, so questions about
+a country, a pair or a commodity are answered from the index without loading
+the whole datasets.
+
+The store is only written by getdata (build_store). The dashboard and the
+analysis open it read-only, and do without it when it is missing or older
+than the clean datasets.
+'''
+import os
+import sqlite3
+import pandas as pd
+from proj_cappmait.helper import storage
+
+STORE_NAME = "trade.db"
+
+TABLES = '''
+CREATE TABLE IF NOT EXISTS countries (
+    code TEXT PRIMARY KEY,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS imf_flows (
+    from_code TEXT NOT NULL,
+    to_code TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS imf_from_to_year
+    ON imf_flows (from_code, to_code, year, value);
+CREATE INDEX IF NOT EXISTS imf_to_from_year
+    ON imf_flows (to_code, from_code, year, value);
+CREATE TABLE IF NOT EXISTS commodities (
+    code INTEGER PRIMARY KEY,
+    description TEXT
+);
+CREATE TABLE IF NOT EXISTS un_flows (
+    reporter TEXT NOT NULL,
+    partner TEXT NOT NULL,
+    commodity INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS un_reporter_commodity_year
+    ON un_flows (reporter, commodity, year, partner, value);
+CREATE INDEX IF NOT EXISTS un_commodity_year
+    ON un_flows (commodity, year, value);
+'''
+
+# Clean datasets each table is loaded from
+SOURCES = {"imf": "imf_import_export_cleaned", "un": "un_comtrade_top30"}
+
+
+def connect(folder = storage.DATA_PATH):
+    '''
+    Open the trade store of a data folder, read-only
+
+    Input:
+        folder (str): folder of the clean datasets and of the store
+
+    Output:
+        (sqlite3.Connection): connection to the store, None if the store
+            is missing, older than the clean datasets or unreadable
+    '''
+    path = folder + STORE_NAME
+    if any(source_time(folder, name) > store_time(path)
+           for name in SOURCES.values()):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro",
+                               uri=True, check_same_thread=False)
+        conn.execute("SELECT 1 FROM imf_flows LIMIT 1")
+    except sqlite3.Error as error:
+        print(f"Could not open the trade store {path}: {error}")
+        return None
+    return conn
+
+
+def source_time(folder, name):
+    '''
+    Last modification time of a clean dataset (csv or parquet), 0 if it
+    does not exist
+    '''
+    times = [os.path.getmtime(folder + name + ext)
+             for ext in (".csv", ".parquet")
+             if os.path.exists(folder + name + ext)]
+    return max(times, default=0)
+
+
+def store_time(path):
+    '''
+    Last modification time of the store, -1 if it does not exist
+    '''
+    return os.path.getmtime(path) if os.path.exists(path) else -1
+
+
+def load_imf(conn, folder = storage.CLEAN_PATH):
+    '''
+    Replace the IMF flows of the store with the clean IMF data
+
+    Inputs:
+        conn (sqlite3.Connection): connection to the store
+        folder (str): folder of the clean IMF data
+    '''
+    partners = storage.read_clean(SOURCES["imf"], folder, categorical=False)
+    years = [col for col in partners.columns if col.isdigit()]
+    flows = partners.melt(["from_code", "to_code"], years, "year", "value")
+    flows = flows.dropna(subset=["value"])
+    flows["year"] = flows["year"].astype(int)
+    names = pd.concat([
+        partners[["from_code", "from_name"]].set_axis(["code", "name"], axis=1),
+        partners[["to_code", "to_name"]].set_axis(["code", "name"], axis=1)
+    ]).drop_duplicates("code")
+
+    with conn:
+        conn.execute("DELETE FROM imf_flows")
+        conn.execute("DELETE FROM countries")
+        conn.executemany("INSERT INTO imf_flows VALUES (?, ?, ?, ?)",
+                         flows[["from_code", "to_code", "year", "value"]]
+                         .itertuples(index=False))
+        conn.executemany("INSERT INTO countries VALUES (?, ?)",
+                         names.itertuples(index=False))
+
+
+def load_un(conn, folder = storage.CLEAN_PATH):
+    '''
+    Replace the UN Comtrade flows of the store with the UN Comtrade extract
+
+    Inputs:
+        conn (sqlite3.Connection): connection to the store
+        folder (str): folder of the UN Comtrade extract
+    '''
+    if source_time(folder, SOURCES["un"]) == 0:
+        with conn:
+            conn.execute("DELETE FROM un_flows")
+            conn.execute("DELETE FROM commodities")
+        return
+    un_comtrade = storage.read_clean(SOURCES["un"], folder, categorical=False)
+    commodities = un_comtrade[["comm_code", "comm_desc"]].drop_duplicates(
+        "comm_code")
+
+    with conn:
+        conn.execute("DELETE FROM un_flows")
+        conn.execute("DELETE FROM commodities")
+        conn.executemany("INSERT INTO un_flows VALUES (?, ?, ?, ?, ?)",
+                         un_comtrade[["reporter_iso", "partner_iso",
+                                      "comm_code", "year", "trade_val"]]
+                         .astype({"comm_code": int, "year": int})
+                         .itertuples(index=False))
+        conn.executemany("INSERT INTO commodities VALUES (?, ?)",
+                         commodities.astype({"comm_code": int})
+                         .itertuples(index=False))
+
+
+def build_store(folder = storage.CLEAN_PATH):
+    '''
+    Build the trade store of a folder from its clean datasets
+
+    Input:
+        folder (str): folder of the clean datasets and of the store
+    '''
+    conn = sqlite3.connect(folder + STORE_NAME)
+    conn.executescript(TABLES)
+    load_imf(conn, folder)
+    load_un(conn, folder)
+    conn.close()
+
+
+def top_partners(conn, country_code, year, num = 10, is_exporter = True):
+    '''
+    Find the largest trading partners of a country in a year
+
+    Inputs:
+        conn (sqlite3.Connection): connection to the store
+        country_code (str): ISO3 country code
+        year (int): year
+        num (int): number of partners
+        is_exporter (bool): if True, the partners the country exports to,
+            otherwise the partners it imports from
+
+    Output:
+        (DataFrame): partner code, partner name and trade volume, sorted by
+            trade volume
+    '''
+    country, partner = (("from_code", "to_code") if is_exporter
+                        else ("to_code", "from_code"))
+    query = f'''
+        SELECT f.{partner} AS partner_code, c.name AS partner_name, f.value
+        FROM imf_flows AS f LEFT JOIN countries AS c ON c.code = f.{partner}
+        WHERE f.{country} = ? AND f.year = ?
+        ORDER BY f.value DESC
+        LIMIT ?'''
+    return pd.read_sql_query(query, conn, params=(country_code, year, num))
+
+
+def pair_flows(conn, from_code, to_code):
+    '''
+    Trade volume from one country to another for every stored year
+
+    Inputs:
+        conn (sqlite3.Connection): connection to the store
+        from_code (str): ISO3 code of the exporter
+        to_code (str): ISO3 code of the importer
+
+    Output:
+        (DataFrame): year and trade volume, sorted by year
+    '''
+    query = '''
+        SELECT year, value FROM imf_flows
+        WHERE from_code = ? AND to_code = ?
+        ORDER BY year'''
+    return pd.read_sql_query(query, conn, params=(from_code, to_code))
+
+
+def commodity_totals(conn, years, reporter = None):
+    '''
+    Total UN Comtrade exports of each commodity, one column per year
+
+    Inputs:
+        conn (sqlite3.Connection): connection to the store
+        years (list of int): years to sum
+        reporter (str): ISO3 code of the reporter. Default sums all
+            reporters
+
+    Output:
+        (DataFrame): comm_code, comm_desc and a column export_{year} for
+            each year
+    '''
+    columns = ", ".join(
+        f"SUM(CASE WHEN f.year = {int(year)} THEN f.value END) "
+        f"AS export_{int(year)}" for year in years)
+    where = "f.reporter = ? AND " if reporter is not None else ""
+    query = f'''
+        SELECT f.commodity AS comm_code, c.description AS comm_desc, {columns}
+        FROM un_flows AS f JOIN commodities AS c ON c.code = f.commodity
+        WHERE {where}f.year IN ({", ".join("?" * len(years))})
+        GROUP BY f.commodity
+        ORDER BY f.commodity'''
+    params = ([reporter] if reporter is not None else []) + list(years)
+    return pd.read_sql_query(query, conn, params=params)
@@ -3,19 +3,40 @@ Module for doing analysis
 '''
 
 ######## Import Packages & Set Options ###########
+import hashlib
+import json
+from collections import defaultdict
+from itertools import combinations
+
 import networkx as nx
 import pandas as pd
 import plotly.express as px
+import plotly.offline
 import statsmodels.api as sm
 
 from dash import Dash
-from dash import dcc
 from dash import html
+from flask import Response, abort
 from pyvis.network import Network
-from itertools import combinations
+from proj_cappmait import config
+from proj_cappmait.helper import comtrade, countries, static_assets, storage
+from proj_cappmait.helper import trade_store
+from proj_cappmait.helper import network_analysis as net
 
 pd.options.mode.chained_assignment = None
 
+# Years compared in the report
+BASE = config.BASE_YEAR
+COMPARE = config.COMPARE_YEAR
+EXPORT_BASE = f'export_{BASE}'
+EXPORT_COMPARE = f'export_{COMPARE}'
+# Smallest IMF trade volume (USD million) of the whole world network. The
+# dashboard network has a slider for it.
+IMF_EDGE_THRESHOLD = 5000
+# Pages of the pyvis networks, in the assets folder
+NETWORK_PAGE = {name: f'{name}_{COMPARE}.html'
+                for name in ['imf', 'un', 'un_pharma', 'un_vehicle']}
+
 ###### List of data ######
 '''
 1. UN comtrade data for top 30 major exporters
@@ -33,8 +54,8 @@ labels = {'country_code': 'Country',
           'growth': 'Merchandise Export Value (%YoY)',
           'stringency_index': 'Stringency Index',
           'continent': 'Continent',
-          'current_gdp_2020': '2020 Nominal GDP (USD)',
-          'export_2019': 'Export Value in 2019',
+          f'current_gdp_{COMPARE}': f'{COMPARE} Nominal GDP (USD)',
+          EXPORT_BASE: f'Export Value in {BASE}',
           'weighted_stringent' : 'Export-Adjusted Stringency Index',
           'deg_centrality': 'Degree Centrality',
           'bet_centrality': 'Betweeness Centrality',
@@ -109,8 +130,8 @@ def undirected_export(df, from_country_col, to_country_col):
 
     Inputs:
         df (DataFrame): a trade dataframe
-        from_country_col (int): a column index that represents the exporter
-        to_country_col (int): a column index that represents the destination
+        from_country_col (str): the column of the exporter
+        to_country_col (str): the column of the destination
 
     Return:
         (DataFrame): A New DataFrame that abolish the relationship between
@@ -119,9 +140,8 @@ def undirected_export(df, from_country_col, to_country_col):
 
     df = df.dropna()
     relation = []
-    for row in df.itertuples():
-        country_1 = row[from_country_col + 1]
-        country_2 = row[to_country_col + 1]
+    for country_1, country_2 in zip(df[from_country_col],
+                                    df[to_country_col]):
         if country_1 < country_2:
             rel = country_1 + "-" + country_2
         else:
@@ -141,7 +161,8 @@ def undirected_export(df, from_country_col, to_country_col):
 # 3. Create Network Chart
 # Create Network Graph
 def create_network(df, node_size_col_name, from_country_col, to_country_col,
-                   curr_exp_value_col, prev_exp_value_col, output_path):
+                   curr_exp_value_col, prev_exp_value_col, output_path,
+                   continents = None):
     '''
     Create a network graph of export dataframe.
 
@@ -156,6 +177,9 @@ def create_network(df, node_size_col_name, from_country_col, to_country_col,
         prev_exp_value_col (int): a column index that
             represents the previous export
         output_path (str): an output location to keeping file
+        continents (dict): country code to continent. If given, the
+            countries of each continent are shown as one node until it is
+            clicked (add_clusters)
 
     Return:
         Network in html file
@@ -193,7 +217,70 @@ def create_network(df, node_size_col_name, from_country_col, to_country_col,
         node['value'] = len(neighbors[node['id']])
 
     network.repulsion(node_distance=200, spring_length=300)
-    return network.show(output_path)
+    if continents is None:
+        return network.show(output_path)
+
+    for node in network.nodes:
+        node['group'] = continents.get(node['id'], net.OTHER)
+    shown = network.show(output_path)
+    add_clusters(network, output_path)
+    return shown
+
+
+# Level of detail of the network html files (vis.js clustering)
+CLUSTER_SCRIPT = '''<script type="text/javascript">
+    // The countries of each continent start as one node, clicking a
+    // continent node opens it
+    var clusters = CLUSTERS;
+    Object.keys(clusters).forEach(function(group) {
+        network.cluster({
+            joinCondition: function(node) { return node.group === group; },
+            clusterNodeProperties: clusters[group]
+        });
+    });
+    network.on("selectNode", function(params) {
+        if (params.nodes.length === 1 && network.isCluster(params.nodes[0])) {
+            network.openCluster(params.nodes[0]);
+        }
+    });
+</script>
+'''
+
+
+def add_clusters(network, output_path):
+    '''
+    Add continent nodes to a network html file. The size, label and hover
+    text of each continent node are computed here from its countries, so
+    opening a continent in the browser only shows its countries again.
+
+    Inputs:
+        network (Network): the network, with a group (continent) per node
+        output_path (str): the html file of the network
+    '''
+    members = defaultdict(list)
+    for node in network.nodes:
+        members[node['group']].append(node)
+
+    clusters = {}
+    for group, nodes in members.items():
+        # A continent of one country stays a country
+        if len(nodes) < 2:
+            continue
+        clusters[group] = {
+            'id': 'cluster:' + group,
+            'label': f'{group} ({len(nodes)})',
+            'title': group + ' (click to expand):<br>' +
+                     '<br>'.join(sorted(node['id'] for node in nodes)),
+            'value': sum(node['value'] for node in nodes),
+            'shape': 'dot',
+            'borderWidth': 3
+        }
+
+    with open(output_path) as f:
+        page = f.read()
+    script = CLUSTER_SCRIPT.replace('CLUSTERS', json.dumps(clusters))
+    with open(output_path, 'w') as f:
+        f.write(page.replace('</body>', script + '</body>', 1))
 
 
 # Dict to DataFrame
@@ -246,63 +333,76 @@ def pot_triangle(graph, col_names, sort_by, top_n):
 
 ################### Preparing Data ############################
 # Read Raw Data
-un_comtrade = pd.read_csv('proj_cappmait/data/un_comtrade_top30.csv',
-                          dtype = {'rtCode': 'str', 'ptCode': 'str',
-                                   'cmdCode': 'str'})
+un_comtrade = storage.read_clean('un_comtrade_top30', categorical = False)
 
-owid_covid = pd.read_csv('proj_cappmait/data/owid_covid_data_cleaned.csv',
-                         usecols = ['iso_code', 'period', 'total_cases',
-                                    'new_cases', 'stringency_index'])
+owid_covid = storage.read_clean('owid_covid_data_cleaned',
+                                columns = ['iso_code', 'period', 'total_cases',
+                                           'new_cases', 'stringency_index'],
+                                categorical = False)
 
-owid_country = pd.read_csv('proj_cappmait/data/owid_country_info.csv',
-                         usecols = ['iso_code', 'continent', 'location',
-                                    'population'])
+owid_country = storage.read_clean('owid_country_info',
+                                  columns = ['iso_code', 'continent',
+                                             'location', 'population'],
+                                  categorical = False)
 
-wto_export = pd.read_csv(
-    "proj_cappmait/data/merchandise_values_annual_dataset.csv"
-)
+wto_export = storage.read_clean("merchandise_values_annual_dataset",
+                                categorical = False)
 wto_export = wto_export[(wto_export['Indicator'] == 'Export') &
-                        (wto_export['ProductCode'] == 'TO')]
+                        (wto_export['ProductCode'] == 'TO') &
+                        (wto_export['Year'].isin([BASE, COMPARE]))]
+
+continents = net.load_continents()
 
-imf_ex_im = pd.read_csv(
-    "proj_cappmait/data/imf_import_export_cleaned.csv"
-).dropna()
+imf_ex_im = storage.read_clean("imf_import_export_cleaned",
+                               categorical = False)
+# Only the compared years, the other years may be missing
+imf_ex_im = imf_ex_im.dropna(subset = [str(BASE), str(COMPARE)])
 
-wb_econ = pd.read_csv("proj_cappmait/data/world-bank-econ-data.csv")
+wb_econ = storage.read_clean("world-bank-econ-data", categorical = False)
+
+# Built by getdata, None without it
+trade_db = trade_store.connect()
+
+country_dim = countries.load_dimension()
 
 
 # Create Processed Table for analysis
 ## 1. UN Comtrade
+un_comtrade = un_comtrade[un_comtrade['year'].isin([BASE, COMPARE])]
 un_comtrade_pivot = un_comtrade.pivot(['reporter_iso', 'partner_iso',
                                        'comm_code', 'comm_desc'],
                                        'year', 'trade_val').reset_index()
 un_comtrade_pivot.columns = ['reporter_iso', 'partner_iso', 'comm_code',
-                             'comm_desc', 'export_2019', 'export_2020']
+                             'comm_desc', EXPORT_BASE, EXPORT_COMPARE]
 
 ## 2. Owid Covid Data
-owid_df = owid_covid[owid_covid['period'] == '2020']
+owid_df = owid_covid[owid_covid['period'] == str(COMPARE)]
 owid_df.rename(columns={'period':'year'}, inplace=True)
 
 ### Merge to owid_country and add total cases per population
-owid_df = owid_df.merge(owid_country, how = 'inner', on = 'iso_code')
+owid_country = countries.attach_country_id(owid_country, 'iso_code',
+                                           country_dim)
+owid_df = countries.attach_country_id(owid_df, 'iso_code', country_dim)
+owid_df = owid_df.merge(owid_country.drop(columns = 'iso_code'),
+                        how = 'inner', on = 'country_id')
 owid_df['cases_per_pop_percent'] = (owid_df['total_cases'] /
                                     owid_df['population'] * 100)
 
 ## 3. WTO export
 wto_export_pivot = wto_export.pivot(['ReporterISO3A', 'Reporter'],
                                     'Year', 'Value').reset_index()
-wto_export_pivot['growth'] = ((wto_export_pivot[2020] /
-                              wto_export_pivot[2019] - 1) * 100)
+wto_export_pivot['growth'] = ((wto_export_pivot[COMPARE] /
+                              wto_export_pivot[BASE] - 1) * 100)
 
-## 4. IMF calculate growth and drop 2019
-imf_ex_im['growth'] = (imf_ex_im['2020'] / imf_ex_im['2019'] - 1) * 100
+## 4. IMF calculate growth
+imf_ex_im['growth'] = (imf_ex_im[str(COMPARE)] / imf_ex_im[str(BASE)] - 1) * 100
 
 
 ############## Plotly Graph #####################
 # Part 1
-q1_df = wto_export_pivot[wto_export_pivot[2019] > 20000]
-q1_df.columns = ['country_code', 'country_name', 'export_2019',
-                 'export_2020', 'growth']
+q1_df = wto_export_pivot[wto_export_pivot[BASE] > 20000]
+q1_df.columns = ['country_code', 'country_name', EXPORT_BASE,
+                 EXPORT_COMPARE, 'growth']
 q1_winner_df = (q1_df.dropna()
                 .sort_values('growth', ascending=False).head(14))
 q1_winner_bar = px_hbar(df=q1_winner_df, x='growth',
@@ -317,13 +417,20 @@ q1_loser_bar = px_hbar(df=q1_loser_df, x='growth',
                         range_x=[-100,5], labels=labels,
                         title_text="Top Loser Countries")
 
-q1_comm_df = (un_comtrade_pivot.groupby(['comm_code', 'comm_desc'])
-              .agg('sum').reset_index())
-q1_comm_df = q1_comm_df[['comm_code', 'comm_desc',
-                         'export_2019', 'export_2020']]
+# Commodities of config.HS_LEVEL digits when the partitioned flows are
+# stored, HS2 chapters from the trade store or the UN Comtrade extract
+# otherwise
+if comtrade.stored_levels():
+    q1_comm_df = comtrade.commodity_totals([BASE, COMPARE], config.HS_LEVEL)
+elif trade_db is not None:
+    q1_comm_df = trade_store.commodity_totals(trade_db, [BASE, COMPARE])
+else:
+    q1_comm_df = (un_comtrade.groupby(['comm_code', 'comm_desc', 'year'])
+                  ['trade_val'].sum().unstack('year')
+                  .add_prefix('export_').reset_index())
 q1_comm_df['comm_code'] = q1_comm_df['comm_code'].map(str)
-q1_comm_df['growth'] = ((q1_comm_df['export_2020'] /
-                         q1_comm_df['export_2019'] - 1) * 100)
+q1_comm_df['growth'] = ((q1_comm_df[EXPORT_COMPARE] /
+                         q1_comm_df[EXPORT_BASE] - 1) * 100)
 q1_comm_winner_df = (q1_comm_df.dropna()
                      .sort_values('growth', ascending=False)
                      .head(20))
@@ -344,15 +451,17 @@ q1_comm_loser_bar = px_hbar(df=q1_comm_loser_df, x='growth',
 
 
 # Part 2
-q2_scat1_df = wto_export_pivot.merge(owid_df, how='inner',
-                                     left_on='ReporterISO3A',
-                                     right_on='iso_code')
+wto_export_ids = countries.attach_country_id(wto_export_pivot,
+                                             'ReporterISO3A', country_dim,
+                                             drop = False)
+q2_scat1_df = wto_export_ids.merge(owid_df, how='inner', on='country_id')
 q2_scat1_df = q2_scat1_df.loc[:, ~q2_scat1_df.columns.isin(['iso_code', 
+                                                           'country_id',
                                                            'year',
                                                            'new_cases',
                                                            'location'])]
-q2_scat1_df.columns = ['country_code', 'country_name', 'export_2019',
-                       'export_2020', 'growth', 'total_cases',
+q2_scat1_df.columns = ['country_code', 'country_name', EXPORT_BASE,
+                       EXPORT_COMPARE, 'growth', 'total_cases',
                        'stringency_index', 'continent', 'population',
                        'cases_per_pop_percent']
 q2_scat1_df = q2_scat1_df.dropna()
@@ -363,7 +472,7 @@ q2_scat1 = px_scatter(
     y="growth",
     color="continent",
     hover_name="country_name",
-    size='export_2019',
+    size=EXPORT_BASE,
     labels=labels,
     title_text=
         'Relationship between the cases per population to The Export Growth')
@@ -374,28 +483,28 @@ q2_scat2 = px_scatter(
     y="growth",
     color="continent",
     hover_name="country_name",
-    size='export_2019',
+    size=EXPORT_BASE,
     labels=labels,
     title_text=
         'Relationship between the Stringency Index to the Export Growth')
 
 ## Commodities Scatterplot
-q2_scat2_df = un_comtrade_pivot.merge(owid_df, how = 'inner',
-                                     left_on = 'reporter_iso',
-                                     right_on = 'iso_code')
-q2_scat2_df['weighted_stringent'] = (q2_scat2_df['export_2019'] *
+q2_scat2_df = countries.attach_country_id(un_comtrade_pivot, 'reporter_iso',
+                                         country_dim, drop = False)
+q2_scat2_df = q2_scat2_df.merge(owid_df, how = 'inner', on = 'country_id')
+q2_scat2_df['weighted_stringent'] = (q2_scat2_df[EXPORT_BASE] *
                                      q2_scat2_df['stringency_index'])
 q2_scat2_df = q2_scat2_df.loc[:,
                               q2_scat2_df.columns.isin(['comm_desc',
-                                                        'export_2019',
-                                                        'export_2020',
+                                                        EXPORT_BASE,
+                                                        EXPORT_COMPARE,
                                                         'weighted_stringent'])
                              ]
 q2_scat2_df = q2_scat2_df.groupby('comm_desc').agg('sum').reset_index()
-q2_scat2_df['growth'] = ((q2_scat2_df['export_2020'] /
-                          q2_scat2_df['export_2019'] - 1) * 100)
+q2_scat2_df['growth'] = ((q2_scat2_df[EXPORT_COMPARE] /
+                          q2_scat2_df[EXPORT_BASE] - 1) * 100)
 q2_scat2_df['weighted_stringent'] = (q2_scat2_df['weighted_stringent'] /
-                                     q2_scat2_df['export_2019'])
+                                     q2_scat2_df[EXPORT_BASE])
 
 q2_scat3 = px_scatter(
     q2_scat2_df,
@@ -403,20 +512,18 @@ q2_scat3 = px_scatter(
     y="growth",
     color="comm_desc",
     hover_name="comm_desc",
-    size='export_2019',
+    size=EXPORT_BASE,
     labels=labels,
     title_text='The Government Stringency Index to Commodities'
 )
 
 ## Regression
-wb_econ_2020 = wb_econ[wb_econ["time"] == 2020]
-
-q2_reg_df = wto_export_pivot.merge(wb_econ_2020, how='inner',
-                            left_on='ReporterISO3A',
-                            right_on='country_code')
-q2_reg_df = q2_reg_df.merge(owid_df, how='left',
-                            left_on=['ReporterISO3A'],
-                            right_on=['iso_code'])
+wb_econ_compare = countries.attach_country_id(
+    wb_econ[wb_econ["time"] == COMPARE], 'country_code', country_dim)
+
+q2_reg_df = wto_export_ids.merge(wb_econ_compare, how='inner',
+                                 on='country_id')
+q2_reg_df = q2_reg_df.merge(owid_df, how='left', on='country_id')
 q2_reg_df = q2_reg_df.dropna()
 
 ### Filter Outlier
@@ -437,39 +544,47 @@ summary_table_html = summary.tables[1].as_html()
 
 # Part 3
 ## IMF whole world
-imf_undirect = undirected_export(imf_ex_im, 3 ,5)
-imf_undirect  = imf_undirect[['country_1', 'country_2', '2019', '2020']]
-imf_und_filter = imf_undirect[imf_undirect['2019'] > 5000]
+imf_undirect = undirected_export(imf_ex_im[['from_code', 'to_code',
+                                            str(BASE), str(COMPARE)]],
+                                 'from_code', 'to_code')
+imf_undirect  = imf_undirect[['country_1', 'country_2', str(BASE), 
+                              str(COMPARE)]]
+imf_und_filter = imf_undirect[imf_undirect[str(BASE)] > IMF_EDGE_THRESHOLD]
 
-create_network(imf_und_filter,'2020', 0, 1, 3, 2,
-               'proj_cappmait/product/assets/imf_2020.html')
+create_network(imf_und_filter, str(COMPARE), 0, 1, 3, 2,
+               'proj_cappmait/product/assets/' + NETWORK_PAGE['imf'],
+               continents)
 
 ## UN Export
-un_undirect = undirected_export(un_comtrade_pivot, 0, 1)
-un_undirect.columns = ['year', 'relation', 'export_2019',
-                       'export_2020', 'country_1', 'country_2']
+un_undirect = undirected_export(un_comtrade_pivot, 'reporter_iso',
+                                'partner_iso')
+un_undirect.columns = ['year', 'relation', EXPORT_BASE,
+                       EXPORT_COMPARE, 'country_1', 'country_2']
 
-create_network(un_undirect,'export_2020', 4, 5, 3, 2,
-               'proj_cappmait/product/assets/un_2020.html')
+create_network(un_undirect, EXPORT_COMPARE, 4, 5, 3, 2,
+               'proj_cappmait/product/assets/' + NETWORK_PAGE['un'],
+               continents)
 
 ## Example Some Product
 ### Pharmaceutical Products
 un_pharma = un_comtrade_pivot[un_comtrade_pivot['comm_code'] == 30]
-un_pharma = undirected_export(un_pharma, 0, 1)
-un_pharma.columns = ['year', 'relation', 'export_2019',
-                     'export_2020', 'country_1', 'country_2']
+un_pharma = undirected_export(un_pharma, 'reporter_iso', 'partner_iso')
+un_pharma.columns = ['year', 'relation', EXPORT_BASE,
+                     EXPORT_COMPARE, 'country_1', 'country_2']
 
-create_network(un_pharma,'export_2020', 4, 5, 3, 2,
-               'proj_cappmait/product/assets/un_pharma_2020.html')
+create_network(un_pharma, EXPORT_COMPARE, 4, 5, 3, 2,
+               'proj_cappmait/product/assets/' + NETWORK_PAGE['un_pharma'],
+               continents)
 
 ### Vehicle
 un_vehicle = un_comtrade_pivot[un_comtrade_pivot['comm_code'] == 87]
-un_vehicle = undirected_export(un_vehicle, 0, 1)
-un_vehicle.columns = ['year', 'relation', 'export_2019',
-                      'export_2020', 'country_1', 'country_2']
+un_vehicle = undirected_export(un_vehicle, 'reporter_iso', 'partner_iso')
+un_vehicle.columns = ['year', 'relation', EXPORT_BASE,
+                      EXPORT_COMPARE, 'country_1', 'country_2']
 
-create_network(un_vehicle,'export_2020', 4, 5, 3, 2,
-               'proj_cappmait/product/assets/un_vehicle_2020.html')
+create_network(un_vehicle, EXPORT_COMPARE, 4, 5, 3, 2,
+               'proj_cappmait/product/assets/' + NETWORK_PAGE['un_vehicle'],
+               continents)
 
 ## Centrality
 imf_net = nx.from_pandas_edgelist(imf_undirect, 'country_1', 'country_2')
@@ -677,48 +792,107 @@ FOOTER = "\n Analysed by CAPPMAIT, part of the project in CAPP 30122"
 ############### Dash Report ########################
 app = Dash(__name__)
 
+# The figures are serialized once. The page only has placeholders, and each
+# figure and network is fetched when its section is scrolled into view
+# (assets/lazy.js), so the first paint only needs the text.
+FIGURES = {'winner_coun': q1_winner_bar, 'loser_coun': q1_loser_bar,
+           'winner_comm': q1_comm_winner_bar,
+           'loser_comm': q1_comm_loser_bar,
+           'scatter_1': q2_scat1, 'scatter_2': q2_scat2,
+           'scatter_3': q2_scat3,
+           'cen_deg': deg_hbar, 'between': bet_hbar, 'triangle': rec_hbar}
+FIGURE_JSON = {graph_id: fig.to_json() for graph_id, fig in FIGURES.items()}
+PLOTLY_JS = plotly.offline.get_plotlyjs()
+LAZY_GRAPH = 'lazy-graph'
+# The urls of the figures and of plotly.js change with their content, so 
+# browsers keep them (helper/static_assets.py)
+FINGERPRINT = hashlib.sha1(
+    (PLOTLY_JS + ''.join(FIGURE_JSON.values())).encode()).hexdigest()[:12]
+static_assets.add_static_cache(app, prefixes=['/figures/'])
+
+@app.server.route('/figures/<fingerprint>/<graph_id>.json')
+def figure_json(fingerprint, graph_id):
+    '''
+    Send the serialized figure of a graph
+    '''
+    if fingerprint != FINGERPRINT or graph_id not in FIGURE_JSON:
+        abort(404)
+    return Response(FIGURE_JSON[graph_id], mimetype='application/json')
+
+@app.server.route('/figures/<fingerprint>/plotly.min.js')
+def plotly_js(fingerprint):
+    '''
+    Send plotly.js, loaded with the first figure shown
+    '''
+    if fingerprint != FINGERPRINT:
+        abort(404)
+    return Response(PLOTLY_JS, mimetype='application/javascript')
+
+def lazy_graph(graph_id):
+    '''
+    Create a placeholder of a figure, drawn when it is scrolled into view
+    Inputs:
+        graph_id (str): the key of the figure in FIGURES
+    Return:
+        (Div): the placeholder, as high as the figure
+    '''
+    return html.Div(id=graph_id, className=LAZY_GRAPH,
+                    style={'height': FIGURES[graph_id].layout.height},
+                    **{'data-src': app.get_relative_path(
+                           f'/figures/{FINGERPRINT}/{graph_id}.json'),
+                       'data-plotly': app.get_relative_path(
+                           f'/figures/{FINGERPRINT}/plotly.min.js')})
+
+def lazy_iframe(asset, title=None):
+    '''
+    Create an iframe of a network page, loaded when it is scrolled into view
+    Inputs:
+        asset (str): the file name of the page in the assets folder
+        title (str): the title of the iframe
+    Return:
+        (Iframe): the iframe
+    '''
+    return html.Iframe(style={"height": "600px", "width": "1200px"},
+                       title=title,
+                       **{'data-src': app.get_asset_url(asset)})
+
 app.layout = html.Div([
     html.H1(TITLE),
     html.P(INTRODUCTION),
     html.H2(TOPIC1),
     html.P(CONTENT1_1),
-    dcc.Graph(id='winner_coun', figure=q1_winner_bar),
-    dcc.Graph(id='loser_coun', figure=q1_loser_bar),
+    lazy_graph('winner_coun'),
+    lazy_graph('loser_coun'),
     html.P(CONTENT1_2),
-    dcc.Graph(id='winner_comm', figure=q1_comm_winner_bar),
-    dcc.Graph(id='loser_comm', figure=q1_comm_loser_bar),
+    lazy_graph('winner_comm'),
+    lazy_graph('loser_comm'),
     html.H2(TOPIC2),
     html.P(CONTENT2_1),
-    dcc.Graph(id='scatter_1', figure=q2_scat1),
+    lazy_graph('scatter_1'),
     html.P(CONTENT2_2),
-    dcc.Graph(id='scatter_2', figure=q2_scat2),
+    lazy_graph('scatter_2'),
     html.P(CONTENT2_3),
-    dcc.Graph(id='scatter_3', figure=q2_scat3),
+    lazy_graph('scatter_3'),
     html.P(CONTENT2_4),
     html.H2(TOPIC3),
     html.P(CONTENT3_1),
     html.H3("Global Trading Network"),
-    html.Iframe(src=app.get_asset_url("imf_2020.html"),
-                style={"height": "600px", "width": "1200px"},
-                title="Global Trading Network"),
+    lazy_iframe(NETWORK_PAGE["imf"], title="Global Trading Network"),
     html.P(CONTENT3_2),
     html.H3("Top 30 Exporters Trading Network"),
-    html.Iframe(src=app.get_asset_url("un_2020.html"),
-                style={"height": "600px", "width": "1200px"}),
+    lazy_iframe(NETWORK_PAGE["un"]),
     html.P(CONTENT3_3),
     html.H3("Pharmaceutical Trading Network"),
-    html.Iframe(src=app.get_asset_url("un_pharma_2020.html"),
-                style={"height": "600px", "width": "1200px"}),
+    lazy_iframe(NETWORK_PAGE["un_pharma"]),
     html.H3("Vehicle Trading Network"),
-    html.Iframe(src=app.get_asset_url("un_vehicle_2020.html"),
-                style={"height": "600px", "width": "1200px"}),
+    lazy_iframe(NETWORK_PAGE["un_vehicle"]),
     html.H3(SUBTOPIC3_1),
     html.P(CONTENT3_1_1),
-    dcc.Graph(id='cen_deg', figure=deg_hbar),
+    lazy_graph('cen_deg'),
     html.P(CONTENT3_1_2),
-    dcc.Graph(id="between", figure=bet_hbar),
+    lazy_graph('between'),
     html.P(CONTENT3_1_3),
-    dcc.Graph(id="triangle" ,figure=rec_hbar),
+    lazy_graph('triangle'),
     html.Footer(FOOTER)
     ],
     style={'marginLeft': 100, 'marginRight': 100, 'marginTop': 50, 
@@ -0,0 +1,71 @@
+/*
+ * Lazy sections of the analysis report (product/analysis.py).
+ *
+ * The figures and the networks are placeholders with a data-src attribute:
+ * the url of the figure JSON ("#id" for a figure embedded in the page) or
+ * of the network page. Each one is loaded when it gets close to the screen,
+ * and plotly.js (data-plotly) is loaded with the first figure.
+ */
+(function() {
+    var plotly = null;
+
+    function loadPlotly(src) {
+        if (window.Plotly) {
+            return Promise.resolve(window.Plotly);
+        }
+        if (!plotly) {
+            plotly = new Promise(function(resolve, reject) {
+                var script = document.createElement("script");
+                script.src = src;
+                script.onload = function() { resolve(window.Plotly); };
+                script.onerror = reject;
+                document.head.appendChild(script);
+            });
+        }
+        return plotly;
+    }
+
+    function loadFigure(src) {
+        if (src.charAt(0) === "#") {
+            var data = document.getElementById(src.slice(1));
+            return Promise.resolve(JSON.parse(data.textContent));
+        }
+        return fetch(src).then(function(resp) { return resp.json(); });
+    }
+
+    function show(element) {
+        var src = element.getAttribute("data-src");
+        if (element.tagName === "IFRAME") {
+            element.src = src;
+            return;
+        }
+        Promise.all([loadPlotly(element.getAttribute("data-plotly")),
+                     loadFigure(src)]).then(function(loaded) {
+            var figure = loaded[1];
+            loaded[0].newPlot(element, figure.data, figure.layout,
+                              figure.config || {});
+        });
+    }
+
+    var observer = new IntersectionObserver(function(entries) {
+        entries.forEach(function(entry) {
+            if (entry.isIntersecting) {
+                observer.unobserve(entry.target);
+                show(entry.target);
+            }
+        });
+    }, {rootMargin: "200px"});
+
+    // Dash renders the layout after the page is loaded
+    function watch() {
+        document.querySelectorAll("[data-src]:not([data-watched])")
+            .forEach(function(element) {
+                element.setAttribute("data-watched", "");
+                observer.observe(element);
+            });
+    }
+
+    new MutationObserver(watch).observe(document.documentElement,
+                                        {childList: true, subtree: true});
+    watch();
+})();
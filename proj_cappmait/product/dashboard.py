@@ -1,41 +1,174 @@
 '''
 Module for interactive dashboard.
 '''
-import pandas as pd
+import copy
+import os
+from contextlib import closing
 import numpy as np
-import plotly.express as px
 import plotly.graph_objects as go
-from dash import html, dcc
+from dash import Dash, Patch, ctx, html, dcc, Input, Output, State
 from dash.exceptions import PreventUpdate
-from dash_extensions.enrich import DashProxy, MultiplexerTransform, Input, Output
 import dash_cytoscape as cyto
+from flask_caching import Cache
+from proj_cappmait import config
+from proj_cappmait.getdata import integrity
 from proj_cappmait.helper import network_analysis as net
+from proj_cappmait.helper import (shared_data, singleflight, static_assets, 
+                                  storage, trade_cube, trade_store)
 
-app = DashProxy(transforms=[MultiplexerTransform()],
-                prevent_initial_callbacks=True)
+BASE = str(config.BASE_YEAR)
+COMPARE = str(config.COMPARE_YEAR)
+
+# trade.css is in proj_cappmait/assets, whatever the main module is
+app = Dash(prevent_initial_callbacks=True, 
+           assets_folder=os.path.join(os.path.dirname(os.path.dirname(
+               os.path.abspath(__file__))), "assets"))
+# The bundles, assets and map outlines are served by the app with long-lived
+# cache headers and compressed (helper/static_assets.py)
+static_assets.add_static_cache(app)
 
 # Load Data
-product = pd.read_csv(
-    "proj_cappmait/data/merchandise_values_annual_dataset.csv",
-     dtype={"Value":"int", "Year":"category"})
-country_code = pd.read_csv(
-    "proj_cappmait/data/countries_codes_and_coordinates_cleaned.csv")
-covid_data = pd.read_csv('proj_cappmait/data/owid_covid_data_cleaned.csv')
+def load_product():
+    '''
+    Load the WTO product data of the compared years
+    '''
+    product = storage.read_clean("merchandise_values_annual_dataset")
+    return product[product["Year"].isin([config.BASE_YEAR, 
+                                         config.COMPARE_YEAR])
+                   ].astype({"Year": "str"}).reset_index(drop=True)
+
+def load_covid():
+    '''
+    Load the covid data of every resolution, sorted by resolution
+    '''
+    if storage.has_clean("owid_covid_pyramid"):
+        covid_data = storage.read_clean("owid_covid_pyramid", 
+                                        categorical=False)
+    else:
+        # Quarters and years of the selected years only
+        covid_data = storage.read_clean("owid_covid_data_cleaned", 
+                                        categorical=False)
+        covid_data.insert(2, "resolution", np.where(
+            covid_data["period"].str.contains("Q"), "quarter", "year"))
+    return covid_data.sort_values("resolution", kind="stable", 
+                                  ignore_index=True)
+
+# The tables are shared by the dashboard processes (helper/shared_data.py):
+# their columns are read-only memory maps, and string columns are categories
+product = shared_data.shared_table("product", load_product, 
+    shared_data.clean_sources("merchandise_values_annual_dataset"))
+country_code = shared_data.shared_table("country_code", 
+    lambda: storage.read_clean("countries_codes_and_coordinates_cleaned"), 
+    shared_data.clean_sources("countries_codes_and_coordinates_cleaned"))
+covid_data = shared_data.shared_table("covid_data", load_covid, 
+    shared_data.clean_sources("owid_covid_pyramid") + 
+    shared_data.clean_sources("owid_covid_data_cleaned"))
+# One small table per resolution (a slice of the shared table), and its 
+# periods in order
+covid_tables = {resolution: covid_data.iloc[rows[0]:rows[-1] + 1] 
+                for resolution, rows 
+                in covid_data.groupby("resolution", observed=True)
+                .indices.items()}
+covid_periods = {resolution: sorted(table["period"].unique()) 
+                 for resolution, table in covid_tables.items()}
+RESOLUTIONS = [resolution for resolution in ["month", "quarter", "year"] 
+               if resolution in covid_tables]
+# Months of the network slider: the months of the monthly IMF data that 
+# have the same month of the year before. Position 0 compares the years.
+network_cube = trade_cube.shared_cube()
+if network_cube is not None and storage.has_clean("pagerank_periods"):
+    NETWORK_PERIODS = [None] + network_cube[0][trade_cube.PER_YEAR["month"]:]
+else:
+    NETWORK_PERIODS = [None]
+# Continent of each country, for the overview of the network
+CONTINENTS = net.load_continents()
+# Smallest trade volume (USD million) of the edges at each position of the 
+# network threshold slider, and the largest number of partners per country
+EDGE_THRESHOLDS = [0, 10, 100, 1000, 5000, 10000, 50000]
+MAX_PARTNERS = 5
+
+# Identical calls of the figure builders below are computed once, and their
+# results kept in memory and in the cache shared by the processes 
+# (helper/singleflight.py). The cache keys include the version of the clean 
+# data manifest, the years and the version of the data files (continents 
+# included), so a data refresh or other years invalidate them.
+DATA_VERSION = "{}-{}-{}-{}".format(
+    integrity.load_manifest()["version"] or "local", BASE, COMPARE,
+    shared_data.version(
+        [path for name in ["merchandise_values_annual_dataset", 
+                           "countries_codes_and_coordinates_cleaned", 
+                           "owid_covid_pyramid", "owid_covid_data_cleaned", 
+                           "imf_import_export_cleaned", "country_dim", 
+                           "pagerank", "pagerank_periods", 
+                           "owid_country_info"] 
+         for path in shared_data.clean_sources(name)] + 
+        [storage.DATA_PATH + trade_cube.CUBE_NAME]))
+
+def cache_config():
+    '''
+    Settings of the cache shared by the processes: Redis if
+    config.REDIS_URL is set, otherwise files in config.CACHE_PATH
+    Outputs:
+        (dict): Flask-Caching settings
+    '''
+    if config.REDIS_URL:
+        return {"CACHE_TYPE": "RedisCache", 
+                "CACHE_REDIS_URL": config.REDIS_URL,
+                # Entries of older data versions expire
+                "CACHE_DEFAULT_TIMEOUT": 7 * 24 * 3600}
+    # The oldest files are removed past the threshold
+    return {"CACHE_TYPE": "FileSystemCache", 
+            "CACHE_DIR": config.CACHE_PATH,
+            "CACHE_THRESHOLD": 2000,
+            "CACHE_DEFAULT_TIMEOUT": 0}
+
+cache = Cache(app.server, config=cache_config())
+flights = singleflight.SingleFlight(config.MEMO_SIZE, cache, DATA_VERSION)
+
+def slider_marks(resolution, labels = 12):
+    '''
+    Build the time slider marks of a resolution
+    Inputs:
+        resolution(str): month, quarter or year
+        labels(int): the maximum number of labelled marks
+    Outputs:
+        marks(dict): period label for each slider position
+    '''
+    periods = covid_periods[resolution]
+    every = -(-len(periods) // labels)
+    return {i: period if i % every == 0 else '' 
+            for i, period in enumerate(periods)}
+
+def default_period(resolution):
+    '''
+    Slider position shown first: the first period of the compared year
+    Inputs:
+        resolution(str): month, quarter or year
+    Outputs:
+        (int): the slider position
+    '''
+    periods = covid_periods[resolution]
+    return next((i for i, period in enumerate(periods) 
+                 if period.startswith(COMPARE)), 0)
 
 # Functions for drawing graphs
-def plot_world_map(time_selected, val_selected):
+@flights
+def plot_world_map(time_selected, val_selected, resolution = "quarter"):
     '''
     Plot worldwide covid cases situation
     Inputs:
-        time_selected(str): the quarter selected by user
+        time_selected(int): the slider position of the period selected by user
         val_selected(str): the data type selected by user
+        resolution(str): month, quarter or year
     Outputs:
         fig: the world map graph
     '''
-    dic = {1:'2020Q1', 2:'2020Q2', 3:'2020Q3', 4:'2020Q4'}
-    dff = covid_data[covid_data.period == dic.get(time_selected)]
-    dff['hover_text'] = dff['Country_name'] + ": " + \
-                        dff[val_selected].apply(str)
+    periods = covid_periods[resolution]
+    period = periods[min(time_selected, len(periods) - 1)]
+    table = covid_tables[resolution]
+    dff = table[table.period == period]
+    dff = dff.assign(hover_text = dff['Country_name'].astype(str) + ": " +
+                     dff[val_selected].apply(str))
 
     np.seterr(divide = 'ignore') 
     fig = go.Figure(data = go.Choropleth(
@@ -62,26 +195,74 @@ def plot_world_map(time_selected, val_selected):
     return fig
 
 
-def build_networkelements(is_exporter):
+@flights
+def network_base(period_selected = 0):
+    '''
+    Prepare the network of a period once: the country nodes, the partner 
+    edges of each view sorted for the edge sliders, and the node positions 
+    of each view, computed with the best partner edges so that the nodes 
+    stay in place when the sliders move. 
+    Input:
+        period_selected(int): The network slider position: 0 compares the 
+            years, otherwise a month is compared with the month a year before. 
+    Output:
+        nodes(dict): A country code to its label and pagerank. 
+        views(dict): For the exporter view (True) and the importer view 
+            (False), a tuple of the EdgeIndex, the country positions and 
+            the continent positions (key '' for the overview, otherwise the 
+            expanded continent). 
+    '''
+    graph = net.construct_networkgraph(NETWORK_PERIODS[period_selected])
+    nodes = graph.node_data()
+    views = {}
+    for is_exporter in (True, False):
+        index = graph.edge_index(is_exporter)
+        edges = index.select(1)
+        shown_nodes, shown_edges = net.cluster_network(nodes, edges, 
+                                                       CONTINENTS)
+        centers = net.node_positions([node[0] for node in shown_nodes], 
+                                     shown_edges, scale=400)
+        continent_positions = {'': centers}
+        for expanded in centers:
+            codes = [code for code in nodes 
+                     if CONTINENTS.get(code, net.OTHER) == expanded]
+            continent_positions[expanded] = net.expanded_positions(
+                centers, expanded, codes, edges)
+        views[is_exporter] = (index, net.node_positions(list(nodes), edges), 
+                              continent_positions)
+    return nodes, views
+
+
+@flights
+def build_networkelements(is_exporter, period_selected = 0, top = 1, 
+                          threshold = 0):
     '''
     Build a network elements. Node is each country. Source of edge 
-    is country node, and target is the best trading partner. In the exporter 
+    is country node, and target is a best trading partner. In the exporter 
     view, the country serve as an exporter and export the most to the best 
-    trading partner. In the importer view, the country serve as an importer and
-    import the most from the best trading partner. 
+    trading partners. In the importer view, the country serve as an importer 
+    and import the most from the best trading partners. 
     Input:
         is_exporter(boolean): True if the country node is exporter, and False 
             otherwise. 
+        period_selected(int): The network slider position: 0 compares the 
+            years, otherwise a month is compared with the month a year before. 
+        top(int): The number of best partners of each country. 
+        threshold(float): The smallest trade volume of an edge. 
     Output:
-        elements(list): A list of graph nodes and edges. 
+        elements(list): A list of graph nodes, with their positions for the 
+            preset layout, and edges. 
     '''
-    graph = net.construct_networkgraph()
-    nodes, edges = graph.find_best_partners(1, is_exporter)
+    nodes, views = network_base(period_selected)
+    index, positions, _ = views[is_exporter]
+    edges = index.select(top, threshold)
 
     graph_nodes = [
-        {'data': {'id': node.country_code, 
-                  'label': node.label, 
-                  'pagerank': node.pagerank}} for node in nodes.values()
+        {'data': {'id': code, 
+                  'label': label, 
+                  'pagerank': pagerank},
+         'position': positions[code]} for code, (label, pagerank) 
+        in nodes.items()
     ]
 
     graph_edges = [
@@ -93,6 +274,77 @@ def build_networkelements(is_exporter):
     return graph_nodes + graph_edges
 
 
+@flights
+def build_continentelements(is_exporter, period_selected = 0, top = 1, 
+                            threshold = 0):
+    '''
+    Build the network elements of the overview, where the countries of a 
+    continent are one node and their edges are merged. Tapping a continent 
+    expands it into its countries, so the elements of every expanded 
+    continent are built here and the browser only picks them. 
+    Input:
+        is_exporter(boolean): True if the country node is exporter, and False 
+            otherwise. 
+        period_selected(int): The network slider position. 
+        top(int): The number of best partners of each country. 
+        threshold(float): The smallest trade volume of an edge. 
+    Output:
+        views(dict): The elements of the overview (key ''), and of each 
+            expanded continent (key continent). 
+    '''
+    nodes, views = network_base(period_selected)
+    index, _, continent_positions = views[is_exporter]
+    edges = index.select(top, threshold)
+
+    elements = {}
+    for expanded, positions in continent_positions.items():
+        shown_nodes, shown_edges = net.cluster_network(nodes, edges, 
+                                                       CONTINENTS, 
+                                                       expanded or None)
+        graph_nodes = []
+        for node_id, label, pagerank, continent in shown_nodes:
+            if node_id == continent:
+                # The expanded continent is a box around its countries
+                graph_nodes.append(
+                    {'data': {'id': node_id, 'label': label, 
+                              'pagerank': pagerank, 'cluster': True},
+                     'position': positions[node_id]})
+            else:
+                graph_nodes.append(
+                    {'data': {'id': node_id, 'label': label, 
+                              'pagerank': pagerank, 'parent': continent},
+                     'position': positions[node_id]})
+        graph_edges = [
+            {'data': {'source': source, 
+                      'target': target, 
+                      'weight': weight}} for source, target, weight 
+            in shown_edges
+        ]
+        elements[expanded] = graph_nodes + graph_edges
+    return elements
+
+
+def build_networkviews(period_selected = 0, top = 1, threshold_selected = 0):
+    '''
+    Build the network elements of both views of a period, by country and 
+    by continent, kept in the browser so that switching the view or the 
+    level of detail needs no request. 
+    Input:
+        period_selected(int): The network slider position. 
+        top(int): The number of best partners of each country. 
+        threshold_selected(int): The threshold slider position. 
+    Output:
+        views(dict): The elements of the exporter and the importer view. 
+    '''
+    threshold = EDGE_THRESHOLDS[threshold_selected]
+    return {view: {'countries': build_networkelements(
+                        is_exporter, period_selected, top, threshold),
+                   'continents': build_continentelements(
+                        is_exporter, period_selected, top, threshold)}
+            for view, is_exporter in [('exporter', True), 
+                                      ('importer', False)]}
+
+
 def network_legend():
     '''
     Draw a network map legend since legend is not
@@ -113,8 +365,8 @@ def network_legend():
                 x=[1.14, 1.41, 1.70],
                 y=[1, 1, 1],
                 text=[": PageRank(=centrality) size", 
-                      ": Trade Increased(2019\u21922020)", 
-                      ": Trade Decreased(2019\u21922020)"],
+                      f": Trade Increased({BASE}\u2192{COMPARE})", 
+                      f": Trade Decreased({BASE}\u2192{COMPARE})"],
                 mode="text",
                 textfont=dict(
                     color="#edeff7",
@@ -171,26 +423,66 @@ def network_legend():
     return fig
 
 
-def plot_bar(df, country_name):
+def set_paths(fig, updates):
     '''
-    Create a bar graph object, which represents 
-    trade volume of export/import in 2019/2020. 
+    Set values of a figure given their paths. 
     Inputs:
-        df (Pandas Dataframe): product data for the country
-        country_name(str): the country name
+        fig (dict or Patch): the figure, or a partial update of it
+        updates (dict): path (tuple of keys and indices) to value
+    Outputs:
+        fig: the updated figure
+    '''
+    for path, value in updates.items():
+        target = fig
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = value
+    return fig
+
+
+def full_figure(base, updates):
+    '''
+    Build a complete figure from a figure built once and the updates of a 
+    country. 
+    Inputs:
+        base (dict): the figure built once, not modified
+        updates (dict): path to value
+    Outputs:
+        fig (dict): the figure
+    '''
+    return set_paths(copy.deepcopy(base), updates)
+
+
+# The layouts of the country dashboard are built once. Selecting a country 
+# sends only the trace data, titles and sankey links (country_updates) as 
+# partial updates of the figures shown.
+def bar_figure():
+    '''
+    Create the bar graph, which represents trade volume of 
+    export/import in 2019/2020, without data. 
     Outputs:
-        fig(a bar graph object)
+        fig(dict): the bar graph
     '''
-    fig = px.bar(df[df["ProductCode"] == "TO"], x="Indicator", y="Value", 
-                 color="Year", barmode="group",
-                 color_discrete_map = {
-                    '2019': '#36559c',
-                    '2020': '#b5442d'}
-                 )
+    fig = go.Figure()
+    for year, color in [(BASE, '#36559c'), (COMPARE, '#b5442d')]:
+        fig.add_trace(go.Bar(
+                    x=[],
+                    y=[],
+                    name=year,
+                    legendgroup=year,
+                    offsetgroup=year,
+                    alignmentgroup="True",
+                    marker=dict(color=color),
+                    hovertemplate=
+                        f"Year={year}<br>Indicator=%{{x}}<br>" +
+                        "Value=%{y}<extra></extra>",
+        ))
 
     fig.update_layout(
+                title='',
                 font_color="#e7ecf5",
-                title=f'{country_name}\'s Total Trade Volume before/after Covid',
+                barmode="group",
+                legend=dict(title_text="Year"),
                 xaxis=dict(
                     title= '',
                     titlefont_size=14,
@@ -218,46 +510,59 @@ def plot_bar(df, country_name):
                 bargroupgap=0.1
     )
 
-    return fig
+    return fig.to_dict()
 
 
-def plot_sankey(val_selected, country_name):
+def bar_updates(df, country_name):
     '''
-    Create a sankey graph object, which represents 
-    top10 trade flows of each export/import in 2019/2020. 
+    Data of the bar graph for a country. 
     Inputs:
-        val_selected(str): the country code
+        df (Pandas Dataframe): product data for the country
         country_name(str): the country name
     Outputs:
-        fig(a sankey graph object)
+        updates(dict): path in the bar graph to value
     '''
-    graph = net.construct_networkgraph()
-    nodes, edges = graph.draw_sankey(val_selected)
+    total = df[df["ProductCode"] == "TO"]
+    updates = {("layout", "title", "text"): 
+        f'{country_name}\'s Total Trade Volume before/after Covid'}
+    for i, year in enumerate([BASE, COMPARE]):
+        bars = total[total["Year"] == year]
+        updates["data", i, "x"] = bars["Indicator"].tolist()
+        updates["data", i, "y"] = bars["Value"].tolist()
+    return updates
 
+
+def sankey_figure():
+    '''
+    Create the sankey graph, which represents top10 trade flows of 
+    each export/import in 2019/2020, without nodes and links. 
+    Outputs:
+        fig(dict): the sankey graph
+    '''
     fig = go.Figure(data=[go.Sankey(
                 node = dict(
                     pad = 5,
                     thickness = 5,
                     line = dict(color = "#aab0bf", width = 0.5),
-                    label = nodes,
+                    label = [],
                     color = "#aab0bf"
                 ),
                 link = dict(
-                    source = [source for source, _, _, _ in edges], 
-                    target = [target for _, target, _, _ in edges],
-                    value =  [value for _, _, value, _ in edges],
-                    color = [color for _, _, _, color in edges]
+                    source = [], 
+                    target = [],
+                    value =  [],
+                    color = []
     ))])
 
-    fig.add_annotation(text="2019",
+    fig.add_annotation(text=BASE,
                 xref="paper", yref="paper",
                 x=0.2, y=1.00, showarrow=False)
-    fig.add_annotation(text="2020",
+    fig.add_annotation(text=COMPARE,
                 xref="paper", yref="paper",
                 x=0.75, y=1.00, showarrow=False)
 
     fig.update_layout(
-                title = f'{country_name}\'s Trade Partners before/after Covid',
+                title = '',
                 font_color="#e7ecf5",
                 autosize=False,
                 width=600,
@@ -272,44 +577,53 @@ def plot_sankey(val_selected, country_name):
                 paper_bgcolor= 'rgba(0,0,0,0)',
                 plot_bgcolor='rgba(0,0,0,0)'
     )
-    return fig
+    return fig.to_dict()
 
 
-def plot_dot(df, country_name):
+def sankey_updates(val_selected, country_name):
     '''
-    Create a dot graph object, which represents 
-    total trade (import+export) in top5 product categories. 
+    Nodes and links of the sankey graph for a country. 
     Inputs:
-        df (Pandas Dataframe): product data for the country
+        val_selected(str): the country code
         country_name(str): the country name
     Outputs:
-        fig(a tree graph object)
+        updates(dict): path in the sankey graph to value
     '''
-    df_new = df[df["ProductCode"]!="TO"].pivot(
-        index=["ReporterISO3A", "Reporter", "ProductCode", "Product"], 
-        values="Value", columns=["Indicator", "Year"]).reset_index()
+    graph = net.construct_networkgraph()
+    nodes, edges = graph.draw_sankey(val_selected)
 
-    if len(df_new) > 0:
-        df_new.columns = df_new.columns.map(' '.join).str.strip()
-        df_new["Total 2020"] = (df_new["Import 2020"] + 
-            df_new["Export 2020"])
-        df_new["Total 2019"] = (df_new["Import 2019"] + 
-            df_new["Export 2019"])
-        df_new = df_new.sort_values("Total 2019").tail(5)
-        df_new["Product"] = df_new["Product"].str.replace("equipment", "")
+    return {
+        ("layout", "title", "text"): 
+            f'{country_name}\'s Trade Partners before/after Covid',
+        ("data", 0, "node", "label"): nodes,
+        ("data", 0, "link", "source"): 
+            [source for source, _, _, _ in edges],
+        ("data", 0, "link", "target"): 
+            [target for _, target, _, _ in edges],
+        ("data", 0, "link", "value"): [value for _, _, value, _ in edges],
+        ("data", 0, "link", "color"): [color for _, _, _, color in edges],
+    }
 
-        fig = go.Figure()
 
+def dot_figure():
+    '''
+    Create the dot graph, which represents total trade (import+export) 
+    in top5 product categories, without data. 
+    Outputs:
+        fig(dict): the dot graph
+    '''
+    fig = go.Figure()
+    for year, color in [(BASE, '#36559c'), (COMPARE, '#b5442d')]:
         fig.add_trace(go.Scatter(
-                    x=df_new["Total 2019"],
-                    y=df_new["Product"],
+                    x=[],
+                    y=[],
                     opacity=0.7,
-                    marker=dict(color='#36559c', 
+                    marker=dict(color=color, 
                         size=12, line=dict(color="#aab0bf",width=1)
                     ),
                     mode="markers",
-                    name="2019",
-                    customdata = df_new[["Import 2019", "Export 2019"]],
+                    name=year,
+                    customdata = [],
                     hovertemplate=
                         "<b>%{y}</b><br><br>" +
                         "Import: %{customdata[0]}<br>" +
@@ -317,51 +631,20 @@ def plot_dot(df, country_name):
                         "<extra></extra>",
         ))
 
-        fig.add_trace(go.Scatter(
-                    x=df_new["Total 2020"],
-                    y=df_new["Product"],
-                    opacity=0.7,
-                    marker=dict(color='#b5442d', 
-                        size=12, 
-                        line=dict(color="#aab0bf",width=1)
-                    ),
-                    mode="markers",
-                    name="2020",
-                    customdata = df_new[["Import 2020", "Export 2020"]],
-                    hovertemplate=
-                        "<b>%{y}</b><br><br>" +
-                        "Import: %{customdata[0]}<br>" +
-                        "Export: %{customdata[1]}<br>" +
-                        "<extra></extra>",
-        ))
-
-        fig.update_layout(
-                    xaxis = dict(showgrid=False, showline=True),
-                    xaxis_title="Total volume of import and export",
-                    legend=dict(
-                            orientation="h",
-                            yanchor="bottom",
-                            y=0.98,
-                            xanchor="right",
-                            x=1
-        ))
-
-    # If data is missing, show a message
-    else:
-        fig = go.Figure()
-        fig.update_layout(
-                    xaxis = {"visible": False},
-                    yaxis = {"visible": False},
-                    annotations = [{
-                            "text": "Missing Data",
-                            "xref": "paper",
-                            "yref": "paper",
-                            "showarrow": False,
-                            "font": {"size": 20}}]            
-        )
-
     fig.update_layout(
-                title = f'{country_name}\'s Product Category before/after Covid',
+                xaxis = dict(showgrid=False, showline=True, visible=True),
+                yaxis = dict(visible=True),
+                xaxis_title="Total volume of import and export",
+                annotations = [],
+                showlegend = True,
+                legend=dict(
+                        orientation="h",
+                        yanchor="bottom",
+                        y=0.98,
+                        xanchor="right",
+                        x=1
+                ),
+                title = '',
                 font_color="#e7ecf5",
                 autosize=False,
                 width=600,
@@ -377,28 +660,160 @@ def plot_dot(df, country_name):
                 plot_bgcolor='rgba(0,0,0,0)'
     )
 
-    return fig
+    return fig.to_dict()
 
 
-def update_countrydashboard(val_selected):
+def dot_updates(df, country_name):
+    '''
+    Data of the dot graph for a country, the top5 product categories. 
+    Inputs:
+        df (Pandas Dataframe): product data for the country
+        country_name(str): the country name
+    Outputs:
+        updates(dict): path in the dot graph to value
+    '''
+    df_new = df[df["ProductCode"]!="TO"].pivot(
+        index=["ReporterISO3A", "Reporter", "ProductCode", "Product"], 
+        values="Value", columns=["Indicator", "Year"]).reset_index()
+    updates = {("layout", "title", "text"): 
+        f'{country_name}\'s Product Category before/after Covid'}
+
+    if len(df_new) > 0:
+        df_new.columns = df_new.columns.map(' '.join).str.strip()
+        df_new["Total " + COMPARE] = (df_new["Import " + COMPARE] + 
+            df_new["Export " + COMPARE])
+        df_new["Total " + BASE] = (df_new["Import " + BASE] + 
+            df_new["Export " + BASE])
+        df_new = df_new.sort_values("Total " + BASE).tail(5)
+        df_new["Product"] = df_new["Product"].str.replace("equipment", "")
+
+        for i, year in enumerate([BASE, COMPARE]):
+            updates["data", i, "x"] = df_new["Total " + year].tolist()
+            updates["data", i, "y"] = df_new["Product"].tolist()
+            updates["data", i, "customdata"] = df_new[
+                ["Import " + year, "Export " + year]].values.tolist()
+        missing = False
+
+    # If data is missing, show a message
+    else:
+        for i in range(2):
+            updates["data", i, "x"] = []
+            updates["data", i, "y"] = []
+            updates["data", i, "customdata"] = []
+        missing = True
+
+    updates["layout", "xaxis", "visible"] = not missing
+    updates["layout", "yaxis", "visible"] = not missing
+    updates["layout", "showlegend"] = not missing
+    updates["layout", "annotations"] = [{
+                            "text": "Missing Data",
+                            "xref": "paper",
+                            "yref": "paper",
+                            "showarrow": False,
+                            "font": {"size": 20}}] if missing else []
+    return updates
+
+
+BAR_FIGURE = bar_figure()
+SANKEY_FIGURE = sankey_figure()
+DOT_FIGURE = dot_figure()
+
+
+def plot_bar(df, country_name):
+    '''
+    Create a bar graph object, which represents 
+    trade volume of export/import in 2019/2020. 
+    Inputs:
+        df (Pandas Dataframe): product data for the country
+        country_name(str): the country name
+    Outputs:
+        fig(dict): the bar graph
+    '''
+    return full_figure(BAR_FIGURE, bar_updates(df, country_name))
+
+
+def plot_sankey(val_selected, country_name):
+    '''
+    Create a sankey graph object, which represents 
+    top10 trade flows of each export/import in 2019/2020. 
+    Inputs:
+        val_selected(str): the country code
+        country_name(str): the country name
+    Outputs:
+        fig(dict): the sankey graph
+    '''
+    return full_figure(SANKEY_FIGURE, 
+                       sankey_updates(val_selected, country_name))
+
+
+def plot_dot(df, country_name):
+    '''
+    Create a dot graph object, which represents 
+    total trade (import+export) in top5 product categories. 
+    Inputs:
+        df (Pandas Dataframe): product data for the country
+        country_name(str): the country name
+    Outputs:
+        fig(dict): the dot graph
+    '''
+    return full_figure(DOT_FIGURE, dot_updates(df, country_name))
+
+
+@flights
+def country_updates(val_selected):
     '''
     Update country dashboard(RHS) given the user selected country. 
     Inputs:
         val_selected(str) : The user selected country code
     Outputs:
-        A tuple of graph objects
+        A tuple of the updates (path to value) of the bar, sankey and 
+        dot graphs
     '''
     df = product[product["ReporterISO3A"] == val_selected] 
     country_name = (country_code.loc[country_code["Alpha-3code"] == 
         val_selected, "Country"].item())
 
-    bar_plt = plot_bar(df, country_name)
+    return (bar_updates(df, country_name), 
+            sankey_updates(val_selected, country_name), 
+            dot_updates(df, country_name))
 
-    sankey_plt = plot_sankey(val_selected, country_name)
 
-    dot_plt = plot_dot(df, country_name)
+def top_partners(val_selected, num = 5):
+    '''
+    List the largest export partners of a country in the compared year, 
+    queried from the trade store (helper/trade_store.py). 
+    Inputs:
+        val_selected(str) : The country code
+        num(int) : The number of partners
+    Outputs:
+        text(str): The partners and their exports, empty without the store
+    '''
+    # Opened per query, a connection is not shared by the forked workers
+    conn = trade_store.connect()
+    if conn is None:
+        return ''
+    with closing(conn):
+        partners = trade_store.top_partners(conn, val_selected, 
+                                            config.COMPARE_YEAR, num)
+    if partners.empty:
+        return ''
+    return (f'Largest export partners in {COMPARE} (USD million): ' + 
+            ', '.join(f'{name or code} {value:,.0f}' for code, name, value 
+                      in partners.itertuples(index=False)))
 
-    return (bar_plt, sankey_plt, dot_plt)
+
+def update_countrydashboard(val_selected):
+    '''
+    Build the complete country dashboard(RHS) of a country. 
+    Inputs:
+        val_selected(str) : The country code
+    Outputs:
+        A tuple of the bar, sankey and dot graphs
+    '''
+    bar_plt, sankey_plt, dot_plt = country_updates(val_selected)
+    return (full_figure(BAR_FIGURE, bar_plt), 
+            full_figure(SANKEY_FIGURE, sankey_plt), 
+            full_figure(DOT_FIGURE, dot_plt))
 
 # Style for network graph
 network_stylesheet = [
@@ -418,10 +833,32 @@ network_stylesheet = [
         "style": {
             "line-color": "mapData(weight, -0.01, 0.01, red, blue)"
     }
+    },
+    {
+        "selector": "node[?cluster]",
+        "style": {
+            "width": "mapData(pagerank, 0, 0.5, 40, 150)",
+            "height": "mapData(pagerank, 0, 0.5, 40, 150)",
+            "content": "data(label)",
+            "font-size": "20px",
+            "background-color": "#6c7a96",
+        }
+    },
+    {
+        "selector": ":parent",
+        "style": {
+            "background-opacity": 0.1,
+            "text-valign": "top",
+        }
     }
 ]
 
 
+# The map outlines of the covid map are served by the app instead of the 
+# plotly CDN
+TOPOJSON_URL = static_assets.add_topojson(app, static_assets.topojson_names(
+    [plot_world_map(default_period('quarter'), 'total_cases_per_million')]))
+
 # Define Layout (dash components inside)
 app.layout = html.Div(
     id="root",
@@ -466,8 +903,18 @@ app.layout = html.Div(
                                         'value': 'total_deaths_per_million'
                                     }]
                         ),
+                        dcc.RadioItems(id='resolution-selected', 
+                                value='quarter',
+                                options = [
+                                    {'label': resolution.capitalize(), 
+                                        'value': resolution
+                                    } for resolution in RESOLUTIONS],
+                                inline=True
+                        ),
                         dcc.Graph(id="covid-map", 
-                                figure=plot_world_map(1, 
+                                config={'topojsonURL': TOPOJSON_URL},
+                                figure=plot_world_map(
+                                    default_period('quarter'), 
                                     'total_cases_per_million'
                                 ) 
                         )
@@ -480,13 +927,10 @@ app.layout = html.Div(
                         ),
                         dcc.Slider(id = 'time-slider',
                                 step=None,
-                                marks = {
-                                    1: '2020Q1',
-                                    2: '2020Q2',
-                                    3: '2020Q3',
-                                    4: '2020Q4',
-                                },
-                                value = 1
+                                min = 0,
+                                max = len(covid_periods['quarter']) - 1,
+                                marks = slider_marks('quarter'),
+                                value = default_period('quarter')
                             ),
                     ]),
                     
@@ -507,10 +951,55 @@ app.layout = html.Div(
                                         value=True, 
                                         inline=True
                             ),
+                            dcc.RadioItems(id='network-detail', 
+                                    options=[
+                                            {'label':'Continents (tap to expand)', 
+                                             'value':'continents'},
+                                            {'label':'Countries', 
+                                             'value':'countries'}
+                                        ], 
+                                        value='continents', 
+                                        inline=True
+                            ),
+                            dcc.Store(id='network-expanded'),
+                            html.P(children='Partners per country'),
+                            dcc.Slider(id='network-top',
+                                    min=1,
+                                    max=MAX_PARTNERS,
+                                    step=1,
+                                    marks={i: str(i) for i in 
+                                           range(1, MAX_PARTNERS + 1)},
+                                    value=1
+                            ),
+                            html.P(children='Smallest trade (USD million)'),
+                            dcc.Slider(id='network-threshold',
+                                    step=None,
+                                    min=0,
+                                    max=len(EDGE_THRESHOLDS) - 1,
+                                    marks={i: f'{threshold:,}' for i, 
+                                           threshold in 
+                                           enumerate(EDGE_THRESHOLDS)},
+                                    value=0
+                            ),
+                            dcc.Slider(id='network-period',
+                                    step=None,
+                                    min=0,
+                                    max=len(NETWORK_PERIODS) - 1,
+                                    marks={i: (period or f'{BASE}-{COMPARE}') 
+                                           if i % 3 == 0 else '' 
+                                           for i, period in 
+                                           enumerate(NETWORK_PERIODS)},
+                                    value=0
+                            ),
+                            dcc.Store(id='network-views', 
+                                    data=build_networkviews()
+                            ),
+                            # Elements are set from network-views
                             cyto.Cytoscape(id='network-graph',
-                                    elements=build_networkelements(True),
+                                    elements=[],
                                     style={'width': '100%', 'height': '600px'},
-                                    layout={'name': 'cose','animate': 'end'},
+                                    # Positions are computed on the server
+                                    layout={'name': 'preset'},
                                     stylesheet=network_stylesheet,
                                     autoungrabify=True,
                                     minZoom=0.4,
@@ -546,12 +1035,16 @@ app.layout = html.Div(
                         options=[
                             {'label': name, 
                              'value': code
-                            } for name, _, code, _, _, _ in \
-                                country_code.itertuples(index=False)
+                            } for name, code in \
+                                country_code[["Country", "Alpha-3code"]]
+                                .itertuples(index=False)
                         ],
                         searchable=True,
                         value="USA"
                     ),
+                    html.P(id='top-partners', 
+                        children=top_partners("USA")
+                    ),
                     dcc.Graph(id="barplot", 
                         figure=plot_bar(
                             product[product["ReporterISO3A"] == "USA"], 
@@ -581,95 +1074,138 @@ app.layout = html.Div(
 @app.callback(
     Output("covid-map", "figure"),
     [Input('time-slider', 'value'),
-    Input("data-type-selected", "value")],
+    Input("data-type-selected", "value"),
+    Input("resolution-selected", "value")],
 )
 
-def update_world_map(time_selected, val_selected):
+def update_world_map(time_selected, val_selected, resolution):
     '''
     Update world map given user selected time and data.
     Inputs:
-        time_selected(int): the quarter selected by user
+        time_selected(int): the slider position selected by user
         val_selected(str): the data type selected by user
+        resolution(str): the resolution selected by user
     Output:
         fig: updated world map graph
     '''
-    return plot_world_map(time_selected, val_selected)
+    return plot_world_map(time_selected, val_selected, resolution)
 
 
 @app.callback(
-    Output(component_id="network-graph", component_property="elements"),
-    [Input(component_id="import-or-export", component_property="value")]
+    [Output('time-slider', 'marks'),
+    Output('time-slider', 'max'),
+    Output('time-slider', 'value')],
+    [Input("resolution-selected", "value")],
 )
 
-def update_networkgraph(val_selected):
+def update_time_slider(resolution):
     '''
-    Update network graph given user selected data. 
+    Update the time slider given user selected resolution.
     Inputs:
-        val_selected(boolean): True if exporter view and false if importer view. 
+        resolution(str): the resolution selected by user
     Output:
-        fig: updated network graph
+        marks, max and value of the slider
     '''
-    return build_networkelements(val_selected)
+    return (slider_marks(resolution), len(covid_periods[resolution]) - 1, 
+            default_period(resolution))
+
 
 @app.callback(
-    [Output(component_id="barplot", component_property="figure"),
-    Output(component_id="sankeyplot", component_property="figure"),
-    Output(component_id="dotplot", component_property="figure")],
-    [Input(component_id="slt_country", component_property="value")]
+    Output(component_id="network-views", component_property="data"),
+    [Input(component_id="network-period", component_property="value"),
+    Input(component_id="network-top", component_property="value"),
+    Input(component_id="network-threshold", component_property="value")]
 )
 
-def update_fromdropdown(val_selected):
+def update_networkviews(period_selected, top, threshold_selected):
     '''
-    Update country dashboard give user selected country
-    from dropdown list
-    Input:
-        val_selected(str): The user selected country code
+    Update both views of the network graph given user selected period, 
+    number of partners and smallest trade volume. 
+    Inputs:
+        period_selected(int): The network slider position selected by user
+        top(int): The number of partners selected by user
+        threshold_selected(int): The threshold slider position selected 
+            by user
     Output:
-        figs: updated country dashboard
+        views: the elements of the exporter and the importer view
     '''
-    return update_countrydashboard(val_selected)
+    return build_networkviews(period_selected, top, threshold_selected)
+
+# Switching the view and the level of detail runs in the browser, on the 
+# stored views. Tapping a continent expands it, tapping its box folds it.
+app.clientside_callback(
+    '''
+    function(views, is_exporter, detail, tapped, expanded) {
+        var view = is_exporter ? views.exporter : views.importer;
+        if (detail !== 'continents') {
+            return [view.countries, null];
+        }
+        var triggered = dash_clientside.callback_context.triggered.map(
+            function(trigger) { return trigger.prop_id; });
+        if (triggered.indexOf('network-graph.tapNodeData') >= 0 && 
+                tapped && tapped.cluster) {
+            expanded = tapped.id === expanded ? null : tapped.id;
+        }
+        if (!(expanded in view.continents)) {
+            expanded = null;
+        }
+        return [view.continents[expanded || ''], expanded];
+    }
+    ''',
+    [Output(component_id="network-graph", component_property="elements"),
+    Output(component_id="network-expanded", component_property="data")],
+    [Input(component_id="network-views", component_property="data"),
+    Input(component_id="import-or-export", component_property="value"),
+    Input(component_id="network-detail", component_property="value"),
+    Input(component_id="network-graph", component_property="tapNodeData")],
+    [State(component_id="network-expanded", component_property="data")],
+    prevent_initial_call=False
+)
 
 @app.callback(
     [Output(component_id="barplot", component_property="figure"),
     Output(component_id="sankeyplot", component_property="figure"),
     Output(component_id="dotplot", component_property="figure"),
-    Output(component_id="slt_country", component_property="value")],
-    [Input(component_id="covid-map", component_property="clickData")]
+    Output(component_id="top-partners", component_property="children")],
+    [Input(component_id="slt_country", component_property="value")]
 )
 
-def update_frommap(map_clicked):
+def update_fromdropdown(val_selected):
     '''
-    Update country dashboard and dropdown list selection
-    given user selected country from world map
+    Update country dashboard give user selected country
+    from dropdown list. Only the data and titles of the figures
+    are sent, their layouts stay in the browser.
     Input:
-        map_clicked(dict): The mouse clicked data
+        val_selected(str): The user selected country code
     Output:
-        A tuple of updated country dashboard figs and a dropdown list value
+        figs: partial updates of the country dashboard, and its largest 
+            export partners
     '''
-    if map_clicked:
-        val_selected = map_clicked["points"][0]["location"]
-        return update_countrydashboard(val_selected) + (val_selected,)
-    raise PreventUpdate
+    return [set_paths(Patch(), updates) 
+            for updates in country_updates(val_selected)] + [
+                top_partners(val_selected)]
 
 @app.callback(
-    [Output(component_id="barplot", component_property="figure"),
-    Output(component_id="sankeyplot", component_property="figure"),
-    Output(component_id="dotplot", component_property="figure"),
-    Output(component_id="slt_country", component_property="value")],
-    [Input(component_id="network-graph", component_property="tapNodeData")]
+    Output(component_id="slt_country", component_property="value"),
+    [Input(component_id="covid-map", component_property="clickData"),
+    Input(component_id="network-graph", component_property="tapNodeData")]
 )
 
-def update_fromnode(node_clicked):
+def update_fromclick(map_clicked, node_clicked):
     '''
-    Update country dashboard and dropdown list selection
-    given user selected country from network map
+    Update dropdown list selection given user selected country from 
+    world map or network map. The dropdown list then updates the 
+    country dashboard.
     Input:
-        node_clicked(dict): The mouse clicked data
+        map_clicked(dict): The mouse clicked data of the world map
+        node_clicked(dict): The mouse clicked data of the network map
     Output:
-        A tuple of updated country dashboard figs and a dropdown list value
+        val_selected(str): a dropdown list value
     '''
-    if node_clicked:
-        val_selected = node_clicked["id"]
-        return update_countrydashboard(val_selected) + (val_selected,)
+    if ctx.triggered_id == "covid-map" and map_clicked:
+        return map_clicked["points"][0]["location"]
+    # Continent nodes expand in the browser
+    if (ctx.triggered_id == "network-graph" and node_clicked and 
+        not node_clicked.get("cluster")):
+        return node_clicked["id"]
     raise PreventUpdate
-
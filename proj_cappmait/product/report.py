@@ -0,0 +1,227 @@
+'''
+Module to export the analysis report as a static site.
+
+The page of product/analysis.py is computed once when the module is
+imported, and it does not change per request. build_report renders its
+layout to a folder that any static file server can serve, or a browser can
+open offline:
+
+    index.html          the report, each figure embedded as JSON
+    assets/             plotly.js, lazy.js drawing the figures when they
+                        are scrolled into view, the libraries of the
+                        networks, and the map outlines (topojson) of the
+                        geo figures
+    networks/           the pyvis networks shown in the iframes
+
+plotly.js comes from the plotly package. The other libraries are downloaded
+once (helper/static_assets.py) to config.VENDOR_PATH, and linked to their website
+when they cannot be downloaded.
+'''
+import html as markup
+import json
+import os
+import re
+import shutil
+import plotly.offline
+from plotly.utils import PlotlyJSONEncoder
+from proj_cappmait import config
+from proj_cappmait.helper import static_assets
+from proj_cappmait.product import analysis
+
+# Style properties written without a unit, other numbers are pixels
+UNITLESS = {"line-height", "opacity", "z-index", "font-weight", "flex"}
+# Links of the pyvis pages to the libraries on their website
+REMOTE_LINK = re.compile(r'(src|href)="(https?://[^"]+)"')
+
+
+
+def build_report(folder = config.REPORT_PATH, app = analysis.app):
+    '''
+    Render the analysis report to a static folder
+
+    Inputs:
+        folder (str): the output folder, replaced if it exists
+        app (Dash): the app of the report
+
+    Output:
+        (str): the path of the page
+    '''
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder + "assets")
+    os.makedirs(folder + "networks")
+    with open(folder + "assets/plotly.min.js", "w", encoding="utf-8") as f:
+        f.write(plotly.offline.get_plotlyjs())
+    # The figures and networks are drawn when they are scrolled into view,
+    # as in the app
+    shutil.copy(os.path.join(app.config.assets_folder, "lazy.js"),
+                folder + "assets/lazy.js")
+
+    figures = []
+    body = render(app.layout, app, folder, figures)
+    copied = [copy_vendor(static_assets.TOPOJSON_URL + name,
+                          folder + "assets/topojson/")
+              for name in static_assets.topojson_names(
+                  [figure for _, figure in figures])]
+    plot_config = {"topojsonURL": "assets/topojson/"
+                   if None not in copied else static_assets.TOPOJSON_URL}
+
+    page = ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n' +
+            f'<title>{markup.escape(analysis.TITLE)}</title>\n' +
+            '</head>\n<body>\n' + body + "\n" +
+            "\n".join(figure_data(graph_id, figure, plot_config)
+                      for graph_id, figure in figures) + "\n" +
+            '<script type="text/javascript" src="assets/lazy.js"></script>' +
+            "\n</body>\n</html>\n")
+    with open(folder + "index.html", "w", encoding="utf-8") as f:
+        f.write(page)
+    print(f"Report written to {folder}index.html")
+    return folder + "index.html"
+
+
+def render(component, app, folder, figures):
+    '''
+    Render a Dash component and its children as html
+
+    Inputs:
+        component: a Dash component, a string or a list of them
+        app (Dash): the app, for the urls of its assets
+        folder (str): the output folder, where the iframe pages are copied
+        figures (list): (graph id, figure) of the graphs rendered so far,
+            appended to
+
+    Output:
+        (str): the html
+    '''
+    if component is None:
+        return ""
+    if isinstance(component, (str, int, float)):
+        return markup.escape(str(component))
+    if isinstance(component, (list, tuple)):
+        return "".join(render(child, app, folder, figures)
+                       for child in component)
+
+    attributes = {"id": getattr(component, "id", None),
+                  "class": getattr(component, "className", None),
+                  "title": getattr(component, "title", None),
+                  "style": css(getattr(component, "style", None))}
+    # data-src and the other data attributes (assets/lazy.js)
+    attributes.update({name: value for name, value in vars(component).items()
+                       if name.startswith("data-")})
+    tag = component._type.lower()
+    if tag == "graph" or attributes["class"] == analysis.LAZY_GRAPH:
+        graph_id = component.id or f"graph-{len(figures)}"
+        figures.append((graph_id, component.figure if tag == "graph"
+                        else analysis.FIGURES[graph_id]))
+        attributes.update({"id": graph_id, "class": analysis.LAZY_GRAPH,
+                           "data-src": f"#figure-{graph_id}",
+                           "data-plotly": "assets/plotly.min.js"})
+        tag = "div"
+    elif tag == "iframe":
+        attributes["data-src"] = copy_network(
+            getattr(component, "src", None) or attributes["data-src"],
+            app, folder)
+    children = render(getattr(component, "children", None), app, folder,
+                      figures)
+    return f"<{tag}{html_attributes(attributes)}>{children}</{tag}>\n"
+
+
+def html_attributes(attributes):
+    '''
+    Write the attributes of an html tag, without the missing ones
+    '''
+    return "".join(f' {name}="{markup.escape(str(value))}"'
+                   for name, value in attributes.items()
+                   if value is not None)
+
+
+def css(style):
+    '''
+    Write a Dash style (camelCase properties, numbers in pixels) as css
+
+    Input:
+        style (dict): the style of a component
+
+    Output:
+        (str): the css declarations, None without a style
+    '''
+    if not style:
+        return None
+    declarations = []
+    for name, value in style.items():
+        name = re.sub("([A-Z])", r"-\1", name).lower()
+        if isinstance(value, (int, float)) and name not in UNITLESS:
+            value = f"{value}px"
+        declarations.append(f"{name}: {value}")
+    return "; ".join(declarations)
+
+
+def figure_data(graph_id, figure, plot_config):
+    '''
+    Embed a figure as JSON, drawn by assets/lazy.js
+
+    Inputs:
+        graph_id (str): id of the div of the figure
+        figure (Figure or dict): the figure
+        plot_config (dict): the plotly.js configuration of the figure
+
+    Output:
+        (str): the script tag
+    '''
+    if hasattr(figure, "to_plotly_json"):
+        figure = figure.to_plotly_json()
+    data = json.dumps(dict(figure, config=plot_config), cls=PlotlyJSONEncoder)
+    # A "</" in the data would end the script tag
+    data = data.replace("</", "<\\/")
+    return (f'<script type="application/json" ' +
+            f'id="figure-{markup.escape(graph_id)}">{data}</script>')
+
+
+def copy_network(src, app, folder):
+    '''
+    Copy a network page shown in an iframe, with its libraries linked to
+    the assets folder
+
+    Inputs:
+        src (str): the url of the page in the app
+        app (Dash): the app
+        folder (str): the output folder
+
+    Output:
+        (str): the url of the page in the static report
+    '''
+    name = src[len(app.get_asset_url("")):]
+    with open(os.path.join(app.config.assets_folder, name),
+              encoding="utf-8") as f:
+        page = f.read()
+
+    def local_link(match):
+        local = copy_vendor(match.group(2), folder + "assets/")
+        if local is None:
+            return match.group(0)
+        return f'{match.group(1)}="../assets/{local}"'
+
+    with open(folder + "networks/" + name, "w", encoding="utf-8") as f:
+        f.write(REMOTE_LINK.sub(local_link, page))
+    return "networks/" + name
+
+
+def copy_vendor(url, folder, vendor = config.VENDOR_PATH):
+    '''
+    Copy a library to a folder, downloaded first if it is not in the
+    vendor folder
+
+    Inputs:
+        url (str): the url of the library
+        folder (str): the folder to copy it to
+        vendor (str): the folder of the downloaded libraries
+
+    Output:
+        (str): the file name of the copy, None if it could not be
+            downloaded
+    '''
+    path = static_assets.download(url, vendor)
+    if path is None:
+        return None
+    os.makedirs(folder, exist_ok=True)
+    shutil.copy(path, folder + os.path.basename(path))
+    return os.path.basename(path)
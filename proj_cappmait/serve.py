@@ -0,0 +1,93 @@
+'''
+Module to serve the dashboard and the analysis with gunicorn.
+
+The app module (and so its data) is imported once in the gunicorn master
+before the workers are forked, so the workers share the loaded data
+copy-on-write. A HUP signal to the master reloads the data: the app module
+is imported again in the master, new workers are forked from it and the old
+workers finish their requests before they stop.
+
+    kill -HUP <master pid>
+'''
+import gc
+import importlib
+from gunicorn.app.base import BaseApplication
+from proj_cappmait import config
+from proj_cappmait.helper import static_assets
+from proj_cappmait.helper.health import add_health
+
+
+class TradeServer(BaseApplication):
+    '''
+    Class for a gunicorn server of a Dash app module.
+    '''
+
+    def __init__(self, module_name, options):
+        '''
+        A constructor.
+
+        Inputs:
+            module_name (str): module defining the Dash app as app
+            options (dict): gunicorn settings
+        '''
+        self.module_name = module_name
+        self.options = options
+        self.reloading = False
+        super().__init__()
+
+    def load_config(self):
+        '''
+        Apply the gunicorn settings
+        '''
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        '''
+        Import the app module (again after a reload) and return its
+        Flask server. Called in the master when the app is preloaded.
+        '''
+        module = importlib.import_module(self.module_name)
+        if self.reloading:
+            module = importlib.reload(module)
+            self.reloading = False
+        server = module.app.server
+        add_health(server, self.module_name.rsplit(".", 1)[-1])
+        # Compress the javascript and css files once, before the workers
+        # send them
+        static_assets.precompress(module.app)
+        # Keep the loaded objects out of the garbage collector, so that it
+        # does not write to (and copy) the pages shared with the workers
+        gc.freeze()
+        return server
+
+    def reload(self):
+        '''
+        Reload the settings, and the app module when the master asks for
+        the server again
+        '''
+        super().reload()
+        gc.unfreeze()
+        self.reloading = True
+        self.callable = None
+
+
+def run(module_name, port, workers = None):
+    '''
+    Serve a Dash app with gunicorn
+
+    Inputs:
+        module_name (str): module defining the Dash app as app
+        port (int): port to listen to
+        workers (int): number of worker processes. Default is
+            config.WORKERS
+    '''
+    workers = config.WORKERS if workers is None else workers
+    TradeServer(module_name, {
+        "bind": f"{config.HOST}:{port}",
+        "workers": workers,
+        "preload_app": True,
+        "timeout": 120,
+        "graceful_timeout": 30,
+    }).run()